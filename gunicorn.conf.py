@@ -0,0 +1,31 @@
+# haveyouseenit/gunicorn.conf.py
+# Production serving: gunicorn -c gunicorn.conf.py movie_tracker.wsgi
+#
+# The app is synchronous and spends most of a request waiting on Postgres and the cache, so each
+# worker process runs a few threads (gthread). Every thread keeps its own persistent DB connection
+# (CONN_MAX_AGE), so the pool needs workers * threads connections; keep that under Postgres'
+# max_connections, or put PgBouncer in front (DB_PGBOUNCER=True).
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '9000')}"
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', max(2, multiprocessing.cpu_count())))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Recycle workers now and then so a slow leak can't grow forever; the jitter keeps them from all restarting at once.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+# Not preloaded: the unseen-queue refill threads and DB connections must be created per worker, after the fork.
+preload_app = False
+# The heartbeat file lives in memory; a container's /tmp may be a slow overlay filesystem.
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
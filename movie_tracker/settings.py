@@ -39,7 +39,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tracker.middleware.RequestMetricsMiddleware',
+    'tracker.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    *(['whitenoise.middleware.WhiteNoiseMiddleware'] if os.environ.get('SERVE_STATIC') == 'True' else []),
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -80,8 +83,21 @@ if 'POSTGRES_DB' in os.environ:
             'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
             'HOST': os.environ.get('DB_HOST'),
             'PORT': os.environ.get('DB_PORT'),
+            # Keep connections open between requests (seconds; 0 closes them after each request) and
+            # check them before reuse, so a restarted database costs one reconnect, not an error.
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', 'True') == 'True',
         }
     }
+    # Behind PgBouncer in transaction pooling mode a connection can change server between queries,
+    # so server-side cursors (used by QuerySet.iterator()) must be off.
+    if os.environ.get('DB_PGBOUNCER') == 'True':
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+    # Optional streaming replica for reads (see tracker.routers); tests use the primary for both aliases.
+    if os.environ.get('DB_REPLICA_HOST'):
+        DATABASES['replica'] = {**DATABASES['default'], 'HOST': os.environ['DB_REPLICA_HOST'], 'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']), 'TEST': {'MIRROR': 'default'}}
+    # Registers the trigram lookups used by the person search (the pg_trgm extension itself is enabled by migration 0012).
+    INSTALLED_APPS += ['django.contrib.postgres']
 else:
     DATABASES = {
         'default': {
@@ -89,6 +105,14 @@ else:
             'NAME': BASE_DIR / 'db.sqlite3',
         }
     }
+    # A second SQLite file standing in for a read replica, to try the routing locally (copy db.sqlite3 to it).
+    if os.environ.get('DB_REPLICA_NAME'):
+        DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.environ['DB_REPLICA_NAME'], 'TEST': {'MIRROR': 'default'}}
+
+# Reads go to the 'replica' alias when one is configured; a user who just wrote reads from the
+# primary for REPLICA_PIN_SECONDS (ReplicaRoutingMiddleware).
+DATABASE_ROUTERS = ['tracker.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -107,6 +131,8 @@ USE_TZ = True
 # --- Static Files Configuration for Production ---
 STATIC_URL = '/staticfiles/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+# runserver serves static files itself; under gunicorn set SERVE_STATIC=True to let WhiteNoise serve
+# the collectstatic output (admin styles) from the app processes.
 
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -127,4 +153,90 @@ JAZZMIN_SETTINGS = {
         "brand_theme": "navbar-dark",
         "sidebar_theme": "sidebar-dark-primary",
     }
-}
\ No newline at end of file
+}
+
+# --- Caching ---
+# Local memory by default (one cache per process), which is only safe with a single process. Point
+# REDIS_URL or MEMCACHED_LOCATION at a shared server in production so every worker sees the same
+# fragments, invalidations, unseen queues and rating buffers. CACHE_DIR selects a file-based cache that
+# survives restarts, but it is for a single process too: its add() and incr() are not atomic across
+# processes, so the cache locks, version bumps and hit counters would race between workers.
+if os.environ.get('REDIS_URL'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.environ['REDIS_URL']}} # requires the redis package
+elif os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache', 'LOCATION': os.environ['MEMCACHED_LOCATION']}} # requires pymemcache
+elif os.environ.get('CACHE_DIR'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': os.environ['CACHE_DIR']}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'haveyouseenit'}}
+# With DEBUG off, a per-process cache would lose buffered swipes when a worker recycles and keep
+# invalidations (and removed friends) from reaching the other workers, so `manage.py check --deploy`
+# fails (tracker.E001) unless the cache is Redis or Memcached. ALLOW_LOCAL_CACHE=True accepts a local
+# cache for single-process setups.
+SILENCED_SYSTEM_CHECKS = ['tracker.E001'] if os.environ.get('ALLOW_LOCAL_CACHE') == 'True' else []
+CACHES['default']['KEY_PREFIX'] = 'hysi'
+# Lifetime of cached fragments. Invalidation works by bumping versioned keys, so orphaned fragments just age out after this.
+CACHE_FRAGMENT_TIMEOUT = int(os.environ.get('CACHE_FRAGMENT_TIMEOUT', 3600))
+
+# --- Rating Loop: Per-User Unseen Movie Queue ---
+# Each user keeps a short queue of pre-picked unseen movies in the cache; the rating page pops
+# from it and a background thread tops it up once it drops below the low-water mark.
+# SQLite serialises writers, so the local development fallback refills inline by default.
+UNSEEN_QUEUE_SIZE = 20
+UNSEEN_QUEUE_LOW_WATER = 5
+UNSEEN_QUEUE_REFILL_IN_BACKGROUND = os.environ.get('UNSEEN_QUEUE_REFILL_IN_BACKGROUND', str('POSTGRES_DB' in os.environ)) == 'True'
+
+# --- Rating Loop: Buffered Swipes ---
+# The JSON rating API buffers each user's swipes in the cache and writes them with one bulk insert
+# every RATING_BUFFER_SIZE swipes or RATING_BUFFER_MAX_AGE seconds (run flush_rating_buffers from cron
+# to catch users who stopped swiping). Set RATING_BUFFER_SIZE to 1 to write every swipe through.
+RATING_BUFFER_SIZE = int(os.environ.get('RATING_BUFFER_SIZE', 10))
+RATING_BUFFER_MAX_AGE = int(os.environ.get('RATING_BUFFER_MAX_AGE', 30))
+# Rating writes Profile.last_activity at most once per LAST_ACTIVITY_INTERVAL seconds per user.
+LAST_ACTIVITY_INTERVAL = int(os.environ.get('LAST_ACTIVITY_INTERVAL', 300))
+
+# --- Friends' Activity Feed ---
+# Every rating is copied into each friend's timeline when it is written (fan-out on write), so the
+# feed is one range read however many friends a user has. Timelines keep FRIEND_FEED_LENGTH entries;
+# each user's ratings trim their friends' timelines at most once per FRIEND_FEED_TRIM_INTERVAL seconds.
+FRIEND_FEED_LENGTH = int(os.environ.get('FRIEND_FEED_LENGTH', 100))
+FRIEND_FEED_TRIM_INTERVAL = int(os.environ.get('FRIEND_FEED_TRIM_INTERVAL', 300))
+
+# --- Request Metrics ---
+# RequestMetricsMiddleware times every request. METRICS_SINKS is a comma-separated list of 'log',
+# 'statsd' (UDP to STATSD_HOST:STATSD_PORT), 'prometheus' (scraped from /metrics/) or dotted paths to
+# classes with a record(metrics) method.
+METRICS_SINKS = [sink for sink in os.environ.get('METRICS_SINKS', 'log' if DEBUG else '').split(',') if sink]
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', 'True') == 'True'
+# Bearer token for /metrics/; without one only staff can read it.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+STATSD_HOST = os.environ.get('STATSD_HOST', '127.0.0.1')
+STATSD_PORT = int(os.environ.get('STATSD_PORT', 8125))
+STATSD_PREFIX = os.environ.get('STATSD_PREFIX', 'haveyouseenit')
+# Per-view budgets keyed by URL name ('POST name' for a method of its own); a request over either limit
+# logs a warning on tracker.metrics. They are steady-state budgets, for warm caches. A request that did
+# amortised work (a fragment rebuild, a queue refill, a flush of up to RATING_BUFFER_SIZE buffered
+# swipes) is cold and held to the view's 'cold' budget.
+VIEW_BUDGETS = {
+    'default': {'queries': 20, 'ms': 500},
+    'next_movie': {'queries': 10, 'ms': 150, 'cold': {'queries': 30, 'ms': 500}},
+    # The rating form also writes the rating: the insert, friends' feed entries, seen bitmap and counters.
+    'POST next_movie': {'queries': 16, 'ms': 250, 'cold': {'queries': 32, 'ms': 500}},
+    'my_profile': {'queries': 8, 'ms': 250, 'cold': {'queries': 24, 'ms': 500}},
+    'profile_dashboard': {'queries': 8, 'ms': 250, 'cold': {'queries': 24, 'ms': 500}},
+    'movie_detail': {'queries': 4, 'ms': 100, 'cold': {'queries': 8, 'ms': 250}},
+    'get_seen_movies_page': {'queries': 5, 'ms': 100, 'cold': {'queries': 20, 'ms': 300}},
+    'get_last_rated_page': {'queries': 4, 'ms': 100, 'cold': {'queries': 20, 'ms': 300}},
+    'get_friend_feed_page': {'queries': 3, 'ms': 100},
+    'friend_compatibility': {'queries': 8, 'ms': 50, 'cold': {'queries': 24, 'ms': 300}},
+    'friend_compatibility_ranking': {'queries': 8, 'ms': 100, 'cold': {'queries': 24, 'ms': 300}},
+    'update_rating': {'queries': 10, 'ms': 100, 'cold': {'queries': 26, 'ms': 300}},
+    'rate_movie_api': {'queries': 10, 'ms': 100, 'cold': {'queries': 32, 'ms': 500}},
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'tracker.metrics': {'handlers': ['console'], 'level': 'INFO', 'propagate': False}},
+}
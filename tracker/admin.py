@@ -3,18 +3,17 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-# **MODIFICATION**: Added MovieCastCredit
 from .models import (
-    Profile, Movie, Genre, Actor, Cinematographer,
-    Director, Producer, UserMovieView, InviteCode, Friendship, MovieCastCredit
+    Profile, Movie, Genre, Person, Credit, UserMovieView, InviteCode, Friendship, CrawlState,
+    rebuild_credits_summaries
 )
 
 # --- User and Profile Admin (No changes here) ---
 class ProfileInline(admin.StackedInline):
     model = Profile
     can_delete = False
-    fields = ('date_of_birth', 'join_date', 'last_activity',)
-    readonly_fields = ('join_date', 'last_activity',)
+    fields = ('date_of_birth', 'join_date', 'last_activity', 'total_rated', 'total_seen',)
+    readonly_fields = ('join_date', 'last_activity', 'total_rated', 'total_seen',)
     max_num = 1
     min_num = 1
 
@@ -27,53 +26,42 @@ admin.site.register(User, UserAdmin)
 
 # --- Movie and Person Admin ---
 
-# **NEW CLASS**
-# This defines the inline editor for the cast on the Movie admin page.
-class MovieCastCreditInline(admin.TabularInline):
-    model = MovieCastCredit
-    fields = ('actor', 'order')
-    autocomplete_fields = ('actor',)
-    extra = 1 # Provides one extra slot for adding an actor.
+# This defines the inline editor for the cast and crew on the Movie admin page.
+class CreditInline(admin.TabularInline):
+    model = Credit
+    fields = ('role', 'person', 'order')
+    autocomplete_fields = ('person',)
+    extra = 1 # Provides one extra slot for adding a credit.
 
 
-@admin.register(Actor)
-class ActorAdmin(admin.ModelAdmin):
-    search_fields = ('name',)
-
-@admin.register(Director)
-class DirectorAdmin(admin.ModelAdmin):
-    search_fields = ('name',)
-
-@admin.register(Producer)
-class ProducerAdmin(admin.ModelAdmin):
-    search_fields = ('name',)
-
-@admin.register(Cinematographer)
-class CinematographerAdmin(admin.ModelAdmin):
+@admin.register(Person)
+class PersonAdmin(admin.ModelAdmin):
+    list_display = ('name', 'tmdb_id', 'imdb_id')
     search_fields = ('name',)
 
 
 @admin.register(Movie)
 class MovieAdmin(admin.ModelAdmin):
-    list_display = ('title', 'release_year', 'runtime_minutes', 'revenue')
-    list_filter = ('release_year', 'genre')
+    list_display = ('title', 'release_year', 'runtime_minutes', 'revenue', 'revenue_tier')
+    list_filter = ('release_year', 'revenue_tier', 'genre')
     search_fields = ('title',)
     
-    # **MODIFICATION**: Removed 'actors'
-    autocomplete_fields = ('cinematographers', 'directors', 'producers')
     filter_horizontal = ('genre',)
     
     fieldsets = (
         ('Core Information', {'fields': ('title', 'release_year', 'plot_summary')}),
         ('Statistics & Metadata', {'fields': ('runtime_minutes', 'revenue', 'poster_url', 'collection_id', 'collection_name')}),
         ('External IDs (Read-Only)', {'classes': ('collapse',), 'fields': ('imdb_id', 'tmdb_id')}),
-        # **MODIFICATION**: Removed 'actors'
-        ('Personnel & Genre', {'fields': ('genre', 'directors', 'producers', 'cinematographers')}),
+        ('Genre', {'fields': ('genre',)}),
     )
     readonly_fields = ('imdb_id', 'tmdb_id')
     
-    # **MODIFICATION**: Added the new inline class
-    inlines = [MovieCastCreditInline]
+    inlines = [CreditInline]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Keep the detail page's credits summary (and its ETag) in step with manual edits.
+        rebuild_credits_summaries([form.instance.id])
 
 
 # --- Admin Interfaces for Invite Codes and Friendships ---
@@ -88,24 +76,19 @@ class InviteCodeAdmin(admin.ModelAdmin):
 
 @admin.register(Friendship)
 class FriendshipAdmin(admin.ModelAdmin):
-    """Admin interface for managing friendships."""
-    list_display = ('from_user', 'to_user', 'status', 'created_at', 'accepted_at')
+    """Admin interface for managing friendships (one row per pair of users)."""
+    list_display = ('user_low', 'user_high', 'requested_by', 'status', 'created_at', 'accepted_at')
     list_filter = ('status',)
-    search_fields = ('from_user__username', 'to_user__username')
-
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        if change:
-            try:
-                reciprocal_friendship = Friendship.objects.get(
-                    from_user=obj.to_user,
-                    to_user=obj.from_user
-                )
-                reciprocal_friendship.status = obj.status
-                reciprocal_friendship.accepted_at = obj.accepted_at
-                reciprocal_friendship.save()
-            except Friendship.DoesNotExist:
-                pass
+    search_fields = ('user_low__username', 'user_high__username')
+    raw_id_fields = ('user_low', 'user_high', 'requested_by')
+
+
+@admin.register(CrawlState)
+class CrawlStateAdmin(admin.ModelAdmin):
+    """Read-mostly view of the TMDb ingestion checkpoints; delete a row to force a full re-crawl."""
+    list_display = ('endpoint', 'year', 'last_page_done', 'total_pages', 'total_results', 'completed_at', 'updated_at')
+    list_filter = ('endpoint',)
+    readonly_fields = ('etag', 'updated_at')
 
 
 # Register remaining models
@@ -7,4 +7,5 @@ class TrackerConfig(AppConfig):
     # --- NEW CODE: Signal loading ---
     def ready(self):
         import tracker.signals  # noqa
+        import tracker.checks  # noqa
     # ------------------------------
@@ -0,0 +1,138 @@
+# tracker/caching.py
+
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from django.conf import settings
+from django.core.cache import cache
+from .metrics import mark_cold
+from .models import Genre, Friendship
+from .routers import use_primary
+
+FRAGMENT_TIMEOUT = getattr(settings, 'CACHE_FRAGMENT_TIMEOUT', 3600)
+REPLICA_PIN_SECONDS = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+# Fragments whose hit/miss counters are reported by cache_stats().
+FRAGMENTS = ('genre_list', 'movie_detail', 'seen_movies_grid', 'last_rated_list', 'friend_ids')
+
+# Invalidation scopes. A fragment key embeds the current version of every scope it depends on,
+# so bumping a scope's version orphans all of its fragments at once (they then age out).
+GENRES_SCOPE = 'genres'
+CATALOGUE_SCOPE = 'catalogue'
+
+def movie_scope(movie_id): return f'movie:{movie_id}'
+
+def user_scope(user_id): return f'user:{user_id}'
+
+def friends_scope(user_id): return f'friends:{user_id}'
+
+
+def _new_version():
+    # Seeded from the clock rather than 1, so a version evicted from the cache always comes back
+    # higher than any version already baked into a stored fragment key.
+    return time.time_ns() // 1000
+
+
+def _scope_state(scopes):
+    """
+    Returns the current version of each scope (creating the missing ones) and whether any of them was
+    bumped within the last REPLICA_PIN_SECONDS, in one cache round trip.
+    """
+    keys = [f'cache_version:{scope}' for scope in scopes]; bumped_keys = [f'cache_bumped:{scope}' for scope in scopes]
+    found = cache.get_many(keys + bumped_keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_version(), timeout=None)
+            found[key] = cache.get(key, 0)
+    return [found[key] for key in keys], any(key in found for key in bumped_keys)
+
+
+def scope_versions(scopes):
+    """Returns the current version of each scope, creating the missing ones."""
+    return _scope_state(scopes)[0]
+
+
+def invalidate(*scopes, pin=True):
+    """
+    Bumps the version of each scope, orphaning every fragment built under the old one. `pin=False`
+    skips the replica pin, for bumps that don't follow a write (the benchmark's cold runs).
+    """
+    for scope in scopes:
+        key = f'cache_version:{scope}'
+        try: cache.incr(key)
+        except ValueError: cache.add(key, _new_version(), timeout=None)
+        # Marks the scope as just written: a read replica may not have the change yet.
+        if pin: cache.set(f'cache_bumped:{scope}', True, REPLICA_PIN_SECONDS)
+
+
+class CacheLockBusy(Exception):
+    """A cache lock stayed taken for the whole wait; the caller should retry or fall back."""
+
+
+@contextmanager
+def cache_lock(key, timeout=5, busy=CacheLockBusy):
+    """
+    A short lock held in the shared cache, expiring after `timeout` seconds. Waits up to `timeout`
+    for it and raises `busy` rather than running unlocked; releases only the lock this call took, so
+    a holder that overran the timeout can't delete the next holder's lock.
+    """
+    lock_key = f'{key}:lock'; token = uuid.uuid4().hex; deadline = time.monotonic() + timeout
+    while not cache.add(lock_key, token, timeout):
+        if time.monotonic() >= deadline: raise busy(key)
+        time.sleep(0.005)
+    try: yield
+    finally:
+        if cache.get(lock_key) == token: cache.delete(lock_key)
+
+
+def _count(fragment, outcome):
+    # Counters live in the cache itself so that every worker process reports into the same totals.
+    key = f'cache_stats:{fragment}:{outcome}'
+    try: cache.incr(key)
+    except ValueError: cache.add(key, 1, timeout=None)
+
+
+def cached_fragment(fragment, parts, scopes, build, timeout=None):
+    """
+    Returns the value cached for `fragment` and the key `parts` under the current versions of
+    `scopes`, calling `build()` and storing its result on a miss.
+    """
+    versions, recently_bumped = _scope_state(scopes)
+    key = ':'.join(['fragment', fragment, *map(str, parts), *map(str, versions)])
+    value = cache.get(key)
+    if value is not None:
+        _count(fragment, 'hits')
+        return value
+    _count(fragment, 'misses'); mark_cold(f'{fragment} miss')
+    # A fragment rebuilt from a lagging replica right after an invalidation would cache the old data
+    # under the new version until the next one, so fresh scopes are rebuilt from the primary.
+    with use_primary() if recently_bumped else nullcontext():
+        value = build()
+    cache.set(key, value, FRAGMENT_TIMEOUT if timeout is None else timeout)
+    return value
+
+
+def cache_stats():
+    """Returns {fragment: {'hits', 'misses', 'hit_rate'}} for every cached fragment."""
+    counters = cache.get_many([f'cache_stats:{fragment}:{outcome}' for fragment in FRAGMENTS for outcome in ('hits', 'misses')])
+    stats = {}
+    for fragment in FRAGMENTS:
+        hits = counters.get(f'cache_stats:{fragment}:hits', 0); misses = counters.get(f'cache_stats:{fragment}:misses', 0)
+        stats[fragment] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None}
+    return stats
+
+
+def reset_cache_stats():
+    cache.delete_many([f'cache_stats:{fragment}:{outcome}' for fragment in FRAGMENTS for outcome in ('hits', 'misses')])
+
+
+def genre_list():
+    """All genres ordered by name, as used by the rating page's genre filter."""
+    return cached_fragment('genre_list', [], [GENRES_SCOPE], lambda: list(Genre.objects.order_by('name')))
+
+
+def friend_ids(user_id):
+    """The ids of the user's accepted friends, as a frozenset; signals.py invalidates it when one of their friendships changes."""
+    def build():
+        pairs = Friendship.objects.filter(Friendship.involving(user_id), status=Friendship.Status.ACCEPTED).values_list('user_low_id', 'user_high_id')
+        return frozenset(high if low == user_id else low for low, high in pairs)
+    return cached_fragment('friend_ids', [user_id], [friends_scope(user_id)], build)
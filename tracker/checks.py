@@ -0,0 +1,18 @@
+# tracker/checks.py
+
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends whose add() and incr() are atomic across processes, as the cache locks, rating buffers,
+# unseen queues and fragment version bumps need once several workers share them.
+SHARED_CACHE_BACKENDS = ('django.core.cache.backends.redis.RedisCache', 'django.core.cache.backends.memcached.PyMemcacheCache',
+                         'django.core.cache.backends.memcached.PyLibMCCache')
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Deploy check: with DEBUG off, the default cache has to be shared by every worker process."""
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DEBUG or backend in SHARED_CACHE_BACKENDS: return []
+    return [Error(f"DEBUG is off but the default cache ({backend}) is not shared between processes.",
+                  hint="Set REDIS_URL or MEMCACHED_LOCATION. A single-process deployment can set ALLOW_LOCAL_CACHE=True to silence this.", id='tracker.E001')]
@@ -0,0 +1,56 @@
+# tracker/feed.py
+
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from .models import FeedEntry
+from .caching import friend_ids
+from .pagination import keyset_page
+
+# Each user's timeline keeps (about) this many of their friends' latest ratings; older entries are trimmed.
+FEED_LENGTH = getattr(settings, 'FRIEND_FEED_LENGTH', 100)
+# A user's ratings trim their friends' timelines at most once per this many seconds.
+FEED_TRIM_INTERVAL = getattr(settings, 'FRIEND_FEED_TRIM_INTERVAL', 300)
+FEED_PAGE_SIZE = 10
+
+
+def fan_out(views):
+    """
+    Copies each rating (UserMovieView) into the timeline of every accepted friend of its author, with
+    one bulk_create for the lot. Called by a signal for single saves and by flush_ratings() for
+    buffered swipes, which skip the signals.
+    """
+    by_user = defaultdict(list)
+    for view in views: by_user[view.user_id].append(view)
+    now = timezone.now(); entries = []; due = set()
+    for user_id, user_views in by_user.items():
+        friends = friend_ids(user_id)
+        if not friends: continue
+        entries += [FeedEntry(owner_id=owner_id, actor_id=user_id, movie_id=view.movie_id, has_seen=view.has_seen, date_recorded=now) for view in user_views for owner_id in friends]
+        if cache.add(f'feed_trim:{user_id}', True, FEED_TRIM_INTERVAL): due |= friends
+    if not entries: return
+    FeedEntry.objects.bulk_create(entries, batch_size=1000)
+    trim_timelines(due)
+
+
+def trim_timelines(owner_ids):
+    """Deletes all but the newest FEED_LENGTH entries of each owner's timeline (two queries per owner)."""
+    for owner_id in owner_ids:
+        timeline = FeedEntry.objects.filter(owner_id=owner_id)
+        cutoff = list(timeline.order_by('-date_recorded', '-id').values_list('date_recorded', 'id')[FEED_LENGTH:FEED_LENGTH + 1])
+        if cutoff:
+            recorded, pk = cutoff[0]
+            timeline.filter(Q(date_recorded__lt=recorded) | Q(date_recorded=recorded, id__lte=pk)).delete()
+
+
+def drop_pair_entries(user_a_id, user_b_id):
+    """Removes each user's ratings from the other's timeline, e.g. once they are no longer friends."""
+    FeedEntry.objects.filter(Q(owner_id=user_a_id, actor_id=user_b_id) | Q(owner_id=user_b_id, actor_id=user_a_id)).delete()
+
+
+def friend_feed_page(user, cursor=None):
+    """One page of the user's friends' recent ratings, newest first: a single range read of their own timeline."""
+    entries = FeedEntry.objects.filter(owner=user, actor__is_active=True).select_related('actor', 'movie')
+    return keyset_page(entries, cursor, FEED_PAGE_SIZE, limit=FEED_LENGTH)
@@ -72,7 +72,6 @@ class CustomUserCreationForm(UserCreationForm):
         invite_code.used_by = user; invite_code.used_at = timezone.now()
         if invite_code.generated_by:
             inviter = invite_code.generated_by
-            Friendship.objects.create(from_user=inviter, to_user=user, status=Friendship.Status.ACCEPTED)
-            Friendship.objects.create(from_user=user, to_user=inviter, status=Friendship.Status.ACCEPTED)
-        if commit: user.save(); user.profile.save(); invite_code.save()
+            Friendship.objects.create(**Friendship.pair(inviter, user), requested_by=inviter, status=Friendship.Status.ACCEPTED, accepted_at=timezone.now())
+        if commit: user.save(); invite_code.save()
         return user
\ No newline at end of file
@@ -0,0 +1,264 @@
+# tracker/ingestion.py
+
+from django.db import transaction, IntegrityError
+from .tmdb import TMDbAuthError
+from .models import Movie, Genre, Person, Credit, revenue_tier_for, rebuild_credits_summaries
+
+TMDB_POSTER_BASE_URL = "https://image.tmdb.org/t/p/w500"
+
+
+def load_tmdb_genres(client):
+    """Syncs TMDb's official genre list into Genre and returns {TMDb genre id: Genre}."""
+    data = client.get('/genre/movie/list')
+    names = {genre_data['id']: genre_data['name'] for genre_data in data.get('genres', [])}
+    Genre.objects.bulk_create([Genre(name=name) for name in set(names.values())], ignore_conflicts=True)
+    by_name = {genre.name: genre for genre in Genre.objects.filter(name__in=names.values())}
+    return {tmdb_id: by_name[name] for tmdb_id, name in names.items() if name in by_name}
+
+
+def movie_from_tmdb_result(movie_data):
+    """Builds an unsaved Movie from a TMDb list result, or returns None if it can't be stored."""
+    release_date_str = movie_data.get('release_date') or ''
+    year_str = release_date_str.split('-')[0]
+    if not movie_data.get('id') or not movie_data.get('title') or not year_str.isdigit():
+        return None
+    return Movie(
+        title=movie_data['title'][:255],
+        release_year=int(year_str),
+        tmdb_id=movie_data['id'],
+        plot_summary=movie_data.get('overview'),
+        poster_url=f"{TMDB_POSTER_BASE_URL}{movie_data['poster_path']}" if movie_data.get('poster_path') else None,
+        imdb_id=None,
+    )
+
+
+class MovieBatchWriter:
+    """
+    Buffers TMDb list results across pages and writes them set-based: one IN query for the
+    tmdb_ids that already exist, one bulk INSERT for the new movies and one bulk INSERT for their
+    genre rows, all in a single transaction every `flush_every_pages` pages.
+    """
+
+    def __init__(self, tmdb_genre_map, flush_every_pages=5):
+        self.tmdb_genre_map = tmdb_genre_map
+        self.flush_every_pages = max(1, flush_every_pages)
+        self._pending = {}
+        self._buffered_pages = 0
+
+    @property
+    def pending_pages(self):
+        """Pages buffered since the last flush; 0 means everything added so far is committed."""
+        return self._buffered_pages
+
+    def add_page(self, results):
+        """Buffers one page of results; returns the number of movies written if this triggered a flush."""
+        for movie_data in results:
+            movie = movie_from_tmdb_result(movie_data)
+            if movie is not None:
+                self._pending[movie.tmdb_id] = (movie, movie_data.get('genre_ids') or [])
+        self._buffered_pages += 1
+        if self._buffered_pages >= self.flush_every_pages:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """Writes everything buffered so far; returns the number of new movies inserted."""
+        pending, self._pending, self._buffered_pages = self._pending, {}, 0
+        if not pending:
+            return 0
+
+        with transaction.atomic():
+            existing = set(Movie.objects.filter(tmdb_id__in=pending.keys()).values_list('tmdb_id', flat=True))
+            new_movies = [movie for tmdb_id, (movie, _) in pending.items() if tmdb_id not in existing]
+            if not new_movies:
+                return 0
+            Movie.objects.bulk_create(new_movies, ignore_conflicts=True)
+
+            # ignore_conflicts doesn't hand back primary keys on every backend, so map them by tmdb_id.
+            movie_ids = dict(Movie.objects.filter(tmdb_id__in=[movie.tmdb_id for movie in new_movies]).values_list('tmdb_id', 'id'))
+            GenreLink = Movie.genre.through
+            genre_links = [
+                GenreLink(movie_id=movie_ids[movie.tmdb_id], genre_id=self.tmdb_genre_map[genre_id].id)
+                for movie in new_movies if movie.tmdb_id in movie_ids
+                for genre_id in pending[movie.tmdb_id][1] if genre_id in self.tmdb_genre_map
+            ]
+            GenreLink.objects.bulk_create(genre_links, ignore_conflicts=True)
+        return len(new_movies)
+
+
+def crawl_pages(client, writer, state, path, params, pages, first_page=None, on_page=None):
+    """
+    Fetches `pages` of a TMDb listing concurrently into `writer` and checkpoints `state` at the
+    highest page up to which everything has been committed. A page that fails to fetch holds the
+    checkpoint back, so the next run resumes from it; the listing is only marked complete once
+    every page is in. `first_page` is already-fetched page 1 data. Returns new movies written.
+    """
+    new_movies = 0
+    added_pages = set()
+    committed_upto = state.last_page_done
+
+    def checkpoint():
+        nonlocal committed_upto
+        while committed_upto + 1 in added_pages:
+            committed_upto += 1
+        state.checkpoint(committed_upto)
+
+    def add(page, data):
+        nonlocal new_movies
+        new_movies += writer.add_page(data.get('results') or [])
+        added_pages.add(page)
+        if writer.pending_pages == 0:
+            checkpoint()
+
+    try:
+        if first_page is not None:
+            add(1, first_page)
+        jobs = ((page, path, {**params, 'page': page}) for page in pages)
+        for page, data, error in client.fetch_many(jobs):
+            if isinstance(error, TMDbAuthError):
+                raise error
+            if error is None:
+                add(page, data)
+            if on_page:
+                on_page(page, error)
+    except TMDbAuthError:
+        writer.flush(); checkpoint()
+        raise
+
+    new_movies += writer.flush()
+    checkpoint()
+    if state.total_pages is not None and committed_upto >= state.total_pages:
+        state.mark_complete()
+    return new_movies
+
+
+# Number of top-billed cast members stored per movie.
+CAST_LIMIT = 25
+# Crew credits we keep: TMDb crew job -> Credit role.
+CREW_JOB_ROLES = {
+    'Director': Credit.Role.DIRECTOR,
+    'Producer': Credit.Role.PRODUCER,
+    'Director of Photography': Credit.Role.CINEMATOGRAPHER,
+    'Cinematographer': Credit.Role.CINEMATOGRAPHER,
+}
+
+
+def _resolve_people(names_by_tmdb_id):
+    """Returns {tmdb_id: pk} for the given people, inserting the missing ones in one statement."""
+    if not names_by_tmdb_id:
+        return {}
+    ids = dict(Person.objects.filter(tmdb_id__in=names_by_tmdb_id.keys()).values_list('tmdb_id', 'id'))
+    missing = [Person(tmdb_id=tmdb_id, name=name[:255]) for tmdb_id, name in names_by_tmdb_id.items() if tmdb_id not in ids]
+    if missing:
+        Person.objects.bulk_create(missing, ignore_conflicts=True)
+        ids.update(Person.objects.filter(tmdb_id__in=[person.tmdb_id for person in missing]).values_list('tmdb_id', 'id'))
+    return ids
+
+
+def credits_from_tmdb(data):
+    """Returns the (tmdb person id, name, role, order) credits we keep from a TMDb credits payload."""
+    credits = data.get('credits', {})
+    rows = [(member['id'], member['name'], Credit.Role.CAST, order) for order, member in enumerate(credits.get('cast', [])[:CAST_LIMIT])]
+    rows += [(member['id'], member['name'], CREW_JOB_ROLES[member['job']], order) for order, member in enumerate(credits.get('crew', [])) if member.get('job') in CREW_JOB_ROLES]
+    return rows
+
+
+def movie_chunks(movies, size=500):
+    """Yields the movies in id order, `size` at a time, so the fetch workers never touch the database."""
+    last_id = 0
+    while True:
+        chunk = list(movies.filter(id__gt=last_id).order_by('id')[:size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
+def refresh_movie_details(client, writer, movies):
+    """
+    Fetches details+credits for `movies` concurrently and buffers each payload into the
+    CreditBatchWriter `writer`. Yields (movie, error) as each fetch completes, with error None on
+    success. A rejected API key stops the run after flushing what was already fetched.
+    """
+    jobs = [(movie, f"/movie/{movie.tmdb_id}", {'append_to_response': 'credits'}) for movie in movies]
+    for movie, data, error in client.fetch_many(jobs):
+        if isinstance(error, TMDbAuthError):
+            writer.flush()
+            raise error
+        if error is None:
+            writer.add(movie, data)
+        yield movie, error
+
+
+class CreditBatchWriter:
+    """
+    Buffers TMDb details+credits payloads for several movies and writes them in one transaction:
+    a bulk_update of the movie stats, one Person lookup/insert keyed by tmdb_id, and a diff of the
+    movies' Credit rows against what is already stored, so only changed credits are deleted or
+    inserted.
+    """
+
+    def __init__(self, movies_per_batch=50):
+        self.movies_per_batch = max(1, movies_per_batch)
+        self._pending = []
+        self.failed = []
+
+    def add(self, movie, data):
+        """Buffers one movie; returns the number of movies written if this triggered a flush."""
+        self._pending.append((movie, data))
+        if len(self._pending) >= self.movies_per_batch:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """
+        Writes everything buffered. If the batch hits an integrity error (e.g. a duplicate imdb_id),
+        it is retried movie by movie and the offending movies are collected in `failed`.
+        """
+        pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        try:
+            self._write(pending)
+            return len(pending)
+        except IntegrityError:
+            written = 0
+            for movie, data in pending:
+                try:
+                    self._write([(movie, data)])
+                    written += 1
+                except IntegrityError as e:
+                    self.failed.append((movie, e))
+            return written
+
+    def _write(self, batch):
+        with transaction.atomic():
+            movies = []
+            for movie, data in batch:
+                movie.revenue = data.get('revenue') or 0
+                movie.revenue_tier = revenue_tier_for(movie.revenue)
+                movie.runtime_minutes = data.get('runtime')
+                movie.imdb_id = data.get('imdb_id') or None
+                movies.append(movie)
+            Movie.objects.bulk_update(movies, ['revenue', 'revenue_tier', 'runtime_minutes', 'imdb_id'])
+
+            self._write_credits(batch)
+            rebuild_credits_summaries([movie.id for movie in movies])
+
+    def _write_credits(self, batch):
+        credits_by_movie = {movie.id: credits_from_tmdb(data) for movie, data in batch}
+        person_ids = _resolve_people({tmdb_id: name for rows in credits_by_movie.values() for tmdb_id, name, role, order in rows})
+        # A person listed twice under one role (e.g. two voice parts) keeps their first billing.
+        wanted = {}
+        for movie_id, rows in credits_by_movie.items():
+            for tmdb_id, name, role, order in rows:
+                if tmdb_id in person_ids: wanted.setdefault((movie_id, role, person_ids[tmdb_id]), order)
+
+        existing = {(movie_id, role, person_id): (credit_id, order) for credit_id, movie_id, role, person_id, order in Credit.objects.filter(movie_id__in=credits_by_movie.keys()).values_list('id', 'movie_id', 'role', 'person_id', 'order')}
+        stale = [credit_id for key, (credit_id, order) in existing.items() if key not in wanted]
+        moved = [Credit(id=existing[key][0], order=order) for key, order in wanted.items() if key in existing and existing[key][1] != order]
+        if stale:
+            Credit.objects.filter(id__in=stale).delete()
+        if moved:
+            Credit.objects.bulk_update(moved, ['order'])
+        Credit.objects.bulk_create([Credit(movie_id=movie_id, role=role, person_id=person_id, order=order) for (movie_id, role, person_id), order in wanted.items() if (movie_id, role, person_id) not in existing])
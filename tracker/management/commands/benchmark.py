@@ -0,0 +1,183 @@
+# tracker/management/commands/benchmark.py
+import json
+import logging
+import random
+import statistics
+import subprocess
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.db.models import Max
+from tracker.caching import invalidate, movie_scope, user_scope, friends_scope
+from tracker.models import Movie, Profile, UserMovieView, InviteCode, FeedEntry, rebuild_rating_counters
+from tracker.seen_sets import rebuild_seen_bitmaps
+from tracker.sampling import unseen_movies_for, sample_ids
+from tracker.rating_buffer import flush_ratings
+from .generate_catalogue import USER_PREFIX
+
+SCENARIOS = ['next_movie', 'rate_movie', 'rate_api', 'profile', 'seen_page', 'seen_page_deep', 'last_rated_page', 'last_rated_page_deep', 'movie_detail']
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))]
+
+
+def summarise(timings, queries):
+    return {'n': len(timings), 'p50_ms': round(percentile(timings, 50), 2), 'p95_ms': round(percentile(timings, 95), 2), 'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(statistics.fmean(timings), 2), 'max_ms': round(max(timings), 2), 'queries_median': statistics.median(queries), 'queries_max': max(queries)}
+
+
+def git_commit():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+
+class Command(BaseCommand):
+    help = ('Times the rating loop (next movie, rating POSTs, profile, paging APIs, movie detail) for the benchmark users '
+            'and reports p50/p95/p99 latency and query counts per scenario, optionally as JSON to compare commits.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=str, default=None, help='Comma-separated usernames to benchmark (defaults to every generated benchmark user).')
+        parser.add_argument('--scenarios', type=str, default=','.join(SCENARIOS), help=f"Comma-separated subset of: {', '.join(SCENARIOS)}.")
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per scenario and user.')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per scenario and user before timing starts.')
+        parser.add_argument('--depth', type=int, default=5, help='How many pages in the *_deep paging scenarios start.')
+        parser.add_argument('--cold', action='store_true', help="Orphan the benchmark user's and the detail movies' cached fragments before every timed request (the rest of the cache, the genre list included, is left alone).")
+        parser.add_argument('--seed', type=int, default=1939, help='Random seed for the movies picked by the detail and rating scenarios.')
+        parser.add_argument('--label', type=str, default='', help='Free-form label stored in the JSON report.')
+        parser.add_argument('--output', type=str, default=None, help='Write the report as JSON to this path.')
+        parser.add_argument('--compare', type=str, default=None, help='A previous JSON report to print p95 and query deltas against.')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown: raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        users = User.objects.filter(username__in=options['users'].split(',')) if options['users'] else User.objects.filter(username__startswith=USER_PREFIX)
+        users = list(users.order_by('id'))
+        if not users: raise CommandError('No users to benchmark; run generate_catalogue first or pass --users.')
+        self.rng = random.Random(options['seed']); self.options = options; self.detail_ids = []
+
+        report = {'label': options['label'], 'commit': git_commit(), 'started_at': timezone.now().isoformat(), 'database': connection.vendor,
+                  'catalogue': {'movies': Movie.objects.count(), 'ratings': UserMovieView.objects.count()},
+                  'settings': {key: options[key] for key in ('iterations', 'warmup', 'depth', 'cold', 'seed')}, 'users': {}, 'results': {}}
+        # Budget overruns would drown the report; they are shown again at -v 2.
+        if options['verbosity'] < 2: logging.getLogger('tracker.metrics').setLevel(logging.ERROR)
+        # The test client's host; the benchmark needs neither the dev server nor DEBUG.
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for user in users:
+                user_key = user.username
+                report['users'][user_key] = Profile.objects.get(user=user).total_rated
+                report['results'][user_key] = {}
+                for scenario in scenarios:
+                    result = self._run(scenario, user)
+                    if result is None: continue
+                    report['results'][user_key][scenario] = result
+                    self.stdout.write(f"{user_key:<32} {scenario:<22} p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms  "
+                                      f"p99 {result['p99_ms']:>8.2f}ms  queries {result['queries_median']:g} (max {result['queries_max']})")
+
+        if options['output']:
+            with open(options['output'], 'w') as f: json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        if options['compare']: self._compare(report, options['compare'])
+
+    def _client(self, user):
+        client = Client()
+        # A fresh instance, so nothing cached on this object leaks between the client and the benchmark.
+        client.force_login(User.objects.get(pk=user.pk))
+        return client
+
+    def _run(self, scenario, user):
+        """Warms up, then times `iterations` requests of one scenario; None when it doesn't apply to this user."""
+        client = self._client(user); iterations = self.options['iterations']; warmup = self.options['warmup']
+        # Rows the rating scenarios add as side effects are newer than these, so _undo_ratings can find them.
+        self.last_ids = (InviteCode.objects.aggregate(last=Max('id'))['last'] or 0, FeedEntry.objects.aggregate(last=Max('id'))['last'] or 0)
+        requests = getattr(self, f'_requests_{scenario}')(client, user, warmup + iterations)
+        if requests is None: return None
+        timings, queries = [], []
+        for i, make_request in enumerate(requests):
+            if i >= warmup and self.options['cold']: self._orphan_fragments(user)
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter(); response = make_request(); elapsed = time.perf_counter() - start
+            if response.status_code >= 400: raise CommandError(f"{scenario} for {user.username} returned {response.status_code}")
+            if i >= warmup: timings.append(elapsed * 1000); queries.append(len(captured))
+        if scenario in ('rate_movie', 'rate_api'): self._undo_ratings(user)
+        return summarise(timings, queries) if timings else None
+
+    def _orphan_fragments(self, user):
+        # Bumps the benchmark user's and the detail movies' scopes, which every fragment the scenarios read is
+        # keyed on, so each timed request rebuilds them. The cache may be shared with a live site: the global
+        # scopes (catalogue, genres) are left alone and no replica pins are set.
+        invalidate(user_scope(user.id), friends_scope(user.id), *(movie_scope(movie_id) for movie_id in self.detail_ids), pin=False)
+
+    # --- Scenarios: each returns a list of zero-argument callables issuing one request ---
+
+    def _requests_next_movie(self, client, user, count):
+        url = reverse('next_movie')
+        return [lambda: client.get(url)] * count
+
+    def _requests_rate_movie(self, client, user, count):
+        self.rated_ids = sample_ids(unseen_movies_for(user), count)
+        url = reverse('next_movie')
+        return [lambda movie_id=movie_id: client.post(url, {'movie_id': movie_id, 'has_seen': self.rng.choice(['True', 'False'])}) for movie_id in self.rated_ids]
+
+    def _requests_rate_api(self, client, user, count):
+        self.rated_ids = sample_ids(unseen_movies_for(user), count)
+        url = reverse('rate_movie_api')
+        return [lambda movie_id=movie_id: client.post(url, json.dumps({'movie_id': movie_id, 'has_seen': self.rng.random() < 0.5}), content_type='application/json')
+                for movie_id in self.rated_ids]
+
+    def _undo_ratings(self, user):
+        # Put the user back where generate_catalogue left them, so runs stay comparable: the ratings, the
+        # invite codes granted at milestones, the friends' feed entries and the seen bitmap.
+        flush_ratings(user)
+        UserMovieView.objects.filter(user=user, movie_id__in=self.rated_ids).delete()
+        InviteCode.objects.filter(generated_by=user, id__gt=self.last_ids[0]).delete()
+        FeedEntry.objects.filter(actor=user, id__gt=self.last_ids[1]).delete()
+        rebuild_rating_counters(Profile.objects.filter(user=user)); rebuild_seen_bitmaps([user.id])
+
+    def _requests_profile(self, client, user, count):
+        url = reverse('my_profile')
+        return [lambda: client.get(url)] * count
+
+    def _paging_requests(self, client, url, count, depth):
+        cursor = None
+        for _ in range(depth):
+            cursor = client.get(url, {'cursor': cursor} if cursor else {}).json()['next_cursor']
+            if cursor is None: return None # The list isn't that deep for this user.
+        return [lambda: client.get(url, {'cursor': cursor} if cursor else {})] * count
+
+    def _requests_seen_page(self, client, user, count):
+        return self._paging_requests(client, reverse('get_seen_movies_page', args=[user.username]), count, 0)
+
+    def _requests_seen_page_deep(self, client, user, count):
+        return self._paging_requests(client, reverse('get_seen_movies_page', args=[user.username]), count, self.options['depth'])
+
+    def _requests_last_rated_page(self, client, user, count):
+        return self._paging_requests(client, reverse('get_last_rated_page'), count, 0)
+
+    def _requests_last_rated_page_deep(self, client, user, count):
+        # The last-rated list is capped, so its second page is as deep as it goes.
+        return self._paging_requests(client, reverse('get_last_rated_page'), count, 1)
+
+    def _requests_movie_detail(self, client, user, count):
+        self.detail_ids = sample_ids(Movie.objects.all(), count)
+        return [lambda movie_id=movie_id: client.get(reverse('movie_detail', args=[movie_id])) for movie_id in self.detail_ids]
+
+    def _compare(self, report, path):
+        with open(path) as f: previous = json.load(f)
+        self.stdout.write(f"\nCompared with {path} ({previous.get('label') or previous.get('commit') or 'unlabelled'}):")
+        for user_key, scenarios in report['results'].items():
+            for scenario, result in scenarios.items():
+                before = previous.get('results', {}).get(user_key, {}).get(scenario)
+                if not before: continue
+                change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+                line = (f"{user_key:<32} {scenario:<22} p95 {before['p95_ms']:>8.2f} -> {result['p95_ms']:>8.2f}ms ({change:+.1f}%)  "
+                        f"queries {before['queries_median']:g} -> {result['queries_median']:g}")
+                self.stdout.write(self.style.ERROR(line) if change > 10 else self.style.SUCCESS(line) if change < -10 else line)
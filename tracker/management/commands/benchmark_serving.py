@@ -0,0 +1,98 @@
+# tracker/management/commands/benchmark_serving.py
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from .benchmark import percentile, git_commit
+
+MOVIE_ID_PATTERN = re.compile(r'name="movie_id" value="(\d+)"')
+
+
+class Command(BaseCommand):
+    help = ('Drives the rating loop over HTTP against one or more running servers (e.g. runserver and gunicorn) '
+            'with concurrent clients, and reports throughput and p50/p95/p99 latency per server.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True, help='NAME=URL of a running server, e.g. runserver=http://localhost:9000. Repeatable.')
+        parser.add_argument('--users', type=str, default='bench_user_1000', help='Comma-separated accounts the clients log in as (round-robin).')
+        parser.add_argument('--password', type=str, default=os.environ.get('BENCHMARK_PASSWORD'),
+                            help='Password of those accounts, as given to generate_catalogue --password (defaults to $BENCHMARK_PASSWORD).')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients per target.')
+        parser.add_argument('--duration', type=float, default=20, help='Seconds of measured load per target.')
+        parser.add_argument('--warmup', type=float, default=3, help='Seconds of unmeasured load before measuring.')
+        parser.add_argument('--page-every', type=int, default=10, help='Each client also loads the full rating page every N swipes.')
+        parser.add_argument('--output', type=str, default=None, help='Write the report as JSON to this path.')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep or not url.startswith('http'): raise CommandError(f"--target must look like NAME=http://host:port, got {target!r}")
+            targets.append((name, url.rstrip('/')))
+        if not options['password']: raise CommandError('Pass --password or set BENCHMARK_PASSWORD to the password the benchmark users were generated with.')
+        self.options = options
+        report = {'commit': git_commit(), 'settings': {key: options[key] for key in ('users', 'concurrency', 'duration', 'warmup', 'page_every')}, 'results': {}}
+        for name, url in targets:
+            report['results'][name] = result = self._load(url)
+            self.stdout.write(f"\n{name} ({url}): {result['requests_per_second']:.1f} req/s, {result['errors']} errors")
+            for kind, stats in result['latency'].items():
+                self.stdout.write(f"  {kind:<12} n {stats['n']:>6}  p50 {stats['p50_ms']:>8.2f}ms  p95 {stats['p95_ms']:>8.2f}ms  p99 {stats['p99_ms']:>8.2f}ms")
+        if len(targets) > 1:
+            baseline_name = targets[0][0]; baseline = report['results'][baseline_name]
+            for name, _ in targets[1:]:
+                result = report['results'][name]
+                speedup = result['requests_per_second'] / baseline['requests_per_second'] if baseline['requests_per_second'] else float('inf')
+                self.stdout.write(self.style.SUCCESS(f"\n{name} vs {baseline_name}: {speedup:.2f}x throughput"))
+        if options['output']:
+            with open(options['output'], 'w') as f: json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    def _login(self, url, username):
+        session = requests.Session()
+        session.get(f"{url}/accounts/login/", timeout=10)
+        response = session.post(f"{url}/accounts/login/", timeout=10, allow_redirects=False, headers={'Referer': f"{url}/accounts/login/"},
+                                data={'username': username, 'password': self.options['password'], 'csrfmiddlewaretoken': session.cookies.get('csrftoken', '')})
+        if response.status_code != 302: raise CommandError(f"Could not log in to {url} as {username} (status {response.status_code})")
+        return session
+
+    def _rating_page(self, session, url):
+        response = session.get(f"{url}/", timeout=30); response.raise_for_status()
+        match = MOVIE_ID_PATTERN.search(response.text)
+        return int(match.group(1)) if match else None
+
+    def _client(self, url, username, measure_from, stop_at, samples, lock):
+        """One client swiping as fast as the server answers; returns the number of failed requests."""
+        session = self._login(url, username); errors = 0; swipes = 0
+        movie_id = self._rating_page(session, url)
+        while movie_id is not None and time.monotonic() < stop_at:
+            kind = 'rating_page' if self.options['page_every'] and swipes % self.options['page_every'] == self.options['page_every'] - 1 else 'rate_api'
+            began = time.monotonic()
+            try:
+                if kind == 'rating_page':
+                    movie_id = self._rating_page(session, url)
+                else:
+                    response = session.post(f"{url}/api/rate/", data=json.dumps({'movie_id': movie_id, 'has_seen': swipes % 3 == 0}), timeout=30,
+                                            headers={'Content-Type': 'application/json', 'X-CSRFToken': session.cookies.get('csrftoken', ''), 'Referer': f"{url}/"})
+                    response.raise_for_status(); movie = response.json()['movie']; movie_id = movie and movie['id']
+            except (requests.RequestException, ValueError):
+                errors += 1; time.sleep(0.1); continue
+            finished = time.monotonic(); swipes += 1
+            if began >= measure_from:
+                with lock: samples[kind].append((finished - began) * 1000)
+        return errors
+
+    def _load(self, url):
+        usernames = [name.strip() for name in self.options['users'].split(',') if name.strip()]
+        start = time.monotonic(); measure_from = start + self.options['warmup']; stop_at = measure_from + self.options['duration']
+        samples = {'rate_api': [], 'rating_page': []}; lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=self.options['concurrency']) as pool:
+            futures = [pool.submit(self._client, url, usernames[i % len(usernames)], measure_from, stop_at, samples, lock) for i in range(self.options['concurrency'])]
+            errors = sum(future.result() for future in futures)
+        measured = sum(len(values) for values in samples.values())
+        latency = {kind: {'n': len(values), 'p50_ms': round(percentile(values, 50), 2), 'p95_ms': round(percentile(values, 95), 2), 'p99_ms': round(percentile(values, 99), 2)}
+                   for kind, values in samples.items() if values}
+        return {'url': url, 'requests_per_second': round(measured / self.options['duration'], 1), 'errors': errors, 'latency': latency}
@@ -0,0 +1,25 @@
+# tracker/management/commands/flush_rating_buffers.py
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from tracker.rating_buffer import pending_users, flush_ratings
+
+
+class Command(BaseCommand):
+    help = 'Writes buffered swipes from the JSON rating API to the database. Run it from cron every minute or so.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=0,
+            help='Only flush buffers whose oldest rating is at least this many seconds old.'
+        )
+
+    def handle(self, *args, **options):
+        cutoff = time.time() - options['min_age']
+        user_ids = [user_id for user_id, buffered_at in pending_users().items() if buffered_at <= cutoff]
+        written = 0
+        for user in User.objects.filter(id__in=user_ids):
+            written += flush_ratings(user)
+        self.stdout.write(self.style.SUCCESS(f"Flushed {len(user_ids)} rating buffers ({written} new ratings)."))
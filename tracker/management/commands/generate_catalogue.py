@@ -0,0 +1,116 @@
+# tracker/management/commands/generate_catalogue.py
+import random
+import sys
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from tracker.models import Movie, Genre, Person, Credit, Profile, UserMovieView, revenue_tier_for, rebuild_rating_counters, rebuild_credits_summaries
+from tqdm import tqdm
+
+# Synthetic rows are recognisable by these prefixes, so --clear only ever removes benchmark data.
+MOVIE_PREFIX = 'Bench Movie'
+PERSON_PREFIX = 'Bench Person'
+USER_PREFIX = 'bench_user_'
+GENRE_NAMES = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Family', 'Fantasy', 'History',
+               'Horror', 'Music', 'Mystery', 'Romance', 'Science Fiction', 'Thriller', 'War', 'Western']
+CAST_PER_MOVIE = 8
+CREW_ROLES = [Credit.Role.DIRECTOR, Credit.Role.PRODUCER, Credit.Role.CINEMATOGRAPHER]
+
+
+class Command(BaseCommand):
+    help = 'Builds a reproducible synthetic catalogue (movies, people, credits, genres) and rating users for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=100_000, help='Number of synthetic movies to create.')
+        parser.add_argument('--people', type=int, default=None, help='Size of the person pool credits are drawn from (defaults to movies / 5).')
+        parser.add_argument('--users', type=str, default='0,100,1000,5000,20000',
+                            help='Comma-separated rating-history sizes; one benchmark user is created per size.')
+        parser.add_argument('--seed', type=int, default=1939, help='Random seed, so two runs build the same catalogue.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert.')
+        parser.add_argument('--summaries', action='store_true', help='Also precompute every movie\'s credits summary (slow for large catalogues).')
+        parser.add_argument('--password', type=str, default=None,
+                            help='Password for the benchmark users, e.g. to drive them over HTTP with benchmark_serving. Without it they cannot log in.')
+        parser.add_argument('--clear', action='store_true', help='Delete previously generated benchmark data first.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        try:
+            history_sizes = [int(size) for size in options['users'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--users must be a comma-separated list of integers.')
+        if history_sizes and max(history_sizes) > options['movies']:
+            raise CommandError('A rating history cannot be larger than the catalogue.')
+
+        if options['clear']:
+            self._clear()
+
+        genres = self._genres()
+        movie_ids = self._movies(rng, options['movies'], genres, batch_size)
+        self._credits(rng, movie_ids, options['people'] or max(100, options['movies'] // 5), batch_size)
+        if options['summaries']:
+            for start in tqdm(range(0, len(movie_ids), batch_size), desc="Summaries", unit="batch", file=sys.stdout):
+                rebuild_credits_summaries(movie_ids[start:start + batch_size])
+        self._users(rng, history_sizes, movie_ids, batch_size, options['password'])
+        self.stdout.write(self.style.SUCCESS(f"Generated {len(movie_ids)} movies and {len(history_sizes)} benchmark users (seed {options['seed']})."))
+
+    def _clear(self):
+        self.stdout.write(self.style.WARNING('Deleting previous benchmark data...'))
+        User.objects.filter(username__startswith=USER_PREFIX).delete()
+        Movie.objects.filter(title__startswith=MOVIE_PREFIX).delete()
+        Person.objects.filter(name__startswith=PERSON_PREFIX).delete()
+
+    def _genres(self):
+        Genre.objects.bulk_create([Genre(name=name) for name in GENRE_NAMES], ignore_conflicts=True)
+        return list(Genre.objects.filter(name__in=GENRE_NAMES))
+
+    def _movies(self, rng, count, genres, batch_size):
+        """Bulk-inserts the movies with a long-tailed revenue distribution and one to three genres each."""
+        existing = Movie.objects.filter(title__startswith=MOVIE_PREFIX).count()
+        movie_ids = []
+        with tqdm(total=count, desc="Movies", unit="movie", file=sys.stdout) as t_bar:
+            for start in range(0, count, batch_size):
+                batch = []
+                for i in range(start, min(start + batch_size, count)):
+                    # Log-uniform revenue between $10k and $3bn, so every revenue tier is populated.
+                    revenue = int(10 ** rng.uniform(4, 9.5))
+                    batch.append(Movie(title=f"{MOVIE_PREFIX} {existing + i}", release_year=rng.randint(1930, 2025), runtime_minutes=rng.randint(75, 190),
+                                       revenue=revenue, revenue_tier=revenue_tier_for(revenue), plot_summary='Synthetic benchmark movie.'))
+                with transaction.atomic():
+                    created = Movie.objects.bulk_create(batch)
+                    links = [Movie.genre.through(movie_id=movie.id, genre_id=genre.id) for movie in created for genre in rng.sample(genres, rng.randint(1, 3))]
+                    Movie.genre.through.objects.bulk_create(links)
+                movie_ids += [movie.id for movie in created]
+                t_bar.update(len(batch))
+        return movie_ids
+
+    def _credits(self, rng, movie_ids, people, batch_size):
+        """Creates a pool of people and gives every movie a cast and one of each crew role, drawn with a popularity skew."""
+        existing = Person.objects.filter(name__startswith=PERSON_PREFIX).count()
+        for start in range(0, people, batch_size):
+            Person.objects.bulk_create([Person(name=f"{PERSON_PREFIX} {existing + i}") for i in range(start, min(start + batch_size, people))])
+        person_ids = list(Person.objects.filter(name__startswith=PERSON_PREFIX).values_list('id', flat=True))
+        with tqdm(total=len(movie_ids), desc="Credits", unit="movie", file=sys.stdout) as t_bar:
+            for start in range(0, len(movie_ids), batch_size):
+                credits = []
+                for movie_id in movie_ids[start:start + batch_size]:
+                    # Squaring a uniform draw skews picks towards the front of the pool, like real star power.
+                    cast = {person_ids[int(rng.random() ** 2 * len(person_ids))] for _ in range(CAST_PER_MOVIE)}
+                    credits += [Credit(movie_id=movie_id, person_id=person_id, role=Credit.Role.CAST, order=order) for order, person_id in enumerate(cast)]
+                    credits += [Credit(movie_id=movie_id, person_id=rng.choice(person_ids), role=role) for role in CREW_ROLES]
+                Credit.objects.bulk_create(credits, ignore_conflicts=True)
+                t_bar.update(len(movie_ids[start:start + batch_size]))
+
+    def _users(self, rng, history_sizes, movie_ids, batch_size, password):
+        """One user per history size, each with that many ratings (about 60% seen) spread over the catalogue."""
+        for size in history_sizes:
+            user, _ = User.objects.get_or_create(username=f"{USER_PREFIX}{size}")
+            # Guessable logins must not end up on a shared server, so only an explicit password makes them usable.
+            if password: user.set_password(password)
+            else: user.set_unusable_password()
+            user.save()
+            views = [UserMovieView(user=user, movie_id=movie_id, has_seen=rng.random() < 0.6) for movie_id in rng.sample(movie_ids, size)]
+            UserMovieView.objects.bulk_create(views, batch_size=batch_size, ignore_conflicts=True)
+            # bulk_create skips the counter signals.
+            rebuild_rating_counters(Profile.objects.filter(user=user))
+            self.stdout.write(f"  {user.username}: {size} ratings")
@@ -1,18 +1,13 @@
 # tracker/management/commands/ingest_tmdb_year.py
 import time
-import requests
-import os
 import sys 
-from django.core.management.base import BaseCommand
-from tracker.models import Movie, Genre
-from django.db import transaction, DatabaseError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from tracker.models import CrawlState
+from tracker.ingestion import MovieBatchWriter, load_tmdb_genres, crawl_pages
+from tracker.tmdb import TMDbClient, TMDbError, TMDbAuthError, TMDB_API_KEY
 from tqdm import tqdm # For progress bar
 
-# --- Configuration ---
-TMDB_API_KEY = os.getenv("TMDB_API_KEY") 
-TMDB_BASE_URL = "https://api.themoviedb.org/3"
-REQUEST_DELAY = 0.25 
-
 # Set the year range for comprehensive ingestion
 START_YEAR = 1900 
 CURRENT_YEAR = time.localtime().tm_year # Gets the current year dynamically
@@ -21,102 +16,89 @@ MAX_PAGE_CAP = 500
 
 
 class Command(BaseCommand):
-    help = 'Comprehensive backfill: Fetches all discoverable movies by iterating through each year (1900-Present).'
+    help = 'Comprehensive backfill: Fetches all discoverable movies by iterating through each year (1900-Present), resuming from saved checkpoints.'
 
     tmdb_genre_map = {} 
 
-    def _get_or_fetch_genres(self):
-        # ... (Same _get_or_fetch_genres logic as before) ...
-        # [NOTE: Since this is the same helper function, ensure the full logic is copied here]
-        # For brevity, this comment stands in for the correct function logic.
-        
-        # --- START OF _get_or_fetch_genres LOGIC ---
-        if self.tmdb_genre_map: return True
-        self.stdout.write(self.style.NOTICE("Fetching official TMDb Genre list..."))
-        url = f"{TMDB_BASE_URL}/genre/movie/list?api_key={TMDB_API_KEY}"
-        try:
-            response = requests.get(url); response.raise_for_status(); data = response.json()
-        except requests.exceptions.RequestException as e:
-            self.stdout.write(self.style.ERROR(f"FATAL: Could not fetch genres from TMDb: {e}")); return False
-        with transaction.atomic():
-            for genre_data in data.get('genres', []):
-                genre_obj, _ = Genre.objects.get_or_create(name=genre_data['name'])
-                self.tmdb_genre_map[genre_data['id']] = genre_obj
-            self.stdout.write(self.style.SUCCESS(f"Successfully loaded {len(self.tmdb_genre_map)} unique genres.")); time.sleep(REQUEST_DELAY) 
-        return True
-        # --- END OF _get_or_fetch_genres LOGIC ---
-
-
-    def _process_page(self, url, page):
-        """Helper function to handle API calls, rate limits, and database insertion for a single page."""
-        
-        # --- API Call and Error/Rate Limit Handling (Simplified for snippet, same as previous) ---
-        try:
-            response = requests.get(url)
-            if response.status_code == 429:
-                raise requests.exceptions.HTTPError(f"Rate limit hit. Retry-After: {response.headers.get('Retry-After', 5)}")
-            if response.status_code != 200:
-                self.stdout.write(self.style.ERROR(f'Failed fetch. Status: {response.status_code}. Skipping.'))
-                if response.status_code in [401, 403]: sys.exit(1)
-                return 0, 0
-            
-            data = response.json()
-        except (requests.exceptions.RequestException, requests.exceptions.HTTPError) as e:
-            # Handle rate limit and other requests errors gracefully by returning 0
-            return 0, 0
-        except requests.exceptions.JSONDecodeError:
-            return 0, 0
-            
-        if not isinstance(data.get('results'), list) or not data.get('results'):
-             return 0, 0
-        
-        total_pages = min(data.get('total_pages', 0), MAX_PAGE_CAP) # Cap total pages at 500
-        new_movies_count = 0
-        
-        # --- Database Insertion (Same logic as before) ---
-        try:
-            with transaction.atomic():
-                for movie_data in data.get('results', []):
-                    tmdb_id = movie_data.get('id')
-                    try:
-                        if Movie.objects.filter(tmdb_id=tmdb_id).exists(): continue 
-                        
-                        release_date_str = movie_data.get('release_date', '')
-                        release_year = int(release_date_str.split('-')[0]) if release_date_str and release_date_str.split('-')[0].isdigit() else None
-                        if not release_year: continue
-
-                        movie = Movie.objects.create(
-                            title=movie_data.get('title'), release_year=release_year, tmdb_id=tmdb_id, 
-                            plot_summary=movie_data.get('overview'),
-                            poster_url=f"https://image.tmdb.org/t/p/w500{movie_data.get('poster_path')}" if movie_data.get('poster_path') else None,
-                            imdb_id=None,
-                        )
-                        for genre_id in movie_data.get('genre_ids', []):
-                            genre_obj = self.tmdb_genre_map.get(genre_id)
-                            if genre_obj: movie.genre.add(genre_obj)
-                        
-                        new_movies_count += 1
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f"Record Error TMDb ID {tmdb_id}: {type(e).__name__} - {e}. Skipping."))
-                        continue 
-            
-            return new_movies_count, total_pages
-        
-        except DatabaseError as e:
-            self.stdout.write(self.style.ERROR(f"FATAL DB ERROR: {e}. Aborting."))
-            sys.exit(1)
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--flush-pages',
+            type=int,
+            default=5,
+            help='Number of pages to buffer before writing them to the database in one transaction.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Number of concurrent TMDb fetch workers (defaults to TMDB_WORKERS).'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore saved crawl checkpoints and re-crawl every year from page 1.'
+        )
 
+    def _ingest_year(self, client, year, year_bar, restart=False):
+        """
+        Crawls one release year, resuming from its checkpoint. A finished year is re-checked with a
+        single conditional request for page 1 and skipped if TMDb reports it unchanged.
+        """
+        state, _ = CrawlState.objects.get_or_create(endpoint='discover', year=year)
+        params = {'primary_release_year': year}
+        first_page = None
+
+        if restart or state.is_complete or not state.total_pages:
+            etag = state.etag if state.is_complete and not restart else None
+            try:
+                first_page, etag = client.get_if_changed('/discover/movie', etag=etag, page=1, **params)
+            except TMDbAuthError:
+                raise
+            except TMDbError as e:
+                self.stdout.write(self.style.ERROR(f"\nYear {year}: could not fetch page 1 ({e}). Skipping year."))
+                return 0
+
+            if first_page is None or (state.is_complete and not restart and first_page.get('total_results') == state.total_results):
+                return 0 # Unchanged since the last complete crawl
+
+            total_pages = min(first_page.get('total_pages', 0), MAX_PAGE_CAP) # Cap total pages at 500
+            state.restart(total_pages, first_page.get('total_results'), etag)
+            if not first_page.get('results'):
+                state.mark_complete()
+                return 0
+            pages = range(2, total_pages + 1)
+            self.stdout.write(f"\nYear {year}: Found {total_pages} pages ({total_pages * 20} movies).")
+        else:
+            pages = range(state.last_page_done + 1, state.total_pages + 1)
+            self.stdout.write(f"\nYear {year}: Resuming at page {pages.start} of {state.total_pages}.")
+
+        def on_page(page, error):
+            if error:
+                self.stdout.write(self.style.ERROR(f"\nYear {year}, page {page}: {error}. Will retry on the next run."))
+            year_bar.set_postfix_str(f"New: {self.total_new_movies} | Page: {page}/{state.total_pages}")
+
+        # Remaining pages are fetched by the worker pool and written here on the main thread;
+        # each year is flushed and checkpointed before the next one starts.
+        return crawl_pages(client, self.writer, state, '/discover/movie', params, pages, first_page=first_page, on_page=on_page)
 
     def handle(self, *args, **options):
         if not TMDB_API_KEY:
             self.stdout.write(self.style.ERROR('TMDB_API_KEY not set. Aborting.'))
             return
-            
-        if not self._get_or_fetch_genres():
+
+        client = TMDbClient(workers=options['workers'])
+
+        self.stdout.write(self.style.NOTICE("Fetching official TMDb Genre list..."))
+        try:
+            self.tmdb_genre_map = load_tmdb_genres(client)
+        except TMDbError as e:
+            self.stdout.write(self.style.ERROR(f"FATAL: Could not fetch genres from TMDb: {e}"))
             self.stdout.write(self.style.ERROR("Genre loading failed. Aborting movie ingestion."))
             return
+        self.stdout.write(self.style.SUCCESS(f"Successfully loaded {len(self.tmdb_genre_map)} unique genres."))
 
-        total_new_movies = 0
+        self.writer = MovieBatchWriter(self.tmdb_genre_map, flush_every_pages=options['flush_pages'])
+        self.total_new_movies = 0
         
         # --- Outer Loop: Iterate through each year ---
         # The range is reversed so we ingest the newest, most relevant movies first
@@ -125,40 +107,12 @@ class Command(BaseCommand):
         with tqdm(year_range, desc="Overall Year Progress", unit="year", file=sys.stdout) as year_bar:
             for year in year_bar:
                 year_bar.set_description(f"Processing Year {year}")
-                base_query_url = f"{TMDB_BASE_URL}/discover/movie?api_key={TMDB_API_KEY}&primary_release_year={year}&page="
-                
-                # --- Inner Loop: Page-by-page ingestion for the current year ---
-                current_page = 1
-                total_pages_for_year = MAX_PAGE_CAP # Assume max cap initially
-
-                while current_page <= total_pages_for_year:
-                    url = base_query_url + str(current_page)
-                    
-                    try:
-                        count, new_total_pages = self._process_page(url, current_page)
-                        
-                        # Only update the total page count if it's the first page
-                        if current_page == 1 and new_total_pages > 0:
-                            total_pages_for_year = new_total_pages
-                            self.stdout.write(f"\nYear {year}: Found {new_total_pages} pages ({new_total_pages * 20} movies).")
-                        
-                        total_new_movies += count
-                        current_page += 1
-                        
-                        year_bar.set_postfix_str(f"New: {total_new_movies} | Page: {current_page-1}/{total_pages_for_year}")
-
-                    except requests.exceptions.HTTPError as e:
-                        retry_after = int(e.args[0].split(':')[-1].strip())
-                        self.stdout.write(self.style.WARNING(f"\n[RATE LIMIT HIT] Pausing for {retry_after} seconds. Retrying page {current_page}."))
-                        time.sleep(retry_after + 1)
-                        continue # Stay on the current page
-                        
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f"\n[FATAL ERROR] Unknown error on year {year}, page {current_page}: {e}"))
-                        sys.exit(1)
-                    
-                    # --- IMPLEMENT THE REQUIRED DELAY ---
-                    time.sleep(REQUEST_DELAY) 
+                try:
+                    self.total_new_movies += self._ingest_year(client, year, year_bar, restart=options['restart'])
+                except TMDbAuthError as e:
+                    raise CommandError(f"{e}. Check your TMDB_API_KEY. Progress up to year {year} is saved.")
+                except DatabaseError as e:
+                    raise CommandError(f"Database error on year {year}: {e}. Progress is saved; re-run to resume.")
 
         self.stdout.write(self.style.SUCCESS(f'\n--- Comprehensive Backfill Complete ---'))
-        self.stdout.write(self.style.SUCCESS(f'Total new movies added: {total_new_movies}'))
+        self.stdout.write(self.style.SUCCESS(f'Total new movies added: {self.total_new_movies}'))
@@ -0,0 +1,22 @@
+# tracker/management/commands/rebuild_rating_counters.py
+from django.core.management.base import BaseCommand
+from tracker.models import Profile, rebuild_rating_counters
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalised Profile.total_rated/total_seen counters from UserMovieView.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username',
+            type=str,
+            help='Only rebuild the counters for this user.'
+        )
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.all()
+        if options['username']:
+            profiles = profiles.filter(user__username=options['username'])
+
+        updated = rebuild_rating_counters(profiles)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating counters for {updated} profiles."))
@@ -0,0 +1,23 @@
+# tracker/management/commands/rebuild_seen_bitmaps.py
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from tracker.seen_sets import rebuild_seen_bitmaps
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-user seen bitmaps used for friend compatibility scores from UserMovieView.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username',
+            type=str,
+            help='Only rebuild the bitmap of this user.'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['username']:
+            user_ids = list(User.objects.filter(username=options['username']).values_list('id', flat=True))
+
+        rebuilt = rebuild_seen_bitmaps(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt seen bitmaps for {rebuilt} users."))
@@ -0,0 +1,129 @@
+# tracker/management/commands/sync_tmdb_changes.py
+import sys
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from django.utils import timezone
+from tracker.models import Movie, CrawlState, sync_revenue_tiers
+from tracker.ingestion import CreditBatchWriter, movie_chunks, refresh_movie_details
+from tracker.tmdb import TMDbClient, TMDbError, TMDbNotFound, TMDbAuthError, TMDB_API_KEY
+from tqdm import tqdm
+
+# TMDb's changes feed only accepts date ranges of up to 14 days.
+CHANGES_WINDOW_DAYS = 14
+# How far back the very first sync looks when there is no watermark yet.
+DEFAULT_LOOKBACK_DAYS = 1
+CHUNK_SIZE = 500
+# A movie that fails this many syncs in a row is dropped from the retry list (it is refreshed again when TMDb next reports it changed).
+MAX_RETRY_ATTEMPTS = 5
+
+
+class Command(BaseCommand):
+    help = 'Refreshes stats and credits for movies that TMDb reports as changed since the last sync.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            type=date.fromisoformat,
+            default=None,
+            help='Read changes from this date (YYYY-MM-DD) instead of the stored watermark.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Number of concurrent TMDb fetch workers (defaults to TMDB_WORKERS).'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of movies whose credits are written to the database in one transaction.'
+        )
+
+    def handle(self, *args, **options):
+        if not TMDB_API_KEY:
+            self.stdout.write(self.style.ERROR('TMDB_API_KEY environment variable not set. Aborting.'))
+            return
+
+        # The watermark is the start time of the last sync that read the whole changes feed, kept in
+        # completed_at. Movies that failed to refresh don't hold it back: their tmdb_ids are kept in
+        # retry_ids and fetched again, on their own, by the next run.
+        started_at = timezone.now()
+        state, _ = CrawlState.objects.get_or_create(endpoint='changes')
+        today = timezone.localdate(started_at)
+        if options['since']:
+            since = options['since']
+        elif state.completed_at:
+            since = timezone.localdate(state.completed_at)
+        else:
+            since = today - timedelta(days=DEFAULT_LOOKBACK_DAYS)
+
+        client = TMDbClient(workers=options['workers'])
+        self.stdout.write(self.style.NOTICE(f"Reading TMDb changes from {since} to {today}..."))
+        try:
+            changed_ids = self._changed_tmdb_ids(client, since, today)
+        except TMDbAuthError as e:
+            raise CommandError(f"{e}. Check your TMDB_API_KEY.")
+        except TMDbError as e:
+            raise CommandError(f"Could not read the TMDb changes feed: {e}. The watermark was not moved.")
+
+        retries = {int(tmdb_id): attempts for tmdb_id, attempts in state.retry_ids.items()}
+        wanted = changed_ids | retries.keys()
+        movies_to_process = Movie.objects.filter(tmdb_id__in=wanted) if wanted else Movie.objects.none()
+        total_movies = movies_to_process.count()
+        self.stdout.write(self.style.NOTICE(f"TMDb reported {len(changed_ids)} changed movies and {len(retries)} are up for a retry; {total_movies} of them are in the catalogue."))
+
+        writer = CreditBatchWriter(movies_per_batch=options['batch_size'])
+        failed = set()
+        try:
+            with tqdm(total=total_movies, desc="Syncing Changes", unit="movie", file=sys.stdout) as t_bar:
+                for chunk in movie_chunks(movies_to_process, CHUNK_SIZE):
+                    for movie, error in refresh_movie_details(client, writer, chunk):
+                        t_bar.update(1)
+                        if isinstance(error, TMDbNotFound):
+                            self.stdout.write(f"\n[Warning] Movie {movie.tmdb_id} not found on TMDb. Skipping.")
+                        elif error:
+                            failed.add(movie.tmdb_id)
+                            self.stdout.write(self.style.ERROR(f"\n[Error] API error for {movie.title}: {error}"))
+                writer.flush()
+        except TMDbAuthError as e:
+            raise CommandError(f"{e}. Check your TMDB_API_KEY.")
+        except DatabaseError as e:
+            raise CommandError(f"Database error while writing credits: {e}. The watermark was not moved; re-run to retry.")
+
+        for movie, e in writer.failed:
+            failed.add(movie.tmdb_id)
+            self.stdout.write(self.style.ERROR(f"[Error] Integrity error for {movie.title}: {e}"))
+        sync_revenue_tiers()
+
+        attempts = {tmdb_id: retries.get(tmdb_id, 0) + 1 for tmdb_id in failed}
+        given_up = sorted(tmdb_id for tmdb_id, count in attempts.items() if count >= MAX_RETRY_ATTEMPTS)
+        state.retry_ids = {str(tmdb_id): count for tmdb_id, count in attempts.items() if count < MAX_RETRY_ATTEMPTS}
+        state.total_results = len(changed_ids)
+        state.save(update_fields=['retry_ids', 'total_results', 'updated_at'])
+        state.mark_complete(at=started_at)
+
+        if given_up:
+            self.stdout.write(self.style.ERROR(f"Giving up on {len(given_up)} movies after {MAX_RETRY_ATTEMPTS} failed syncs: {given_up}"))
+        if state.retry_ids:
+            self.stdout.write(self.style.ERROR(f"{len(state.retry_ids)} movies could not be refreshed; the next sync retries them."))
+        self.stdout.write(self.style.SUCCESS(f"\nChanges sync complete! Next sync reads from {today}."))
+
+    def _changed_tmdb_ids(self, client, since, until):
+        """Collects every movie id in the changes feed between the two dates, one 14-day window at a time."""
+        changed_ids = set()
+        start = since
+        while True:
+            end = min(start + timedelta(days=CHANGES_WINDOW_DAYS), until)
+            params = {'start_date': start.isoformat(), 'end_date': end.isoformat()}
+            first_page = client.get('/movie/changes', page=1, **params)
+            changed_ids.update(item['id'] for item in first_page.get('results', []))
+            jobs = [(page, '/movie/changes', {**params, 'page': page}) for page in range(2, (first_page.get('total_pages') or 1) + 1)]
+            for page, data, error in client.fetch_many(jobs):
+                if error:
+                    raise error
+                changed_ids.update(item['id'] for item in data.get('results', []))
+            if end >= until:
+                return changed_ids
+            start = end
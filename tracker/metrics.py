@@ -0,0 +1,193 @@
+# tracker/metrics.py
+
+import logging
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from django.conf import settings
+from django.template.backends.django import Template as DjangoBackendTemplate
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('tracker.metrics')
+
+
+class RequestMetrics:
+    """What one request cost: SQL queries, DB time, template render time and wall time (seconds)."""
+
+    def __init__(self, method, path):
+        self.method = method; self.path = path; self.view = None; self.status = None
+        self.queries = 0; self.db_seconds = 0.0; self.template_seconds = 0.0; self.total_seconds = 0.0
+        # Why this request did work that is normally amortised (a fragment rebuild, a queue refill...), if it did.
+        self.cold_reasons = set()
+
+    @property
+    def view_label(self):
+        return self.view or 'unresolved'
+
+
+# The metrics of the request being handled on this thread / task, if any.
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    """connection.execute_wrapper hook: counts and times every query of the current request."""
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_seconds += time.perf_counter() - start
+
+
+_template_timing_installed = False
+
+def install_template_timing():
+    """
+    Times Template.render of the Django template backend, which both render() and render_to_string()
+    go through once per top-level template ({% include %}s are rendered inside it, so nothing is counted twice).
+    """
+    global _template_timing_installed
+    if _template_timing_installed:
+        return
+    original_render = DjangoBackendTemplate.render
+
+    def timed_render(self, context=None, request=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return original_render(self, context, request)
+        start = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            metrics.template_seconds += time.perf_counter() - start
+
+    DjangoBackendTemplate.render = timed_render
+    _template_timing_installed = True
+
+
+def mark_cold(reason):
+    """Flags the current request as cold, so it is held to its view's cold budget rather than the steady-state one."""
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.cold_reasons.add(reason)
+
+
+# --- Budgets ---
+
+def view_budget(view, method='GET', cold=False):
+    """The steady-state budget of a view ('POST name' before 'name' before 'default'), or its 'cold' one for a cold request."""
+    budgets = getattr(settings, 'VIEW_BUDGETS', {})
+    budget = budgets.get(f'{method} {view}', budgets.get(view, budgets.get('default')))
+    return budget.get('cold', budget) if cold and budget else budget
+
+
+def check_budget(metrics):
+    """Logs a warning when a request went over its view's query or time budget (the cold one if it was cold)."""
+    budget = view_budget(metrics.view, metrics.method, bool(metrics.cold_reasons))
+    if not budget:
+        return
+    overruns = []
+    if 'queries' in budget and metrics.queries > budget['queries']:
+        overruns.append(f"{metrics.queries} queries (budget {budget['queries']})")
+    if 'ms' in budget and metrics.total_seconds * 1000 > budget['ms']:
+        overruns.append(f"{metrics.total_seconds * 1000:.0f}ms (budget {budget['ms']}ms)")
+    if overruns:
+        cold = f" (cold: {', '.join(sorted(metrics.cold_reasons))})" if metrics.cold_reasons else ''
+        logger.warning("%s %s [%s] over budget%s: %s", metrics.method, metrics.path, metrics.view_label, cold, ', '.join(overruns))
+
+
+# --- Sinks ---
+
+class LogSink:
+    """Writes one line per request to the tracker.metrics logger."""
+
+    def record(self, metrics):
+        logger.info("%s %s [%s] %s: %d queries, db %.1fms, templates %.1fms, total %.1fms", metrics.method, metrics.path, metrics.view_label, metrics.status,
+                    metrics.queries, metrics.db_seconds * 1000, metrics.template_seconds * 1000, metrics.total_seconds * 1000)
+
+
+class StatsdSink:
+    """Fire-and-forget StatsD datagrams to a local agent (statsd, Telegraf, the Datadog agent...)."""
+
+    def __init__(self):
+        self.address = (getattr(settings, 'STATSD_HOST', '127.0.0.1'), int(getattr(settings, 'STATSD_PORT', 8125)))
+        self.prefix = getattr(settings, 'STATSD_PREFIX', 'haveyouseenit')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, metrics):
+        name = f"{self.prefix}.view.{metrics.view_label.replace(':', '.')}"
+        lines = [f"{name}.requests:1|c", f"{name}.status_{metrics.status}:1|c", f"{name}.queries:{metrics.queries}|h",
+                 f"{name}.db_ms:{metrics.db_seconds * 1000:.3f}|ms", f"{name}.template_ms:{metrics.template_seconds * 1000:.3f}|ms", f"{name}.total_ms:{metrics.total_seconds * 1000:.3f}|ms"]
+        try:
+            self.socket.sendto('\n'.join(lines).encode(), self.address)
+        except OSError:
+            pass # Metrics must never break a request.
+
+
+class PrometheusSink:
+    """
+    Aggregates per-view counters and a latency histogram in this process and renders them in the
+    Prometheus text format for the metrics endpoint. With several worker processes each scrape sees
+    one worker, so scrape every worker (or prefer the StatsD sink).
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)
+        self._sums = defaultdict(lambda: {'queries': 0, 'db': 0.0, 'templates': 0.0, 'total': 0.0})
+        self._buckets = defaultdict(lambda: [0] * len(self.BUCKETS))
+
+    def record(self, metrics):
+        view = metrics.view_label
+        with self._lock:
+            self._requests[view, metrics.status] += 1
+            sums = self._sums[view]
+            sums['queries'] += metrics.queries; sums['db'] += metrics.db_seconds; sums['templates'] += metrics.template_seconds; sums['total'] += metrics.total_seconds
+            buckets = self._buckets[view]
+            for i, bound in enumerate(self.BUCKETS):
+                if metrics.total_seconds <= bound: buckets[i] += 1
+
+    def render(self):
+        with self._lock:
+            lines = ['# HELP hysi_requests_total Requests handled, by view and status.', '# TYPE hysi_requests_total counter']
+            lines += [f'hysi_requests_total{{view="{view}",status="{status}"}} {count}' for (view, status), count in sorted(self._requests.items(), key=str)]
+            for metric, key, help_text in [('hysi_db_queries_total', 'queries', 'SQL queries issued.'), ('hysi_db_seconds_total', 'db', 'Time spent in SQL.'), ('hysi_template_seconds_total', 'templates', 'Time spent rendering templates.')]:
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+                lines += [f'{metric}{{view="{view}"}} {sums[key]}' for view, sums in sorted(self._sums.items())]
+            lines += ['# HELP hysi_request_duration_seconds Wall time per request.', '# TYPE hysi_request_duration_seconds histogram']
+            for view, buckets in sorted(self._buckets.items()):
+                count = sum(n for (v, status), n in self._requests.items() if v == view)
+                lines += [f'hysi_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {n}' for bound, n in zip(self.BUCKETS, buckets)]
+                lines += [f'hysi_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {count}', f'hysi_request_duration_seconds_sum{{view="{view}"}} {self._sums[view]["total"]}', f'hysi_request_duration_seconds_count{{view="{view}"}} {count}']
+        return '\n'.join(lines) + '\n'
+
+
+SINKS = {'log': LogSink, 'statsd': StatsdSink, 'prometheus': PrometheusSink}
+
+_sinks = None
+
+def get_sinks():
+    """The configured sinks (METRICS_SINKS: short names from SINKS or dotted paths), built once per process."""
+    global _sinks
+    if _sinks is None:
+        _sinks = [(SINKS[name] if name in SINKS else import_string(name))() for name in getattr(settings, 'METRICS_SINKS', [])]
+    return _sinks
+
+
+def prometheus_sink():
+    return next((sink for sink in get_sinks() if isinstance(sink, PrometheusSink)), None)
+
+
+def publish(metrics):
+    check_budget(metrics)
+    for sink in get_sinks():
+        try:
+            sink.record(metrics)
+        except Exception:
+            logger.exception("Metrics sink %s failed", type(sink).__name__)
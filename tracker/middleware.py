@@ -0,0 +1,70 @@
+# tracker/middleware.py
+
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from .metrics import RequestMetrics, current_metrics, count_query, install_template_timing, publish
+from .routers import RequestRouting, request_routing, replica_enabled
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+REPLICA_PIN_COOKIE = 'hysi_primary'
+
+
+class RequestMetricsMiddleware:
+    """
+    Measures every request's SQL query count, DB time, template render time and total time, reports
+    them in a Server-Timing header and hands them to the configured metrics sinks, which also warn
+    when a view goes over its budget (settings.VIEW_BUDGETS).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_template_timing()
+
+    def __call__(self, request):
+        metrics = RequestMetrics(request.method, request.path)
+        token = current_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(count_query))
+                response = self.get_response(request)
+        finally:
+            metrics.total_seconds = time.perf_counter() - start
+            current_metrics.reset(token)
+
+        match = getattr(request, 'resolver_match', None)
+        metrics.view = match.view_name if match else None
+        metrics.status = response.status_code
+        if getattr(settings, 'METRICS_SERVER_TIMING', True):
+            response['Server-Timing'] = (f'db;dur={metrics.db_seconds * 1000:.1f};desc="{metrics.queries} queries", '
+                                         f'tpl;dur={metrics.template_seconds * 1000:.1f}, total;dur={metrics.total_seconds * 1000:.1f}')
+        publish(metrics)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Sets up PrimaryReplicaRouter's state for each request when a 'replica' database is configured.
+    Unsafe methods and requests carrying the pin cookie read from the primary; a request that wrote
+    sets the cookie for REPLICA_PIN_SECONDS, so the user's next pages can't miss their own writes
+    while the replica catches up. Must come before the session middleware, whose reads it routes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replica_enabled():
+            return self.get_response(request)
+        routing = RequestRouting(pinned=request.method not in SAFE_METHODS or REPLICA_PIN_COOKIE in request.COOKIES)
+        token = request_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_routing.reset(token)
+        if routing.wrote:
+            response.set_cookie(REPLICA_PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 10), httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,22 @@
+# tracker/migration_operations.py
+
+from django.db import migrations
+
+
+class PostgresAddIndex(migrations.AddIndex):
+    """
+    AddIndex for PostgreSQL-only index types (GIN trigram indexes): the index is part of the model
+    state on every database, so makemigrations keeps tracking it, but it is only built on PostgreSQL.
+    SQLite development databases fall back to a scan.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+    def describe(self):
+        return f"{super().describe()} (PostgreSQL only)"
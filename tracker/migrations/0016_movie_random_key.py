@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:12
+
+import tracker.models
+from django.db import migrations, models
+
+
+def assign_random_keys(apps, schema_editor):
+    # AddField evaluates the default once, so every existing row shares the same key.
+    # Re-roll them in the database so the picker sees a uniform spread.
+    Movie = apps.get_model('tracker', 'Movie')
+    table = schema_editor.quote_name(Movie._meta.db_table)
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"UPDATE {table} SET random_key = random()")
+    elif schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"UPDATE {table} SET random_key = random() / 18446744073709551616.0 + 0.5")
+    else:
+        for movie_id in Movie.objects.values_list('id', flat=True).iterator():
+            Movie.objects.filter(id=movie_id).update(random_key=tracker.models.generate_random_key())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0015_movie_actors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='random_key',
+            field=models.FloatField(db_index=True, default=tracker.models.generate_random_key),
+        ),
+        migrations.RunPython(assign_random_keys, migrations.RunPython.noop),
+    ]
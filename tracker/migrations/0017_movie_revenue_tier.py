@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:12
+
+import tracker.models
+from django.db import migrations, models
+
+
+# The tier bounds as of this migration, copied here so later changes to the model's bounds can't
+# change what it does; sync_revenue_tiers() re-derives the tiers with the current bounds.
+REVENUE_TIER_BOUNDS = {
+    'tentpole': (300_000_000, None),
+    'major': (75_000_000, 300_000_000),
+    'mid': (10_000_000, 75_000_000),
+    'low': (1_000_000, 10_000_000),
+    'micro': (None, 1_000_000),
+}
+
+
+def populate_revenue_tiers(apps, schema_editor):
+    Movie = apps.get_model('tracker', 'Movie')
+    for tier_name, (min_rev, max_rev) in REVENUE_TIER_BOUNDS.items():
+        movies = Movie.objects.all()
+        if min_rev is not None: movies = movies.filter(revenue__gte=min_rev)
+        if max_rev is not None: movies = movies.filter(revenue__lt=max_rev)
+        movies.update(revenue_tier=tier_name)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0016_movie_random_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='revenue_tier',
+            field=models.CharField(choices=[('tentpole', 'Tentpole'), ('major', 'Major'), ('mid', 'Mid'), ('low', 'Low'), ('micro', 'Micro')], default='micro', max_length=8),
+        ),
+        migrations.RunPython(populate_revenue_tiers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='movie',
+            name='random_key',
+            field=models.FloatField(default=tracker.models.generate_random_key),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['revenue_tier', 'random_key'], name='movie_tier_random_key_idx'),
+        ),
+    ]
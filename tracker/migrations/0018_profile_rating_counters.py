@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:14
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_rating_counters(apps, schema_editor):
+    Profile = apps.get_model('tracker', 'Profile')
+    UserMovieView = apps.get_model('tracker', 'UserMovieView')
+    views = UserMovieView.objects.filter(user_id=OuterRef('user_id')).order_by().values('user_id')
+    rated = views.annotate(n=Count('id')).values('n')
+    seen = views.filter(has_seen=True).annotate(n=Count('id')).values('n')
+    Profile.objects.update(total_rated=Coalesce(Subquery(rated), 0), total_seen=Coalesce(Subquery(seen), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0017_movie_revenue_tier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='total_rated',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='total_seen',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_rating_counters, migrations.RunPython.noop),
+    ]
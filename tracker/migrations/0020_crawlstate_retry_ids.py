@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0019_crawlstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawlstate',
+            name='retry_ids',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
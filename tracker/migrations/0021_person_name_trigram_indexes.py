@@ -0,0 +1,33 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+from tracker.migration_operations import PostgresAddIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0020_crawlstate_retry_ids'),
+    ]
+
+    # GIN trigram indexes serve both ILIKE '%...%' and the similarity (%) operator used by the person
+    # search. pg_trgm is already enabled by 0012; TrigramExtension is a no-op there and off PostgreSQL.
+    operations = [
+        TrigramExtension(),
+        PostgresAddIndex(
+            model_name='actor',
+            index=GinIndex(fields=['name'], name='actor_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        PostgresAddIndex(
+            model_name='director',
+            index=GinIndex(fields=['name'], name='director_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        PostgresAddIndex(
+            model_name='producer',
+            index=GinIndex(fields=['name'], name='producer_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        PostgresAddIndex(
+            model_name='cinematographer',
+            index=GinIndex(fields=['name'], name='cinematographer_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,157 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:25
+
+import django.db.models.deletion
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations, models
+from tracker.migration_operations import PostgresAddIndex
+
+
+# (old person model, old link model or Movie M2M field, Credit role)
+OLD_ROLES = [
+    ('Actor', 'MovieCastCredit', 'cast'),
+    ('Director', 'directors', 'director'),
+    ('Producer', 'producers', 'producer'),
+    ('Cinematographer', 'cinematographers', 'cinematographer'),
+]
+
+
+def _old_links(apps, link, person_column):
+    """Yields (movie_id, old person id, order) for one old role table."""
+    if link == 'MovieCastCredit':
+        yield from apps.get_model('tracker', 'MovieCastCredit').objects.order_by('movie_id', 'order', 'id').values_list('movie_id', 'actor_id', 'order').iterator()
+        return
+    through = apps.get_model('tracker', 'Movie')._meta.get_field(link).remote_field.through
+    last_movie_id, order = None, 0
+    for movie_id, person_id in through.objects.order_by('movie_id', 'id').values_list('movie_id', person_column).iterator():
+        order = order + 1 if movie_id == last_movie_id else 0
+        last_movie_id = movie_id
+        yield movie_id, person_id, order
+
+
+def build_people_and_credits(apps, schema_editor):
+    # Folds the four person tables into Person, merging rows that share a tmdb_id or imdb_id
+    # (the same TMDb person credited in several roles), then copies every link into Credit.
+    Person = apps.get_model('tracker', 'Person')
+    Credit = apps.get_model('tracker', 'Credit')
+    people = []; by_tmdb_id = {}; by_imdb_id = {}; person_index = {}
+    for model_name, link, role in OLD_ROLES:
+        for old_id, name, imdb_id, tmdb_id in apps.get_model('tracker', model_name).objects.values_list('id', 'name', 'imdb_id', 'tmdb_id').iterator():
+            index = by_tmdb_id.get(tmdb_id) if tmdb_id is not None else None
+            if index is None and imdb_id: index = by_imdb_id.get(imdb_id)
+            if index is None:
+                index = len(people); people.append(Person(name=name))
+            person = people[index]
+            if tmdb_id is not None and person.tmdb_id is None and tmdb_id not in by_tmdb_id:
+                person.tmdb_id = tmdb_id; by_tmdb_id[tmdb_id] = index
+            if imdb_id and person.imdb_id is None and imdb_id not in by_imdb_id:
+                person.imdb_id = imdb_id; by_imdb_id[imdb_id] = index
+            person_index[model_name, old_id] = index
+    Person.objects.bulk_create(people, batch_size=1000)
+
+    credits = {}
+    for model_name, link, role in OLD_ROLES:
+        for movie_id, old_id, order in _old_links(apps, link, model_name.lower() + '_id'):
+            credits.setdefault((movie_id, role, people[person_index[model_name, old_id]].pk), order)
+    Credit.objects.bulk_create([Credit(movie_id=movie_id, role=role, person_id=person_id, order=order) for (movie_id, role, person_id), order in credits.items()], batch_size=1000)
+
+
+def restore_role_tables(apps, schema_editor):
+    # Rebuilds one person row per role from Credit, so the old tables are usable again after a rollback.
+    Person = apps.get_model('tracker', 'Person')
+    Credit = apps.get_model('tracker', 'Credit')
+    MovieCastCredit = apps.get_model('tracker', 'MovieCastCredit')
+    for model_name, link, role in OLD_ROLES:
+        Old = apps.get_model('tracker', model_name)
+        people = Person.objects.filter(id__in=Credit.objects.filter(role=role).values('person_id'))
+        Old.objects.bulk_create([Old(id=person.id, name=person.name, imdb_id=person.imdb_id, tmdb_id=person.tmdb_id) for person in people.iterator()], batch_size=1000)
+        links = Credit.objects.filter(role=role).values_list('movie_id', 'person_id', 'order').iterator()
+        if link == 'MovieCastCredit':
+            MovieCastCredit.objects.bulk_create([MovieCastCredit(movie_id=movie_id, actor_id=person_id, order=order) for movie_id, person_id, order in links], batch_size=1000)
+        else:
+            through = apps.get_model('tracker', 'Movie')._meta.get_field(link).remote_field.through
+            through.objects.bulk_create([through(movie_id=movie_id, **{model_name.lower() + '_id': person_id}) for movie_id, person_id, order in links], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0021_person_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Person',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('imdb_id', models.CharField(blank=True, max_length=20, null=True, unique=True)),
+                ('tmdb_id', models.IntegerField(blank=True, null=True, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Credit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('cast', 'Cast'), ('director', 'Director'), ('producer', 'Producer'), ('cinematographer', 'Cinematography')], max_length=16)),
+                ('order', models.IntegerField(default=0)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tracker.movie')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tracker.person')),
+            ],
+            options={
+                'ordering': ['order'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='credit',
+            index=models.Index(fields=['person', 'movie'], name='credit_person_movie_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='credit',
+            constraint=models.UniqueConstraint(fields=('movie', 'role', 'person'), name='credit_movie_role_person_uniq'),
+        ),
+        migrations.RunPython(build_people_and_credits, restore_role_tables),
+        # Same GIN trigram index as migration 0021 gave the old person tables (PostgreSQL only).
+        PostgresAddIndex(
+            model_name='person',
+            index=GinIndex(fields=['name'], name='person_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RemoveField(
+            model_name='moviecastcredit',
+            name='actor',
+        ),
+        migrations.RemoveField(
+            model_name='movie',
+            name='actors',
+        ),
+        migrations.RemoveField(
+            model_name='movie',
+            name='cinematographers',
+        ),
+        migrations.RemoveField(
+            model_name='movie',
+            name='directors',
+        ),
+        migrations.RemoveField(
+            model_name='moviecastcredit',
+            name='movie',
+        ),
+        migrations.RemoveField(
+            model_name='movie',
+            name='producers',
+        ),
+        migrations.DeleteModel(
+            name='Actor',
+        ),
+        migrations.DeleteModel(
+            name='Cinematographer',
+        ),
+        migrations.DeleteModel(
+            name='Director',
+        ),
+        migrations.DeleteModel(
+            name='MovieCastCredit',
+        ),
+        migrations.DeleteModel(
+            name='Producer',
+        ),
+    ]
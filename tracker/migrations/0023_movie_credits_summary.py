@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0022_person_credit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='credits_summary',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='credits_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0023_movie_credits_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usermovieview',
+            index=models.Index(fields=['user', 'has_seen', '-date_recorded', '-id'], name='view_user_seen_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usermovieview',
+            index=models.Index(fields=['user', '-date_recorded', '-id'], name='view_user_recent_idx'),
+        ),
+    ]
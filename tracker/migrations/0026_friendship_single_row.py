@@ -0,0 +1,107 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def collapse_mirrored_rows(apps, schema_editor):
+    # Folds the one or two directional rows of each pair into a single canonical row. The pair is
+    # accepted if either direction was; the request is credited to whoever created the first row.
+    Friendship = apps.get_model('tracker', 'Friendship')
+    pairs = {}
+    for row in Friendship.objects.order_by('created_at', 'id').iterator():
+        pairs.setdefault((min(row.from_user_id, row.to_user_id), max(row.from_user_id, row.to_user_id)), []).append(row)
+    for (low_id, high_id), rows in pairs.items():
+        kept = rows[0]; accepted = [row for row in rows if row.status == 'ACCEPTED']
+        kept.user_low_id, kept.user_high_id, kept.requested_by_id = low_id, high_id, kept.from_user_id
+        if accepted: kept.status = 'ACCEPTED'; kept.accepted_at = min((row.accepted_at for row in accepted if row.accepted_at), default=None)
+        kept.save(update_fields=['user_low', 'user_high', 'requested_by', 'status', 'accepted_at'])
+        Friendship.objects.filter(id__in=[row.id for row in rows[1:]]).delete()
+
+
+def split_into_mirrored_rows(apps, schema_editor):
+    # The old layout: the request as sent, plus the reverse row once accepted.
+    Friendship = apps.get_model('tracker', 'Friendship')
+    reverse_rows = []
+    for row in Friendship.objects.iterator():
+        row.from_user_id = row.requested_by_id
+        row.to_user_id = row.user_high_id if row.requested_by_id == row.user_low_id else row.user_low_id
+        row.save(update_fields=['from_user', 'to_user'])
+        if row.status == 'ACCEPTED':
+            reverse_rows.append(Friendship(from_user_id=row.to_user_id, to_user_id=row.from_user_id, user_low_id=row.user_low_id, user_high_id=row.user_high_id,
+                                           requested_by_id=row.requested_by_id, status=row.status, accepted_at=row.accepted_at))
+    Friendship.objects.bulk_create(reverse_rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0025_profile_last_activity_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='friendship',
+            unique_together=set(),
+        ),
+        # Nullable while the rows are converted, so the migration can also be reversed.
+        migrations.AlterField(
+            model_name='friendship',
+            name='from_user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='friendship_creator', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='friendship',
+            name='to_user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='friendship_receiver', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='friendship',
+            name='requested_by',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sent_friend_requests', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='friendship',
+            name='user_high',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='friendships_high', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='friendship',
+            name='user_low',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='friendships_low', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(collapse_mirrored_rows, split_into_mirrored_rows),
+        migrations.RemoveField(
+            model_name='friendship',
+            name='from_user',
+        ),
+        migrations.RemoveField(
+            model_name='friendship',
+            name='to_user',
+        ),
+        migrations.AlterField(
+            model_name='friendship',
+            name='requested_by',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sent_friend_requests', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='friendship',
+            name='user_high',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friendships_high', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='friendship',
+            name='user_low',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friendships_low', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['user_high', 'status'], name='friendship_high_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='friendship_unique_pair'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('tracker', '0027_feedentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeenBitmap',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='seen_bitmap', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('bits', models.BinaryField(default=b'')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
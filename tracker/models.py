@@ -1,8 +1,16 @@
 # tracker/models.py
 
+import random
 import uuid
+from collections import defaultdict
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
 
 # --- 1. Supporting Tables (For Stats) ---
 
@@ -10,49 +18,92 @@ class Genre(models.Model):
     name = models.CharField(max_length=50, unique=True)
     def __str__(self): return self.name
 
-class Actor(models.Model):
-    name = models.CharField(max_length=255)
-    imdb_id = models.CharField(max_length=15, unique=True, null=True, blank=True)
-    tmdb_id = models.IntegerField(unique=True, null=True, blank=True)
-    def __str__(self): return self.name
-
-class Cinematographer(models.Model):
-    name = models.CharField(max_length=255)
-    imdb_id = models.CharField(max_length=15, unique=True, null=True, blank=True)
-    tmdb_id = models.IntegerField(unique=True, null=True, blank=True)
-    def __str__(self): return self.name
-
-class Director(models.Model):
+class Person(models.Model):
+    """Anyone credited on a movie; their jobs live on Credit, so one person is one row across roles."""
     name = models.CharField(max_length=255)
     imdb_id = models.CharField(max_length=20, unique=True, null=True, blank=True)
     tmdb_id = models.IntegerField(unique=True, null=True, blank=True)
-    def __str__(self): return self.name
 
-class Producer(models.Model):
-    name = models.CharField(max_length=255)
-    imdb_id = models.CharField(max_length=20, unique=True, null=True, blank=True)
-    tmdb_id = models.IntegerField(unique=True, null=True, blank=True)
+    class Meta:
+        # Serves the person search's ILIKE and trigram similarity lookups; only built on PostgreSQL (see migration 0022).
+        indexes = [GinIndex(fields=['name'], name='person_name_trgm_idx', opclasses=['gin_trgm_ops'])]
+
     def __str__(self): return self.name
 
 
 # --- 2. Core Tables ---
 
+def generate_random_key():
+    """Returns a uniform sort key in [0, 1) used by the random movie picker."""
+    return random.random()
+
+# Revenue tiers used by the weighted picker: (min revenue inclusive, max revenue exclusive).
+REVENUE_TIER_BOUNDS = {
+    'tentpole': (300_000_000, None),
+    'major': (75_000_000, 300_000_000),
+    'mid': (10_000_000, 75_000_000),
+    'low': (1_000_000, 10_000_000),
+    'micro': (None, 1_000_000),
+}
+
+def revenue_tier_for(revenue):
+    """Returns the name of the revenue tier a box-office figure falls into."""
+    for tier_name, (min_rev, max_rev) in REVENUE_TIER_BOUNDS.items():
+        if (min_rev is None or revenue >= min_rev) and (max_rev is None or revenue < max_rev):
+            return tier_name
+    return 'micro'
+
 class Movie(models.Model):
+    class RevenueTier(models.TextChoices):
+        TENTPOLE = 'tentpole', 'Tentpole'
+        MAJOR = 'major', 'Major'
+        MID = 'mid', 'Mid'
+        LOW = 'low', 'Low'
+        MICRO = 'micro', 'Micro'
+
     title = models.CharField(max_length=255)
     release_year = models.IntegerField()
     runtime_minutes = models.IntegerField(null=True, blank=True)
     revenue = models.BigIntegerField(default=0)
+    # Materialised from revenue on save (and by backfill_stats) so the picker can probe a single tier.
+    revenue_tier = models.CharField(max_length=8, choices=RevenueTier.choices, default=RevenueTier.MICRO)
     plot_summary = models.TextField(null=True, blank=True)
     imdb_id = models.CharField(max_length=15, unique=True, null=True, blank=True)
     tmdb_id = models.IntegerField(unique=True, null=True, blank=True)
     poster_url = models.URLField(max_length=500, null=True, blank=True)
+    # Uniform random sort key; the picker probes (revenue_tier, random_key) instead of ORDER BY RANDOM().
+    random_key = models.FloatField(default=generate_random_key)
     genre = models.ManyToManyField(Genre)
-    actors = models.ManyToManyField(Actor, through='MovieCastCredit')
-    cinematographers = models.ManyToManyField(Cinematographer)
-    directors = models.ManyToManyField(Director)
-    producers = models.ManyToManyField(Producer)
+    # Denormalised genres, crew and top cast for the detail page; see rebuild_credits_summaries().
+    credits_summary = models.JSONField(default=dict, blank=True)
+    credits_updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['revenue_tier', 'random_key'], name='movie_tier_random_key_idx')]
+
+    def save(self, *args, **kwargs):
+        self.revenue_tier = revenue_tier_for(self.revenue or 0)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'revenue' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'revenue_tier'}
+        super().save(*args, **kwargs)
+
     def __str__(self): return f"{self.title} ({self.release_year})"
 
+
+def sync_revenue_tiers():
+    """
+    Re-derives revenue_tier for rows whose revenue was changed without going through save()
+    (bulk updates, raw SQL). One UPDATE per tier, touching only rows that drifted.
+    """
+    updated = 0
+    for tier_name, (min_rev, max_rev) in REVENUE_TIER_BOUNDS.items():
+        drifted = Movie.objects.exclude(revenue_tier=tier_name)
+        if min_rev is not None: drifted = drifted.filter(revenue__gte=min_rev)
+        if max_rev is not None: drifted = drifted.filter(revenue__lt=max_rev)
+        updated += drifted.update(revenue_tier=tier_name)
+    return updated
+
 class UserMovieView(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
@@ -60,6 +111,11 @@ class UserMovieView(models.Model):
     date_recorded = models.DateTimeField(auto_now_add=True)
     class Meta:
         unique_together = ('user', 'movie')
+        # Serve the keyset-paginated "seen" and "recently rated" lists (see tracker/pagination.py).
+        indexes = [
+            models.Index(fields=['user', 'has_seen', '-date_recorded', '-id'], name='view_user_seen_recent_idx'),
+            models.Index(fields=['user', '-date_recorded', '-id'], name='view_user_recent_idx'),
+        ]
     def __str__(self):
         status = "Seen" if self.has_seen else "Unseen"
         return f"{self.user.username} - {self.movie.title} ({status})"
@@ -68,19 +124,95 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     date_of_birth = models.DateField(null=True, blank=True)
     join_date = models.DateTimeField(auto_now_add=True)
-    last_activity = models.DateTimeField(auto_now=True)
+    # Not auto_now: bumped on its own by touch_last_activity(), so other profile saves don't rewrite it.
+    last_activity = models.DateTimeField(default=timezone.now)
+    # Denormalised UserMovieView counts, kept current by signals; see rebuild_rating_counters().
+    total_rated = models.PositiveIntegerField(default=0)
+    total_seen = models.PositiveIntegerField(default=0)
     def __str__(self): return f"Profile for {self.user.username}"
 
 
+LAST_ACTIVITY_INTERVAL = getattr(settings, 'LAST_ACTIVITY_INTERVAL', 300)
+
+def touch_last_activity(user_id):
+    """
+    Bumps Profile.last_activity with a single-column UPDATE, at most once per LAST_ACTIVITY_INTERVAL
+    seconds per user: the time of the last write is kept in the cache, and cache.add only succeeds
+    once it has expired.
+    """
+    now = timezone.now()
+    if cache.add(f'last_activity:{user_id}', now.timestamp(), LAST_ACTIVITY_INTERVAL):
+        Profile.objects.filter(user_id=user_id).update(last_activity=now)
+
+
+def rebuild_rating_counters(profiles=None):
+    """Recomputes total_rated/total_seen from UserMovieView in a single UPDATE to repair drift."""
+    profiles = Profile.objects.all() if profiles is None else profiles
+    views = UserMovieView.objects.filter(user_id=OuterRef('user_id')).order_by().values('user_id')
+    rated = views.annotate(n=Count('id')).values('n')
+    seen = views.filter(has_seen=True).annotate(n=Count('id')).values('n')
+    return profiles.update(total_rated=Coalesce(Subquery(rated), 0), total_seen=Coalesce(Subquery(seen), 0))
+
+
+class SeenBitmap(models.Model):
+    """
+    The user's seen movies as a zlib-compressed bitset indexed by movie id (see tracker/seen_sets.py),
+    kept in step with UserMovieView by signals so two users can be compared without loading either
+    history. Rebuilt lazily when missing; rebuild_seen_bitmaps repairs drift.
+    """
+    user = models.OneToOneField(User, primary_key=True, related_name='seen_bitmap', on_delete=models.CASCADE)
+    bits = models.BinaryField(default=b'')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self): return f"Seen bitmap for user {self.user_id}"
+
+
 # --- 3. Relationship Tables ---
 
-class MovieCastCredit(models.Model):
+class Credit(models.Model):
+    """One person's role on one movie; cast rows are ordered by billing, crew rows by TMDb's listing."""
+    class Role(models.TextChoices):
+        CAST = 'cast', 'Cast'
+        DIRECTOR = 'director', 'Director'
+        PRODUCER = 'producer', 'Producer'
+        CINEMATOGRAPHER = 'cinematographer', 'Cinematography'
+
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
-    actor = models.ForeignKey(Actor, on_delete=models.CASCADE)
-    order = models.IntegerField()
+    person = models.ForeignKey(Person, on_delete=models.CASCADE)
+    role = models.CharField(max_length=16, choices=Role.choices)
+    order = models.IntegerField(default=0)
 
     class Meta:
         ordering = ['order']
+        constraints = [models.UniqueConstraint(fields=['movie', 'role', 'person'], name='credit_movie_role_person_uniq')]
+        # The unique constraint serves "credits of a movie"; this one serves "movies of these people".
+        indexes = [models.Index(fields=['person', 'movie'], name='credit_person_movie_idx')]
+
+    def __str__(self): return f"{self.person.name} ({self.get_role_display()}) in {self.movie.title}"
+
+
+# Crew roles in the order the detail page lists them, ahead of the cast.
+SUMMARY_CREW_ROLES = [Credit.Role.DIRECTOR, Credit.Role.PRODUCER, Credit.Role.CINEMATOGRAPHER]
+SUMMARY_CAST_LIMIT = 10
+
+def rebuild_credits_summaries(movie_ids):
+    """
+    Rebuilds Movie.credits_summary ({'genres': [...], 'crew': [{'role', 'name'}], 'cast': [{'name'}]})
+    for the given movies with two reads and one bulk_update, and stamps credits_updated_at.
+    """
+    movie_ids = list(movie_ids)
+    credits = defaultdict(list); genres = defaultdict(list)
+    for movie_id, role, name in Credit.objects.filter(movie_id__in=movie_ids).order_by('movie_id', 'order', 'id').values_list('movie_id', 'role', 'person__name'):
+        credits[movie_id].append((role, name))
+    for movie_id, name in Movie.genre.through.objects.filter(movie_id__in=movie_ids).order_by('genre__name').values_list('movie_id', 'genre__name'):
+        genres[movie_id].append(name)
+    labels = dict(Credit.Role.choices); now = timezone.now(); movies = []
+    for movie_id in movie_ids:
+        crew = [{'role': labels[role], 'name': name} for wanted in SUMMARY_CREW_ROLES for role, name in credits[movie_id] if role == wanted]
+        cast = [{'name': name} for role, name in credits[movie_id] if role == Credit.Role.CAST][:SUMMARY_CAST_LIMIT]
+        movies.append(Movie(id=movie_id, credits_summary={'genres': genres[movie_id], 'crew': crew, 'cast': cast}, credits_updated_at=now))
+    Movie.objects.bulk_update(movies, ['credits_summary', 'credits_updated_at'], batch_size=500)
+    return len(movies)
 
 
 # --- 4. Social and Invite Models ---
@@ -103,19 +235,107 @@ class InviteCode(models.Model):
         return f"Code {self.code} (Generated by: {self.generated_by.username if self.generated_by else 'Admin'})"
 
 class Friendship(models.Model):
+    """
+    One row per pair of users, whichever of them sent the request: the lower user id is always
+    user_low (see pair()), so the pair is unique and either side finds it with one index lookup.
+    """
     class Status(models.TextChoices):
         PENDING = 'PENDING', 'Pending'
         ACCEPTED = 'ACCEPTED', 'Accepted'
 
-    from_user = models.ForeignKey(User, related_name='friendship_creator', on_delete=models.CASCADE)
-    to_user = models.ForeignKey(User, related_name='friendship_receiver', on_delete=models.CASCADE)
+    user_low = models.ForeignKey(User, related_name='friendships_low', on_delete=models.CASCADE)
+    user_high = models.ForeignKey(User, related_name='friendships_high', on_delete=models.CASCADE)
+    requested_by = models.ForeignKey(User, related_name='sent_friend_requests', on_delete=models.CASCADE)
     status = models.CharField(max_length=8, choices=Status.choices, default=Status.PENDING)
     created_at = models.DateTimeField(auto_now_add=True)
     accepted_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
-        # A user can only send one friend request to another user
-        unique_together = ('from_user', 'to_user')
+        constraints = [models.UniqueConstraint(fields=['user_low', 'user_high'], name='friendship_unique_pair')]
+        # The unique pair index serves lookups by user_low; this one serves the user_high side.
+        indexes = [models.Index(fields=['user_high', 'status'], name='friendship_high_status_idx')]
+
+    @staticmethod
+    def pair(user_a, user_b):
+        """The canonical field values for the pair, e.g. Friendship.objects.filter(**Friendship.pair(a, b))."""
+        low, high = sorted((user_a, user_b), key=lambda user: user.pk)
+        return {'user_low': low, 'user_high': high}
+
+    @staticmethod
+    def involving(user):
+        """Q for every friendship `user` is part of, on either side."""
+        return models.Q(user_low=user) | models.Q(user_high=user)
+
+    def other_user_id(self, user_id):
+        return self.user_high_id if self.user_low_id == user_id else self.user_low_id
+
+    def save(self, *args, **kwargs):
+        # Keeps hand-built rows (e.g. from the admin) canonical.
+        if self.user_low_id > self.user_high_id: self.user_low_id, self.user_high_id = self.user_high_id, self.user_low_id
+        super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.from_user.username} to {self.to_user.username} ({self.status})"
\ No newline at end of file
+        return f"{self.user_low.username} and {self.user_high.username} ({self.status}, requested by {self.requested_by.username})"
+
+
+class FeedEntry(models.Model):
+    """
+    One rating by `actor` in the friends' activity timeline of `owner`. Rows are fanned out to every
+    friend when the rating is written (see tracker/feed.py), so reading a feed never joins the
+    friendship graph, and each timeline is trimmed to FRIEND_FEED_LENGTH entries.
+    """
+    owner = models.ForeignKey(User, related_name='feed_entries', on_delete=models.CASCADE)
+    actor = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    movie = models.ForeignKey(Movie, related_name='+', on_delete=models.CASCADE)
+    has_seen = models.BooleanField(default=False)
+    date_recorded = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # The timeline is read newest first by keyset (see tracker/pagination.py).
+        indexes = [models.Index(fields=['owner', '-date_recorded', '-id'], name='feed_owner_recent_idx')]
+
+    def __str__(self):
+        return f"{self.actor.username} {'saw' if self.has_seen else 'has not seen'} {self.movie.title} (feed of {self.owner.username})"
+
+
+# --- 5. Ingestion Bookkeeping ---
+
+class CrawlState(models.Model):
+    """Checkpoint for one paged TMDb listing, so ingestion commands can resume and skip unchanged listings."""
+    endpoint = models.CharField(max_length=50)
+    # 0 for listings that aren't partitioned by release year.
+    year = models.IntegerField(default=0)
+    last_page_done = models.IntegerField(default=0)
+    total_pages = models.IntegerField(null=True, blank=True)
+    total_results = models.IntegerField(null=True, blank=True)
+    etag = models.CharField(max_length=255, null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    # {tmdb_id: failed runs} of items to fetch again on the next run (used by the changes sync).
+    retry_ids = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('endpoint', 'year')
+
+    @property
+    def is_complete(self):
+        return self.completed_at is not None
+
+    def restart(self, total_pages, total_results=None, etag=None):
+        """Starts a fresh pass over the listing with the sizes reported by its first page."""
+        self.last_page_done = 0; self.total_pages = total_pages; self.total_results = total_results; self.etag = etag; self.completed_at = None
+        self.save()
+
+    def checkpoint(self, last_page_done):
+        if last_page_done != self.last_page_done:
+            self.last_page_done = last_page_done
+            self.save(update_fields=['last_page_done', 'updated_at'])
+
+    def mark_complete(self, at=None):
+        self.completed_at = at or timezone.now()
+        self.save(update_fields=['completed_at', 'updated_at'])
+
+    def __str__(self):
+        scope = f" {self.year}" if self.year else ""
+        return f"{self.endpoint}{scope}: page {self.last_page_done}/{self.total_pages or '?'}"
+
@@ -0,0 +1,38 @@
+# tracker/pagination.py
+
+import base64
+from datetime import datetime, timezone as dt_timezone
+from django.db.models import Q
+
+
+def encode_cursor(date_recorded, pk, served):
+    """Opaque token for the position just after (date_recorded, pk), `served` rows into the list."""
+    micros = int(date_recorded.timestamp() * 1000000)
+    return base64.urlsafe_b64encode(f"{micros}:{pk}:{served}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError for anything it didn't produce."""
+    try:
+        micros, pk, served = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode().split(':')
+        return datetime.fromtimestamp(int(micros) / 1000000, tz=dt_timezone.utc), int(pk), int(served)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor {token!r}") from e
+
+
+def keyset_page(queryset, cursor=None, page_size=12, limit=None):
+    """
+    One page of UserMovieView (or FeedEntry) rows, newest first, ordered by (-date_recorded, -id) and starting after
+    `cursor`. The seek condition walks the composite (user, ..., -date_recorded, -id) index, so deep
+    pages cost the same as the first and no total count is needed. `limit` caps how far the list can be
+    paged. Returns (rows, next_cursor), with next_cursor None on the last page.
+    """
+    served = 0
+    if cursor:
+        recorded, pk, served = decode_cursor(cursor)
+        queryset = queryset.filter(Q(date_recorded__lt=recorded) | Q(date_recorded=recorded, id__lt=pk))
+    if limit is not None: page_size = max(0, min(page_size, limit - served))
+    rows = list(queryset.order_by('-date_recorded', '-id')[:page_size + 1]) if page_size else []
+    has_more = len(rows) > page_size; rows = rows[:page_size]; served += len(rows)
+    next_cursor = encode_cursor(rows[-1].date_recorded, rows[-1].id, served) if has_more and (limit is None or served < limit) else None
+    return rows, next_cursor
@@ -0,0 +1,137 @@
+# tracker/rating_buffer.py
+
+import time
+from functools import partial
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from .models import Movie, Profile, UserMovieView
+from .caching import cache_lock, invalidate, user_scope, CacheLockBusy
+from .feed import fan_out
+from .metrics import mark_cold
+from .seen_sets import record_ratings
+from .signals import milestone_reached, is_rating_milestone
+
+# Swipes from the JSON rating API are buffered per user in the cache and written in one
+# bulk_create once the buffer holds RATING_BUFFER_SIZE ratings or its oldest one is RATING_BUFFER_MAX_AGE
+# seconds old. Pages that read the user's ratings flush first, and flush_rating_buffers picks up
+# buffers whose owner stopped swiping. At most one buffer's worth of swipes is at risk if the cache
+# loses it; RATING_BUFFER_SIZE = 1 writes every rating through. Needs a cache shared by all workers.
+BUFFER_SIZE = getattr(settings, 'RATING_BUFFER_SIZE', 10)
+BUFFER_MAX_AGE = getattr(settings, 'RATING_BUFFER_MAX_AGE', 30)
+PENDING_KEY = 'rating_buffer:pending'
+LOCK_TIMEOUT = 5
+
+
+def _buffer_key(user_id): return f'rating_buffer:{user_id}'
+
+
+class BufferBusy(CacheLockBusy):
+    """A buffer lock could not be taken within LOCK_TIMEOUT; the caller should retry or fall back."""
+
+
+def _locked(key):
+    # So concurrent requests of one user don't drop each other's swipes.
+    return cache_lock(key, LOCK_TIMEOUT, BufferBusy)
+
+
+def buffered_ratings(user_id):
+    """The user's unwritten ratings as [movie_id, has_seen, buffered_at] lists, oldest first."""
+    return cache.get(_buffer_key(user_id)) or []
+
+
+def buffer_rating(user_id, movie_id, has_seen):
+    """
+    Adds a swipe to the user's buffer (a repeated movie keeps its latest answer) and returns the buffer.
+    Raises BufferBusy if the buffer stays locked.
+    """
+    key = _buffer_key(user_id)
+    with _locked(key):
+        pending = [entry for entry in buffered_ratings(user_id) if entry[0] != movie_id]
+        pending.append([movie_id, has_seen, time.time()])
+        # Registered before it is stored, so a buffer flush_rating_buffers can't see is never written.
+        if len(pending) == 1: _register(user_id, pending[0][2])
+        cache.set(key, pending, None)
+    return pending
+
+
+def _register(user_id, buffered_at):
+    # Called under the user's buffer lock, so a flush can't unregister a buffer that just refilled.
+    with _locked(PENDING_KEY):
+        registry = cache.get(PENDING_KEY) or {}
+        if buffered_at is None: registry.pop(user_id, None)
+        else: registry[user_id] = buffered_at
+        cache.set(PENDING_KEY, registry, None)
+
+
+def flush_due(pending):
+    return bool(pending) and (len(pending) >= BUFFER_SIZE or time.time() - pending[0][2] >= BUFFER_MAX_AGE)
+
+
+def _forget(user_id, flushed):
+    """Drops the flushed entries from the user's buffer, keeping any swipe buffered since."""
+    flushed = {(movie_id, buffered_at) for movie_id, _, buffered_at in flushed}
+    key = _buffer_key(user_id)
+    with _locked(key):
+        remaining = [entry for entry in buffered_ratings(user_id) if (entry[0], entry[2]) not in flushed]
+        if remaining: cache.set(key, remaining, None)
+        else: cache.delete(key)
+        _register(user_id, remaining[0][2] if remaining else None)
+
+
+def _is_unique_violation(error):
+    # PostgreSQL reports SQLSTATE 23505 on the driver error; SQLite only says so in the message.
+    cause = error.__cause__
+    return getattr(cause, 'sqlstate', getattr(cause, 'pgcode', None)) == '23505' or 'UNIQUE constraint failed' in str(error)
+
+
+def pending_users():
+    """{user_id: time of their oldest buffered rating} for every user with a non-empty buffer."""
+    return cache.get(PENDING_KEY) or {}
+
+
+def flush_ratings(user, request=None):
+    """
+    Writes the user's buffered ratings with one bulk_create and returns how many were new. bulk_create
+    skips the model signals, so this does their work by hand: one F() update of the profile counters,
+    one invalidation of the user's cached fragments, one fan-out to the friends' feeds, one update of
+    their seen bitmap and a milestone_reached for every milestone crossed (with the request only when
+    it is the user's own, so the message lands on the right session).
+    """
+    # The buffer is only emptied once its ratings are committed, so a failed write loses nothing. A
+    # concurrent flush of the same entries finds them already rated and writes nothing.
+    pending = buffered_ratings(user.pk)
+    if not pending: return 0
+    mark_cold('rating flush')
+
+    movie_ids = [movie_id for movie_id, _, _ in pending]
+    with transaction.atomic():
+        # A movie deleted since the swipe (admin, generate_catalogue --clear) can never be written; it is
+        # dropped with the rest of the buffer below instead of failing every flush on the foreign key.
+        live = set(Movie.objects.filter(pk__in=movie_ids).values_list('pk', flat=True))
+        for attempt in range(3):
+            # Ratings made meanwhile through the form or on another device win; they are already counted.
+            rated = set(UserMovieView.objects.filter(user_id=user.pk, movie_id__in=movie_ids).values_list('movie_id', flat=True))
+            new_views = [UserMovieView(user_id=user.pk, movie_id=movie_id, has_seen=has_seen) for movie_id, has_seen, _ in pending if movie_id in live and movie_id not in rated]
+            # No ignore_conflicts, so the counters below only count rows that were really inserted. A
+            # unique conflict means a rating landed between the check and the insert: check again.
+            try:
+                with transaction.atomic(): UserMovieView.objects.bulk_create(new_views)
+                break
+            except IntegrityError as e:
+                if attempt == 2 or not _is_unique_violation(e): raise
+        if new_views:
+            profiles = Profile.objects.filter(user_id=user.pk)
+            profiles.update(total_rated=F('total_rated') + len(new_views), total_seen=F('total_seen') + sum(view.has_seen for view in new_views))
+            total_rated = profiles.values_list('total_rated', flat=True).first() or 0
+    try: _forget(user.pk, pending)
+    except BufferBusy: pass  # The next flush finds these already rated and drops them then.
+    if not new_views: return 0
+    transaction.on_commit(partial(invalidate, user_scope(user.pk))); fan_out(new_views)
+    record_ratings([(user.pk, view.movie_id, True) for view in new_views if view.has_seen])
+    own_request = request if request is not None and request.user.pk == user.pk else None
+    for reached in range(total_rated - len(new_views) + 1, total_rated + 1):
+        if is_rating_milestone(reached): milestone_reached.send(sender=User, user=user, total_rated=reached, request=own_request)
+    return len(new_views)
@@ -0,0 +1,64 @@
+# tracker/routers.py
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+
+
+class RequestRouting:
+    """Per-request routing state: `pinned` sends every read to the primary, `wrote` records that the request wrote."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned; self.wrote = False
+
+
+# Set by ReplicaRoutingMiddleware for the request being handled; None outside requests.
+request_routing = ContextVar('request_routing', default=None)
+
+
+def replica_enabled():
+    """True when a 'replica' alias is configured and is a different database from the primary (test runs mirror it onto the primary)."""
+    if REPLICA not in settings.DATABASES: return False
+    replica, primary = connections[REPLICA].settings_dict, connections[PRIMARY].settings_dict
+    return any(replica[key] != primary[key] for key in ('ENGINE', 'NAME', 'HOST', 'PORT'))
+
+
+@contextmanager
+def use_primary():
+    """Sends the reads inside the block to the primary, e.g. to rebuild a cache entry after a write."""
+    routing = request_routing.get()
+    if routing is None or routing.pinned:
+        yield
+        return
+    routing.pinned = True
+    try: yield
+    finally: routing.pinned = False
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends the reads of a request to the optional 'replica' database and every write to the primary.
+    A request reads from the primary once it has written (so it sees its own writes), when it is an
+    unsafe method, or while it carries the pin cookie set after a write (read-your-writes across the
+    next few requests, see ReplicaRoutingMiddleware). Reads outside a request (management commands,
+    background threads) always use the primary, since they usually read in order to write.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = request_routing.get()
+        if routing is None or routing.pinned or routing.wrote or not replica_enabled(): return PRIMARY
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        routing = request_routing.get()
+        if routing is not None: routing.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data, so rows read from either may be related.
+        if {obj1._state.db, obj2._state.db} <= {PRIMARY, REPLICA}: return True
+        return None
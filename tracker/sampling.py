@@ -0,0 +1,82 @@
+# tracker/sampling.py
+
+import random
+from collections import Counter
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+from .models import Movie, UserMovieView, Person, Credit
+
+TIER_WEIGHTS = {"tentpole": 45, "major": 30, "mid": 15, "low": 7, "micro": 3}
+# Best-matching people kept when resolving a person search.
+PERSON_MATCH_LIMIT = 50
+
+
+def unseen_movies_for(user):
+    """
+    Movies the user has not rated yet, expressed as an anti-join (NOT EXISTS) on the
+    (user, movie) unique index instead of materialising the list of rated ids.
+    """
+    rated = UserMovieView.objects.filter(user=user, movie_id=OuterRef('pk'))
+    return Movie.objects.filter(~Exists(rated))
+
+
+def matching_person_ids(person_query, limit=PERSON_MATCH_LIMIT):
+    """
+    Ids of the people whose name best matches `person_query`. On PostgreSQL both the substring and the
+    fuzzy (%) match are served by the name's GIN trigram index and ranked by similarity; elsewhere it
+    falls back to a plain icontains for development.
+    """
+    if connection.vendor == 'postgresql':
+        people = Person.objects.filter(Q(name__icontains=person_query) | Q(name__trigram_similar=person_query)).annotate(similarity=TrigramSimilarity('name', person_query)).order_by('-similarity', 'id')
+    else:
+        people = Person.objects.filter(name__icontains=person_query).order_by('id')
+    return list(people.values_list('id', flat=True)[:limit])
+
+
+def person_filter(person_query):
+    """
+    Q matching movies credited to any person found by `person_query`, in any role. People are resolved
+    first, then a single EXISTS on Credit's (person, movie) index, so there is no join fan-out to DISTINCT away.
+    """
+    person_ids = matching_person_ids(person_query)
+    return Exists(Credit.objects.filter(movie_id=OuterRef('pk'), person_id__in=person_ids)) if person_ids else Q(pk__in=[])
+
+
+def filtered_unseen_movies(user, genre_id=None, person_query=''):
+    """Unseen movies narrowed by the rating page's genre and person filters."""
+    unseen_movies = unseen_movies_for(user)
+    if genre_id: unseen_movies = unseen_movies.filter(genre__id=genre_id)
+    if person_query: unseen_movies = unseen_movies.filter(person_filter(person_query))
+    return unseen_movies
+
+
+def sample_ids(movie_query, count):
+    """
+    Returns up to `count` random movie ids from the queryset with at most two range scans of the
+    random_key index: the run of movies at or after a random point, wrapping around to the start
+    of the key space if the run is short.
+    """
+    point = random.random()
+    ids = list(movie_query.filter(random_key__gte=point).order_by('random_key').values_list('id', flat=True)[:count])
+    if len(ids) < count:
+        ids += movie_query.filter(random_key__lt=point).order_by('random_key').values_list('id', flat=True)[:count - len(ids)]
+    return ids
+
+
+def sample_weighted_movie_ids(unseen_movies, count, exclude_ids=()):
+    """
+    Draws `count` revenue tiers by weight and samples each tier through the (revenue_tier, random_key)
+    index. A tier that comes back short has run dry for this user; it is dropped and its shortfall is
+    re-drawn from the remaining tiers, so the pick never degrades into a random sort over the whole
+    catalogue. `exclude_ids` is a small, bounded list (ids already queued for the user).
+    """
+    excluded = list(exclude_ids); picked = []; remaining = dict(TIER_WEIGHTS)
+    while len(picked) < count and remaining:
+        draws = Counter(random.choices(list(remaining.keys()), weights=list(remaining.values()), k=count - len(picked)))
+        for tier_name, wanted in draws.items():
+            ids = sample_ids(unseen_movies.filter(revenue_tier=tier_name).exclude(id__in=excluded + picked), wanted)
+            picked += ids
+            if len(ids) < wanted: del remaining[tier_name]
+    random.shuffle(picked)
+    return picked
@@ -0,0 +1,111 @@
+# tracker/seen_sets.py
+
+import zlib
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import SeenBitmap, UserMovieView
+from .routers import use_primary
+
+BITMAP_TIMEOUT = getattr(settings, 'CACHE_FRAGMENT_TIMEOUT', 3600)
+
+# A user's seen set is a Python int used as a bitset: bit `movie_id` is set when they have seen the movie.
+# Intersections, unions and popcounts then run in C over a few kilobytes, in microseconds, and the
+# stored form (little-endian bytes, zlib-compressed) stays small because seen sets are sparse.
+
+
+def encode(bits):
+    return zlib.compress(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')) if bits else b''
+
+
+def decode(data):
+    return int.from_bytes(zlib.decompress(data), 'little') if data else 0
+
+
+def bitmap_from_ids(movie_ids):
+    movie_ids = list(movie_ids)
+    if not movie_ids: return 0
+    raw = bytearray(max(movie_ids) // 8 + 1)
+    for movie_id in movie_ids: raw[movie_id >> 3] |= 1 << (movie_id & 7)
+    return int.from_bytes(raw, 'little')
+
+
+def movie_ids(bits, limit=None):
+    """The movie ids in a bitmap, highest (most recently added movie) first."""
+    ids = []
+    while bits and (limit is None or len(ids) < limit):
+        top = bits.bit_length() - 1; ids.append(top); bits ^= 1 << top
+    return ids
+
+
+def _key(user_id): return f'seen_bitmap:{user_id}'
+
+
+def seen_bitmaps(user_ids):
+    """
+    Returns {user_id: bitmap} from the cache, then the SeenBitmap table (one query), building the
+    missing rows from UserMovieView (one more query). Rows are read from the primary, so a lagging
+    replica can't put an old bitmap back in the cache right after a write.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    found = cache.get_many([_key(user_id) for user_id in user_ids])
+    encoded = {user_id: found[_key(user_id)] for user_id in user_ids if _key(user_id) in found}
+    missing = [user_id for user_id in user_ids if user_id not in encoded]
+    if missing:
+        with use_primary():
+            loaded = dict(SeenBitmap.objects.filter(user_id__in=missing).values_list('user_id', 'bits'))
+            unbuilt = [user_id for user_id in missing if user_id not in loaded]
+            if unbuilt:
+                seen = defaultdict(list)
+                for user_id, movie_id in UserMovieView.objects.filter(user_id__in=unbuilt, has_seen=True).values_list('user_id', 'movie_id').iterator():
+                    seen[user_id].append(movie_id)
+                built = {user_id: encode(bitmap_from_ids(seen[user_id])) for user_id in unbuilt}
+                SeenBitmap.objects.bulk_create([SeenBitmap(user_id=user_id, bits=data) for user_id, data in built.items()], ignore_conflicts=True)
+                loaded.update(built)
+        loaded = {user_id: bytes(data) for user_id, data in loaded.items()}
+        cache.set_many({_key(user_id): data for user_id, data in loaded.items()}, BITMAP_TIMEOUT)
+        encoded.update(loaded)
+    return {user_id: decode(encoded[user_id]) for user_id in user_ids}
+
+
+def seen_bitmap(user_id):
+    return seen_bitmaps([user_id])[user_id]
+
+
+def record_ratings(changes):
+    """
+    Applies (user_id, movie_id, has_seen) changes to the stored bitmaps, one locked read-modify-write
+    per user, and drops their cached copies once the caller's transaction commits (dropped earlier, a
+    concurrent read could cache the old row again). Users without a stored bitmap are skipped: theirs
+    is built from UserMovieView, which already holds the change, on first use.
+    """
+    by_user = defaultdict(list)
+    for user_id, movie_id, has_seen in changes: by_user[user_id].append((movie_id, has_seen))
+    for user_id, user_changes in by_user.items():
+        with transaction.atomic():
+            row = SeenBitmap.objects.select_for_update().filter(user_id=user_id).first()
+            if row is None: continue
+            bits = decode(row.bits)
+            for movie_id, has_seen in user_changes:
+                bits = bits | (1 << movie_id) if has_seen else bits & ~(1 << movie_id)
+            row.bits = encode(bits); row.save(update_fields=['bits', 'updated_at'])
+    keys = [_key(user_id) for user_id in by_user]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def rebuild_seen_bitmaps(user_ids=None):
+    """Drops the stored bitmaps (all, or those of `user_ids`) and rebuilds them from UserMovieView; returns how many."""
+    rows = SeenBitmap.objects.all() if user_ids is None else SeenBitmap.objects.filter(user_id__in=user_ids)
+    if user_ids is None: user_ids = list(UserMovieView.objects.order_by().values_list('user_id', flat=True).distinct())
+    rows.delete(); cache.delete_many([_key(user_id) for user_id in user_ids])
+    for start in range(0, len(user_ids), 500): seen_bitmaps(user_ids[start:start + 500])
+    return len(user_ids)
+
+
+def compatibility(mine, theirs):
+    """How two seen sets compare: both seen, each only, and the Jaccard index of the two."""
+    overlap = (mine & theirs).bit_count(); mine_count = mine.bit_count(); their_count = theirs.bit_count()
+    union = mine_count + their_count - overlap
+    return {'overlap': overlap, 'jaccard': round(overlap / union, 4) if union else 0.0,
+            'seen_by_you_only': mine_count - overlap, 'seen_by_them_only': their_count - overlap}
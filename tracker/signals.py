@@ -1,14 +1,25 @@
 # tracker/signals.py
 
-from django.db.models.signals import post_save
+from functools import partial
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_save, post_init, post_delete
 from django.dispatch import receiver, Signal
 from django.contrib.auth.models import User
 from django.contrib import messages
-from .models import Profile, InviteCode
+from .models import Profile, InviteCode, UserMovieView, Movie, Genre, Friendship
+from .caching import invalidate, movie_scope, user_scope, friends_scope, GENRES_SCOPE, CATALOGUE_SCOPE
+from .feed import fan_out, drop_pair_entries
+from .seen_sets import record_ratings
 
 # 1. Define the custom signal
 milestone_reached = Signal()
 
+def is_rating_milestone(total_rated):
+    """Invite codes are earned at 250 ratings and every 100 after that."""
+    return total_rated == 250 or (total_rated > 250 and (total_rated - 250) % 100 == 0)
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """
@@ -17,15 +28,118 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.get_or_create(user=instance)
 
+@receiver(post_init, sender=Profile)
+@receiver(post_save, sender=Profile)
+def remember_loaded_profile(sender, instance, **kwargs):
+    """
+    Signal handler: Remembers the values a profile was loaded (or last saved) with, so saving its
+    user can tell which fields were actually changed in memory.
+    """
+    instance._loaded_values = {field.attname: getattr(instance, field.attname) for field in sender._meta.concrete_fields}
+
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
     """
-    Signal handler: Ensures the Profile object is saved whenever the User object is saved.
+    Signal handler: Saves the user's profile along with the user, but only the fields changed on the
+    profile instance loaded with it. Partial user saves (login's last_login) and users whose profile
+    was never loaded write nothing, and the counters kept by F() updates are never written back stale.
     """
+    if created or update_fields is not None or not User.profile.is_cached(instance):
+        return
     try:
-        instance.profile.save()
+        profile = instance.profile
     except Profile.DoesNotExist:
-        pass
+        return
+    changed = [field.name for field in Profile._meta.concrete_fields if not field.primary_key and getattr(profile, field.attname) != profile._loaded_values.get(field.attname)]
+    if changed:
+        profile.save(update_fields=changed)
+
+@receiver(post_init, sender=UserMovieView)
+def remember_loaded_seen_status(sender, instance, **kwargs):
+    """
+    Signal handler: Remembers the has_seen value a view was loaded with, so a save can tell
+    whether the user's seen counter needs to move.
+    """
+    instance._loaded_has_seen = instance.has_seen if instance.pk else None
+
+# The next two are registered before update_rating_counters, which resets _loaded_has_seen.
+@receiver(post_save, sender=UserMovieView)
+def fan_out_rating(sender, instance, created, **kwargs):
+    """
+    Signal handler: Posts a new rating, or a changed seen status, to the author's friends' activity feeds.
+    """
+    if created or (instance._loaded_has_seen is not None and instance._loaded_has_seen != instance.has_seen):
+        fan_out([instance])
+
+@receiver(post_save, sender=UserMovieView)
+def update_seen_bitmap(sender, instance, created, **kwargs):
+    """
+    Signal handler: Sets or clears the movie's bit in the user's seen bitmap when the seen status changes.
+    """
+    if (instance.has_seen if created else instance._loaded_has_seen is not None and instance._loaded_has_seen != instance.has_seen):
+        record_ratings([(instance.user_id, instance.movie_id, instance.has_seen)])
+
+@receiver(post_save, sender=UserMovieView)
+def update_rating_counters(sender, instance, created, **kwargs):
+    """
+    Signal handler: Keeps Profile.total_rated/total_seen in step with UserMovieView using
+    atomic F() updates, so nothing on the request path has to COUNT(*) the ratings table.
+    """
+    if created:
+        Profile.objects.filter(user_id=instance.user_id).update(total_rated=F('total_rated') + 1, total_seen=F('total_seen') + int(instance.has_seen))
+    elif instance._loaded_has_seen is not None and instance._loaded_has_seen != instance.has_seen:
+        Profile.objects.filter(user_id=instance.user_id).update(total_seen=F('total_seen') + (1 if instance.has_seen else -1))
+    instance._loaded_has_seen = instance.has_seen
+
+@receiver(post_delete, sender=UserMovieView)
+def release_rating_counters(sender, instance, **kwargs):
+    """
+    Signal handler: Takes a deleted view back out of the owner's counters.
+    """
+    seen_delta = int(bool(instance._loaded_has_seen))
+    Profile.objects.filter(user_id=instance.user_id).update(total_rated=Greatest(F('total_rated') - 1, 0), total_seen=Greatest(F('total_seen') - seen_delta, 0))
+    if seen_delta: record_ratings([(instance.user_id, instance.movie_id, False)])
+
+# The cache invalidations below run once the write commits: bumped any earlier, a concurrent request
+# could rebuild a fragment from the still-committed old rows and cache it under the new version.
+@receiver(post_save, sender=UserMovieView)
+@receiver(post_delete, sender=UserMovieView)
+def invalidate_user_fragments(sender, instance, **kwargs):
+    """
+    Signal handler: Orphans the cached rating lists and grids that show this user's ratings.
+    """
+    transaction.on_commit(partial(invalidate, user_scope(instance.user_id)))
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def invalidate_movie_fragments(sender, instance, **kwargs):
+    """
+    Signal handler: Orphans the movie's detail fragment and every cached list that shows movie titles or posters.
+    """
+    transaction.on_commit(partial(invalidate, movie_scope(instance.id), CATALOGUE_SCOPE))
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def invalidate_genre_list(sender, instance, **kwargs):
+    """
+    Signal handler: Orphans the cached genre filter list.
+    """
+    transaction.on_commit(partial(invalidate, GENRES_SCOPE))
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def invalidate_friend_ids(sender, instance, **kwargs):
+    """
+    Signal handler: Orphans the cached friend-id sets of both users in the pair.
+    """
+    transaction.on_commit(partial(invalidate, friends_scope(instance.user_low_id), friends_scope(instance.user_high_id)))
+
+@receiver(post_delete, sender=Friendship)
+def drop_friend_feed_entries(sender, instance, **kwargs):
+    """
+    Signal handler: Takes each user's ratings out of the other's activity feed when a friendship ends.
+    """
+    drop_pair_entries(instance.user_low_id, instance.user_high_id)
 
 # 2. Create the receiver for the custom signal (replaces the previous UserMovieView signal)
 @receiver(milestone_reached)
@@ -33,17 +147,17 @@ def grant_invite_codes_and_message(sender, user, total_rated, **kwargs):
     """
     Listens for the custom milestone_reached signal to grant codes and create a message.
     """
+    # Buffered ratings can be flushed outside a request (flush_rating_buffers); the codes are
+    # still granted, only the message is skipped.
     request = kwargs.get('request')
-    if not request:
-        return
 
     # Milestone 1: Grant 5 codes for the first 250 movies rated.
     if total_rated == 250:
         for _ in range(5):
             InviteCode.objects.create(generated_by=user)
-        messages.success(request, "Congratulations! You've rated 250 movies and earned 5 invite codes!")
+        if request: messages.success(request, "Congratulations! You've rated 250 movies and earned 5 invite codes!")
 
     # Milestone 2: Grant 1 code for every 100 movies rated after 250.
     elif total_rated > 250 and (total_rated - 250) % 100 == 0:
         InviteCode.objects.create(generated_by=user)
-        messages.success(request, f"Congratulations! You've rated {total_rated} movies and earned a new invite code!")
\ No newline at end of file
+        if request: messages.success(request, f"Congratulations! You've rated {total_rated} movies and earned a new invite code!")
\ No newline at end of file
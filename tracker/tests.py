@@ -1,3 +1,1140 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import parse_qs, urlsplit
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction, DatabaseError, IntegrityError
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .caching import cached_fragment, cache_stats, friend_ids, invalidate, reset_cache_stats, scope_versions, movie_scope, user_scope, friends_scope, GENRES_SCOPE, CATALOGUE_SCOPE
+from .checks import check_shared_cache
+from .feed import friend_feed_page
+from .ingestion import CreditBatchWriter, MovieBatchWriter, crawl_pages
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .metrics import mark_cold, PrometheusSink
+from .middleware import ReplicaRoutingMiddleware, REPLICA_PIN_COOKIE
+from .models import rebuild_credits_summaries, revenue_tier_for, Credit, Person, sync_revenue_tiers, Movie, Genre, UserMovieView, Friendship, InviteCode, Profile, FeedEntry, CrawlState
+from .rating_buffer import buffer_rating, buffered_ratings, flush_due, flush_ratings, pending_users, BufferBusy
+from .routers import PrimaryReplicaRouter, use_primary
+from .sampling import matching_person_ids, filtered_unseen_movies, sample_ids, sample_weighted_movie_ids
+from .seen_sets import seen_bitmap, rebuild_seen_bitmaps, movie_ids
+from .views import seen_movies_for
+from .unseen_queue import _pop_unseen, _queue_key, next_unseen_movie, refill_queue, schedule_refill
+from .tmdb import TMDbClient, TMDbError, TMDbAuthError, TMDbNotFound, retry_after_seconds
 
-# Create your tests here.
+
+class RandomKeySamplerTests(TestCase):
+    """The picker reads a run of the random_key index from a random point, wrapping around at the end."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('picker', password='pw')
+        self.movies = Movie.objects.bulk_create([Movie(title=f'Movie {i}', release_year=2000, random_key=(i + 1) / 10) for i in range(5)])
+
+    def test_short_run_wraps_around_to_the_start(self):
+        with mock.patch('tracker.sampling.random.random', return_value=0.45):
+            ids = sample_ids(Movie.objects.all(), 4)
+        self.assertEqual(ids, [self.movies[i].id for i in (4, 0, 1, 2)])
+
+    def test_never_returns_more_than_exists(self):
+        self.assertEqual(sorted(sample_ids(Movie.objects.all(), 10)), sorted(movie.id for movie in self.movies))
+        self.assertEqual(sample_ids(Movie.objects.none(), 3), [])
+        self.assertEqual(sample_weighted_movie_ids(Movie.objects.none(), 3), [])
+
+    def test_filters_and_exclusions_are_respected(self):
+        noir = Genre.objects.create(name='Noir')
+        for movie in self.movies[:2]: movie.genre.add(noir)
+        UserMovieView.objects.create(user=self.user, movie=self.movies[0], has_seen=True)
+        self.assertEqual(sample_weighted_movie_ids(filtered_unseen_movies(self.user, noir.id), 5), [self.movies[1].id])
+        self.assertEqual(sample_weighted_movie_ids(filtered_unseen_movies(self.user, noir.id), 5, exclude_ids=[self.movies[1].id]), [])
+        self.assertEqual(len(sample_weighted_movie_ids(filtered_unseen_movies(self.user), 10)), 4)
+
+
+class RevenueTierTests(TestCase):
+    def test_tier_bounds(self):
+        cases = {0: 'micro', 999_999: 'micro', 1_000_000: 'low', 9_999_999: 'low', 10_000_000: 'mid', 74_999_999: 'mid', 75_000_000: 'major', 300_000_000: 'tentpole'}
+        self.assertEqual({revenue: revenue_tier_for(revenue) for revenue in cases}, cases)
+
+    def test_save_derives_the_tier(self):
+        movie = Movie.objects.create(title='Blockbuster', release_year=2019, revenue=2_000_000_000)
+        self.assertEqual(Movie.objects.get().revenue_tier, 'tentpole')
+        movie.revenue = 5_000_000; movie.save(update_fields=['revenue'])
+        self.assertEqual(Movie.objects.get().revenue_tier, 'low')
+        movie.title = 'Retitled'; movie.save(update_fields=['title'])
+        self.assertEqual(Movie.objects.get().revenue_tier, 'low')
+
+    def test_sync_fixes_tiers_of_bulk_updated_rows(self):
+        Movie.objects.create(title='Sleeper', release_year=2001, revenue=500_000)
+        Movie.objects.update(revenue=80_000_000)
+        self.assertEqual((sync_revenue_tiers(), sync_revenue_tiers()), (1, 0))
+        self.assertEqual(Movie.objects.get().revenue_tier, 'major')
+
+
+class UnseenQueueTests(TestCase):
+    """The rating page's queue serves every unseen movie once and never loses or repeats a pop to a refill."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('swiper', password='pw')
+        self.noir = Genre.objects.create(name='Noir')
+        self.movies = Movie.objects.bulk_create([Movie(title=f'Movie {i}', release_year=2000) for i in range(30)])
+        for movie in self.movies[:8]: movie.genre.add(self.noir)
+
+    def test_every_unseen_movie_is_served_once(self):
+        served = []
+        while (movie := next_unseen_movie(self.user)) is not None:
+            served.append(movie.id); UserMovieView.objects.create(user=self.user, movie=movie, has_seen=True)
+        self.assertEqual(sorted(served), sorted(movie.id for movie in self.movies))
+
+    def test_rated_and_buffered_movies_are_skipped(self):
+        key = _queue_key(self.user.id, None, '')
+        cache.set(key, [movie.id for movie in self.movies[:4]])
+        UserMovieView.objects.create(user=self.user, movie=self.movies[0], has_seen=False)
+        self.assertEqual(next_unseen_movie(self.user, skip_ids=[self.movies[1].id]), self.movies[2])
+        self.assertEqual(cache.get(key)[0], self.movies[3].id)
+
+    def test_refill_does_not_put_back_ids_popped_while_sampling(self):
+        key = _queue_key(self.user.id, None, '')
+        cache.set(key, [movie.id for movie in self.movies[:3]])
+        fresh = [movie.id for movie in self.movies[3:5]]
+
+        def sample_during_a_pop(*args, **kwargs):
+            _pop_unseen(self.user, key, set())
+            return fresh
+
+        with mock.patch('tracker.unseen_queue.sample_weighted_movie_ids', side_effect=sample_during_a_pop):
+            refill_queue(self.user)
+        self.assertEqual(cache.get(key), [movie.id for movie in self.movies[1:5]])
+
+    def test_genre_filter_has_its_own_queue(self):
+        noir_ids = {movie.id for movie in self.movies[:8]}
+        served = set()
+        for _ in range(8):
+            movie = next_unseen_movie(self.user, genre_id=self.noir.id); served.add(movie.id)
+            UserMovieView.objects.create(user=self.user, movie=movie, has_seen=False)
+        self.assertEqual(served, noir_ids)
+        self.assertIsNone(next_unseen_movie(self.user, genre_id=self.noir.id))
+        self.assertEqual(cache.get(_queue_key(self.user.id, None, '')), None)
+        self.assertIsNotNone(next_unseen_movie(self.user))
+
+    @mock.patch('tracker.unseen_queue.QUEUE_LOCK_TIMEOUT', 0.05)
+    def test_busy_queue_serves_a_fresh_pick(self):
+        key = _queue_key(self.user.id, None, '')
+        cache.set(key, [self.movies[0].id]); cache.add(f'{key}:lock', 'other', 60)
+        self.assertIsNotNone(next_unseen_movie(self.user, skip_ids=[self.movies[0].id]))
+        self.assertEqual(cache.get(key), [self.movies[0].id])
+
+    @mock.patch('tracker.unseen_queue.QUEUE_LOCK_TIMEOUT', 0.05)
+    @mock.patch('tracker.unseen_queue.REFILL_IN_BACKGROUND', False)
+    def test_busy_queue_skips_an_inline_refill(self):
+        key = _queue_key(self.user.id, None, '')
+        cache.add(f'{key}:lock', 'other', 60)
+        schedule_refill(self.user)
+        self.assertEqual((cache.get(key), cache.get(f'{key}:refilling')), (None, None))
+
+
+class RatingCounterTests(TestCase):
+    """Profile.total_rated/total_seen follow every rating write without a COUNT(*)."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('counter', password='pw')
+        self.movies = Movie.objects.bulk_create([Movie(title=f'Movie {i}', release_year=2000) for i in range(4)])
+
+    def counters(self, username='counter'):
+        return tuple(Profile.objects.filter(user__username=username).values_list('total_rated', 'total_seen').get())
+
+    def test_creates_toggles_and_deletes(self):
+        for i, movie in enumerate(self.movies): UserMovieView.objects.create(user=self.user, movie=movie, has_seen=i % 2 == 0)
+        self.assertEqual(self.counters(), (4, 2))
+        view = UserMovieView.objects.get(movie=self.movies[1]); view.has_seen = True; view.save()
+        self.assertEqual(self.counters(), (4, 3))
+        view.save()  # Saving it unchanged moves nothing.
+        self.assertEqual(self.counters(), (4, 3))
+        view.has_seen = False; view.save()
+        self.assertEqual(self.counters(), (4, 2))
+        UserMovieView.objects.get(movie=self.movies[0]).delete()
+        UserMovieView.objects.get(movie=self.movies[3]).delete()
+        self.assertEqual(self.counters(), (2, 1))
+
+    def test_rebuild_command(self):
+        other = User.objects.create_user('other', password='pw')
+        UserMovieView.objects.bulk_create([UserMovieView(user=user, movie=movie, has_seen=True) for user in (self.user, other) for movie in self.movies[:3]])
+        self.assertEqual((self.counters(), self.counters('other')), ((0, 0), (0, 0)))
+        out = StringIO()
+        call_command('rebuild_rating_counters', username='counter', stdout=out)
+        self.assertIn('for 1 profiles', out.getvalue())
+        self.assertEqual((self.counters(), self.counters('other')), ((3, 3), (0, 0)))
+        call_command('rebuild_rating_counters', stdout=StringIO())
+        self.assertEqual(self.counters('other'), (3, 3))
+
+
+class MovieBatchWriterTests(TestCase):
+    def test_pages_are_written_set_based(self):
+        action = Genre.objects.create(name='Action')
+        Movie.objects.create(title='Already here', release_year=1999, tmdb_id=1)
+        writer = MovieBatchWriter({28: action}, flush_every_pages=2)
+        first = [{'id': 1, 'title': 'Renamed', 'release_date': '1999-01-01'},
+                 {'id': 2, 'title': 'New', 'release_date': '2005-06-01', 'genre_ids': [28, 99], 'poster_path': '/p.jpg'},
+                 {'id': 3, 'title': 'No date', 'release_date': ''}]
+        self.assertEqual(writer.add_page(first), 0)
+        self.assertEqual((writer.pending_pages, Movie.objects.count()), (1, 1))
+        with self.assertNumQueries(6):  # Savepoint, existing ids, movies, their ids, genre links, release.
+            self.assertEqual(writer.add_page([{'id': 4, 'title': 'Later', 'release_date': '2010-01-01'}]), 2)
+        self.assertEqual(writer.pending_pages, 0)
+        self.assertEqual(sorted(Movie.objects.values_list('tmdb_id', 'title')), [(1, 'Already here'), (2, 'New'), (4, 'Later')])
+        new = Movie.objects.get(tmdb_id=2)
+        self.assertEqual((list(new.genre.all()), new.release_year, new.poster_url), ([action], 2005, 'https://image.tmdb.org/t/p/w500/p.jpg'))
+        self.assertEqual(writer.add_page([{'id': 2, 'title': 'New', 'release_date': '2005-06-01'}]) + writer.flush(), 0)
+
+
+class FakeTMDb:
+    """
+    A local stand-in for the TMDb API on a free port. `routes` maps a path (without the /3 prefix) to
+    a (status, body[, headers]) response, a list of them served in turn (the last one repeats), or a
+    function of the query dict returning one. Unknown paths answer 404. Every request is logged as
+    (monotonic time, path, query, status).
+    """
+
+    def __init__(self, routes):
+        self.routes = routes; self.requests = []; self._lock = threading.Lock()
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path); path = url.path.removeprefix('/3')
+                query = {name: values[0] for name, values in parse_qs(url.query).items()}
+                status, body, headers = fake.respond(path, query)
+                with fake._lock: fake.requests.append((time.monotonic(), path, query, status))
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in {'Content-Type': 'application/json', 'Content-Length': str(len(payload)), **headers}.items(): self.send_header(name, value)
+                self.end_headers(); self.wfile.write(payload)
+
+            def log_message(self, *args): pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/3'
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown(); self.server.server_close()
+
+    def respond(self, path, query):
+        route = self.routes.get(path, (404, {'status_message': 'The resource you requested could not be found.'}))
+        if callable(route): response = route(query)
+        elif isinstance(route, list):
+            with self._lock: response = route.pop(0) if len(route) > 1 else route[0]
+        else: response = route
+        return response if len(response) == 3 else (*response, {})
+
+    def hits(self, path):
+        return [entry for entry in self.requests if entry[1] == path]
+
+
+class TMDbClientTests(TestCase):
+    def client_for(self, fake, workers=4):
+        return TMDbClient(api_key='test', base_url=fake.url, requests_per_second=1000, workers=workers)
+
+    def test_retry_after_accepts_seconds_and_http_dates(self):
+        self.assertEqual(retry_after_seconds('3'), 3.0)
+        self.assertEqual(retry_after_seconds('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertAlmostEqual(retry_after_seconds('Fri, 01 Jan 2100 00:00:00 GMT'), (date(2100, 1, 1) - date.today()).days * 86400, delta=2 * 86400)
+        self.assertEqual(retry_after_seconds('soon'), 5.0)
+        self.assertEqual(retry_after_seconds(None), 5.0)
+
+    def test_rate_limit_pauses_every_worker(self):
+        routes = {f'/movie/{i}': (200, {'id': i}) for i in range(2, 13)}
+        # An HTTP-date in the past: no extra wait beyond the one-second margin.
+        routes['/movie/1'] = [(429, {}, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}), (200, {'id': 1})]
+        with FakeTMDb(routes) as fake:
+            results = list(self.client_for(fake).fetch_many((i, f'/movie/{i}', {}) for i in range(1, 13)))
+        self.assertEqual(sorted(key for key, data, error in results if error is None and data == {'id': key}), list(range(1, 13)))
+        limited_at = next(at for at, path, query, status in fake.requests if status == 429)
+        # Requests already in flight may land just after the 429; nothing else is sent during the pause.
+        self.assertFalse([path for at, path, query, status in fake.requests if limited_at + 0.2 < at < limited_at + 0.9])
+        self.assertGreaterEqual(fake.hits('/movie/1')[-1][0] - limited_at, 0.9)
+
+    def test_server_errors_are_retried(self):
+        with FakeTMDb({'/movie/1': [(500, {}), (502, {}), (200, {'id': 1})], '/movie/2': (503, {})}) as fake, mock.patch('tracker.tmdb.time.sleep'):
+            client = self.client_for(fake)
+            self.assertEqual(client.get('/movie/1'), {'id': 1})
+            with self.assertRaises(TMDbError):
+                client.get('/movie/2')
+        self.assertEqual(len(fake.hits('/movie/1')), 3)
+        self.assertEqual(len(fake.hits('/movie/2')), 5)
+
+    def test_not_found_is_not_retried(self):
+        with FakeTMDb({}) as fake, self.assertRaises(TMDbNotFound):
+            self.client_for(fake).get('/movie/404')
+        self.assertEqual(len(fake.requests), 1)
+
+    def test_auth_error_aborts_a_crawl(self):
+        def discover(query):
+            page = int(query['page'])
+            if page == 3: return 401, {'status_message': 'Invalid API key'}
+            return 200, {'page': page, 'total_pages': 5, 'results': [{'id': page, 'title': f'Page {page}', 'release_date': '2001-01-01'}]}
+
+        state = CrawlState.objects.create(endpoint='discover', year=2001, total_pages=5)
+        with FakeTMDb({'/discover/movie': discover}) as fake, self.assertRaises(TMDbAuthError):
+            crawl_pages(self.client_for(fake, workers=1), MovieBatchWriter({}, flush_every_pages=1), state, '/discover/movie', {'primary_release_year': 2001}, range(2, 6), first_page=discover({'page': 1})[1])
+        state.refresh_from_db()
+        self.assertEqual(state.last_page_done, 2)
+        self.assertIsNone(state.completed_at)
+        self.assertEqual(sorted(Movie.objects.values_list('tmdb_id', flat=True)), [1, 2])
+
+    def test_fetch_many_finishes_when_a_worker_fails(self):
+        client = TMDbClient(api_key='test', base_url='http://127.0.0.1:9', workers=3)
+
+        def get(path, **params):
+            if path == '/movie/2': raise RuntimeError('boom')
+            return {'path': path}
+
+        with mock.patch.object(client, 'get', side_effect=get):
+            results = {key: (data, error) for key, data, error in client.fetch_many((i, f'/movie/{i}', {}) for i in range(1, 6))}
+        self.assertEqual(sorted(results), [1, 2, 3, 4, 5])
+        self.assertIsInstance(results[2][1], TMDbError)
+        self.assertIn('boom', str(results[2][1]))
+        self.assertEqual([results[i] for i in (1, 3, 4, 5)], [({'path': f'/movie/{i}'}, None) for i in (1, 3, 4, 5)])
+
+
+class CreditBatchWriterTests(TestCase):
+    def setUp(self):
+        self.heat, self.ronin = (Movie.objects.create(title=title, release_year=year, tmdb_id=tmdb_id) for title, year, tmdb_id in (('Heat', 1995, 1), ('Ronin', 1998, 2)))
+        self.people = {tmdb_id: Person.objects.create(name=name, tmdb_id=tmdb_id) for tmdb_id, name in ((10, 'Al'), (11, 'Bob'), (12, 'Michael'))}
+        for tmdb_id, role, order in ((10, Credit.Role.CAST, 0), (11, Credit.Role.CAST, 1), (12, Credit.Role.DIRECTOR, 0)):
+            Credit.objects.create(movie=self.heat, person=self.people[tmdb_id], role=role, order=order)
+
+    def payload(self, imdb_id, cast, crew=()):
+        return {'revenue': 187_000_000, 'runtime': 170, 'imdb_id': imdb_id,
+                'credits': {'cast': [{'id': tmdb_id, 'name': name} for tmdb_id, name in cast], 'crew': [{'id': tmdb_id, 'name': name, 'job': job} for tmdb_id, name, job in crew]}}
+
+    def credits(self, movie):
+        return {(credit.person.tmdb_id, credit.role): (credit.id, credit.order) for credit in Credit.objects.filter(movie=movie).select_related('person')}
+
+    def test_credits_are_diffed_against_what_is_stored(self):
+        before = self.credits(self.heat)
+        writer = CreditBatchWriter(movies_per_batch=5)
+        writer.add(self.heat, self.payload('tt0113277', [(11, 'Bob'), (13, 'Val')], [(12, 'Michael', 'Director'), (14, 'Gaffer', 'Gaffer')]))
+        self.assertEqual(writer.flush(), 1)
+        after = self.credits(self.heat)
+        self.assertEqual(set(after), {(11, 'cast'), (13, 'cast'), (12, 'director')})  # Al's credit is stale, the gaffer not kept.
+        self.assertEqual(after[(11, 'cast')], (before[(11, 'cast')][0], 0))  # Moved up in place.
+        self.assertEqual(after[(12, 'director')], before[(12, 'director')])
+        self.assertEqual(after[(13, 'cast')][1], 1)
+        self.assertEqual(Person.objects.get(tmdb_id=13).name, 'Val')
+        heat = Movie.objects.get(pk=self.heat.pk)
+        self.assertEqual((heat.revenue, heat.revenue_tier, heat.runtime_minutes, heat.imdb_id), (187_000_000, 'major', 170, 'tt0113277'))
+        self.assertEqual(heat.credits_summary['cast'], [{'name': 'Bob'}, {'name': 'Val'}])
+
+    def test_integrity_error_falls_back_to_one_movie_at_a_time(self):
+        writer = CreditBatchWriter(movies_per_batch=2)
+        self.assertEqual(writer.add(self.heat, self.payload('tt1', [(11, 'Bob')])), 0)
+        self.assertEqual(writer.add(self.ronin, self.payload('tt1', [(13, 'Robert')])), 1)  # Same imdb_id: the second movie fails.
+        self.assertEqual([movie for movie, error in writer.failed], [self.ronin])
+        self.assertEqual(set(self.credits(self.heat)), {(11, 'cast')})
+        self.assertEqual(self.credits(self.ronin), {})
+        self.assertIsNone(Movie.objects.get(pk=self.ronin.pk).imdb_id)
+
+
+class TMDbYearIngestionTests(TestCase):
+    """Year crawls checkpoint as pages commit, resume at the first missing page and skip unchanged years."""
+    YEAR = 2001
+
+    def setUp(self):
+        self.failing_pages = {3}
+
+    def discover(self, query):
+        page = int(query['page'])
+        if int(query['primary_release_year']) != self.YEAR: return 200, {'page': 1, 'total_pages': 0, 'total_results': 0, 'results': []}
+        if page in self.failing_pages: return 500, {}
+        return 200, {'page': page, 'total_pages': 5, 'total_results': 5, 'results': [{'id': page, 'title': f'Page {page}', 'release_date': f'{self.YEAR}-01-01', 'genre_ids': [18]}]}
+
+    def ingest(self):
+        routes = {'/genre/movie/list': (200, {'genres': [{'id': 18, 'name': 'Drama'}]}), '/discover/movie': self.discover}
+        with FakeTMDb(routes) as fake, mock.patch('tracker.tmdb.TMDB_BASE_URL', fake.url), mock.patch('tracker.tmdb.TMDB_REQUESTS_PER_SECOND', 1000), \
+                mock.patch('tracker.management.commands.ingest_tmdb_year.TMDB_API_KEY', 'test'), mock.patch('tracker.tmdb.time.sleep'), redirect_stdout(StringIO()):
+            call_command('ingest_tmdb_year', workers=2, flush_pages=1, stdout=StringIO())
+        return sorted(int(query['page']) for at, path, query, status in fake.hits('/discover/movie') if query['primary_release_year'] == str(self.YEAR))
+
+    def state(self):
+        return CrawlState.objects.get(endpoint='discover', year=self.YEAR)
+
+    def test_failed_page_is_resumed_then_the_year_is_skipped_while_unchanged(self):
+        self.assertEqual(self.ingest(), [1, 2, 3, 3, 3, 3, 3, 4, 5])
+        self.assertEqual((self.state().last_page_done, self.state().completed_at), (2, None))
+        self.assertEqual(sorted(Movie.objects.values_list('tmdb_id', flat=True)), [1, 2, 4, 5])
+        self.assertEqual(list(Movie.objects.get(tmdb_id=1).genre.values_list('name', flat=True)), ['Drama'])
+
+        self.failing_pages = set()
+        self.assertEqual(self.ingest(), [3, 4, 5])
+        self.assertEqual(self.state().last_page_done, 5)
+        self.assertIsNotNone(self.state().completed_at)
+        self.assertEqual(Movie.objects.count(), 5)
+        self.assertTrue(CrawlState.objects.get(endpoint='discover', year=self.YEAR - 1).is_complete)
+
+        self.assertEqual(self.ingest(), [1])
+
+    def test_checkpoint_waits_for_the_pages_before_it(self):
+        state = CrawlState.objects.create(endpoint='discover', year=self.YEAR, total_pages=5)
+        writer = MovieBatchWriter({}, flush_every_pages=2)
+        with FakeTMDb({'/discover/movie': self.discover}) as fake, mock.patch('tracker.tmdb.time.sleep'):
+            client = TMDbClient(api_key='test', base_url=fake.url, requests_per_second=1000, workers=2)
+            pages = []
+            new = crawl_pages(client, writer, state, '/discover/movie', {'primary_release_year': self.YEAR}, range(2, 6), first_page=self.discover({'page': 1, 'primary_release_year': self.YEAR})[1],
+                              on_page=lambda page, error: pages.append((page, error is None)))
+        self.assertEqual((new, sorted(pages)), (4, [(2, True), (3, False), (4, True), (5, True)]))
+        state.refresh_from_db()
+        self.assertEqual((state.last_page_done, state.is_complete), (2, False))
+
+
+class SyncTMDbChangesTests(TestCase):
+    def details(self, tmdb_id):
+        return 200, {'id': tmdb_id, 'revenue': 5_000_000, 'runtime': 90 + tmdb_id, 'imdb_id': f'tt{tmdb_id}', 'credits': {'cast': [{'id': 100 + tmdb_id, 'name': f'Actor {tmdb_id}'}], 'crew': []}}
+
+    def sync(self, routes, **options):
+        with FakeTMDb(routes) as fake, mock.patch('tracker.tmdb.TMDB_BASE_URL', fake.url), mock.patch('tracker.management.commands.sync_tmdb_changes.TMDB_API_KEY', 'test'), \
+                mock.patch('tracker.tmdb.time.sleep'), redirect_stdout(StringIO()):
+            call_command('sync_tmdb_changes', workers=2, stdout=StringIO(), **options)
+        return fake
+
+    def test_failed_movies_are_retried_without_holding_back_the_watermark(self):
+        for tmdb_id in (1, 2, 3, 4):
+            Movie.objects.create(title=f'Movie {tmdb_id}', release_year=2000, tmdb_id=tmdb_id)
+        since = date.today() - timedelta(days=20)
+
+        def changes(query):
+            # Two 14-day windows; the first has two pages. 99 is not in the catalogue.
+            if query['start_date'] == since.isoformat():
+                return 200, {'page': int(query['page']), 'total_pages': 2, 'results': [{'id': 1}] if query['page'] == '1' else [{'id': 2}, {'id': 99}]}
+            return 200, {'page': 1, 'total_pages': 1, 'results': [{'id': 3}]}
+
+        fake = self.sync({'/movie/changes': changes, '/movie/1': self.details(1), '/movie/3': (500, {})}, since=since)
+        self.assertEqual(sorted(query['start_date'] for at, path, query, status in fake.hits('/movie/changes') if query['page'] == '1'), [since.isoformat(), (since + timedelta(days=14)).isoformat()])
+        state = CrawlState.objects.get(endpoint='changes')
+        self.assertIsNotNone(state.completed_at)
+        self.assertEqual(state.retry_ids, {'3': 1})  # 2 is gone from TMDb (404): not retried.
+        self.assertEqual(Movie.objects.get(tmdb_id=1).runtime_minutes, 91)
+        self.assertEqual(fake.hits('/movie/4'), [])
+
+        # The next run reads from the watermark and fetches the failed movie again, on its own.
+        fake = self.sync({'/movie/changes': (200, {'page': 1, 'total_pages': 1, 'results': []}), '/movie/3': self.details(3)})
+        self.assertEqual([path for at, path, query, status in fake.requests if path != '/movie/changes'], ['/movie/3'])
+        state.refresh_from_db()
+        self.assertEqual(state.retry_ids, {})
+        self.assertEqual(Movie.objects.get(tmdb_id=3).runtime_minutes, 93)
+        self.assertEqual(Movie.objects.get(tmdb_id=3).credit_set.get().person.name, 'Actor 3')
+
+    def test_movies_that_keep_failing_are_dropped_from_the_retries(self):
+        Movie.objects.create(title='Broken', release_year=2000, tmdb_id=7)
+        CrawlState.objects.create(endpoint='changes', completed_at=timezone.now(), retry_ids={'7': 4})
+        self.sync({'/movie/changes': (200, {'page': 1, 'total_pages': 1, 'results': []}), '/movie/7': (500, {})})
+        self.assertEqual(CrawlState.objects.get(endpoint='changes').retry_ids, {})
+
+    def test_changes_feed_failure_keeps_the_watermark(self):
+        watermark = timezone.now() - timedelta(days=2)
+        CrawlState.objects.create(endpoint='changes', completed_at=watermark)
+        with self.assertRaises(CommandError):
+            self.sync({'/movie/changes': (500, {})})
+        self.assertEqual(CrawlState.objects.get(endpoint='changes').completed_at, watermark)
+
+
+class PersonSearchTests(TestCase):
+    """A person search resolves people first, then keeps the movies crediting any of them in any role."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('searcher', password='pw')
+        self.mann, self.caine, self.bale = (Person.objects.create(name=name) for name in ('Michael Mann', 'Michael Caine', 'Christian Bale'))
+        self.heat, self.alfie, self.prestige, self.other = (Movie.objects.create(title=title, release_year=2000) for title in ('Heat', 'Alfie', 'The Prestige', 'Other'))
+        for movie, person, role in ((self.heat, self.mann, Credit.Role.DIRECTOR), (self.alfie, self.caine, Credit.Role.CAST), (self.prestige, self.caine, Credit.Role.CAST), (self.prestige, self.bale, Credit.Role.CAST)):
+            Credit.objects.create(movie=movie, person=person, role=role)
+
+    def test_substring_search_matches_people_in_any_role(self):
+        self.assertEqual(matching_person_ids('michael'), [self.mann.id, self.caine.id])
+        self.assertEqual(matching_person_ids('michael', limit=1), [self.mann.id])
+        self.assertEqual(set(filtered_unseen_movies(self.user, person_query='Michael')), {self.heat, self.alfie, self.prestige})
+        UserMovieView.objects.create(user=self.user, movie=self.alfie, has_seen=True)
+        self.assertEqual(list(filtered_unseen_movies(self.user, person_query='caine')), [self.prestige])
+        self.assertEqual(list(filtered_unseen_movies(self.user, person_query='nobody')), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Trigram matching needs PostgreSQL (pg_trgm).')
+    def test_misspelt_names_match_through_trigrams(self):
+        self.assertEqual(matching_person_ids('Micheal Man')[0], self.mann.id)
+
+
+class PersonMigrationTests(TransactionTestCase):
+    """Migration 0022 folds the four per-role person tables into Person, merging the same TMDb/IMDb person."""
+    before = [('tracker', '0021_person_name_trigram_indexes')]
+    after = [('tracker', '0022_person_credit')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('tracker'))
+
+    def test_people_are_merged_and_credits_copied(self):
+        apps = self.migrate(self.before)
+        Movie = apps.get_model('tracker', 'Movie'); Actor = apps.get_model('tracker', 'Actor'); Director = apps.get_model('tracker', 'Director')
+        heat = Movie.objects.create(title='Heat', release_year=1995); insider = Movie.objects.create(title='The Insider', release_year=1999)
+        pacino = Actor.objects.create(name='Al Pacino', tmdb_id=1158)
+        mann_actor = Actor.objects.create(name='Michael Mann', imdb_id='nm0000520')
+        mann = Director.objects.create(name='Michael Mann', tmdb_id=638, imdb_id='nm0000520')
+        namesake = Director.objects.create(name='Al Pacino')  # No ids: never merged by name.
+        MovieCastCredit = apps.get_model('tracker', 'MovieCastCredit')
+        MovieCastCredit.objects.create(movie=heat, actor=pacino, order=0); MovieCastCredit.objects.create(movie=heat, actor=mann_actor, order=1)
+        MovieCastCredit.objects.create(movie=insider, actor=pacino, order=0)
+        heat.directors.add(mann); insider.directors.add(mann, namesake)
+
+        apps = self.migrate(self.after)
+        Person = apps.get_model('tracker', 'Person'); Credit = apps.get_model('tracker', 'Credit')
+        self.assertEqual(set(Person.objects.values_list('name', 'tmdb_id', 'imdb_id')), {('Al Pacino', None, None), ('Al Pacino', 1158, None), ('Michael Mann', 638, 'nm0000520')})
+        credits = set(Credit.objects.values_list('movie__title', 'role', 'person__name', 'person__tmdb_id', 'order'))
+        self.assertEqual(credits, {('Heat', 'cast', 'Al Pacino', 1158, 0), ('Heat', 'cast', 'Michael Mann', 638, 1), ('Heat', 'director', 'Michael Mann', 638, 0),
+                                   ('The Insider', 'cast', 'Al Pacino', 1158, 0), ('The Insider', 'director', 'Al Pacino', None, 1), ('The Insider', 'director', 'Michael Mann', 638, 0)})
+
+
+class MovieDetailTests(TestCase):
+    """The detail page renders from Movie.credits_summary and answers a revalidation with 304 until it is rebuilt."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('viewer', password='pw')
+        self.movie = Movie.objects.create(title='Heat', release_year=1995)
+        self.movie.genre.add(Genre.objects.create(name='Crime'), Genre.objects.create(name='Action'))
+        for order, (name, role) in enumerate([('Al Pacino', Credit.Role.CAST), ('Art Linson', Credit.Role.PRODUCER), ('Robert De Niro', Credit.Role.CAST), ('Michael Mann', Credit.Role.DIRECTOR)]):
+            Credit.objects.create(movie=self.movie, person=Person.objects.create(name=name), role=role, order=order)
+        self.url = reverse('movie_detail', args=[self.movie.id])
+
+    def test_summary_lists_genres_crew_in_role_order_then_cast(self):
+        self.assertEqual(rebuild_credits_summaries([self.movie.id]), 1)
+        movie = Movie.objects.get()
+        self.assertEqual(movie.credits_summary, {'genres': ['Action', 'Crime'], 'crew': [{'role': 'Director', 'name': 'Michael Mann'}, {'role': 'Producer', 'name': 'Art Linson'}],
+                                                 'cast': [{'name': 'Al Pacino'}, {'name': 'Robert De Niro'}]})
+        self.assertIsNotNone(movie.credits_updated_at)
+
+    def test_etag_revalidation(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Michael Mann')
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # The navbar is per-user, so another user's copy never validates.
+        self.client.force_login(User.objects.create_user('other', password='pw'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # A rebuilt summary is a new version of the page.
+        self.client.force_login(self.user)
+        rebuild_credits_summaries([self.movie.id])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class FragmentCacheTests(TestCase):
+    """Fragments are served from the cache until a write to one of their scopes commits."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        self.movie = Movie.objects.create(title='Heat', release_year=1995)
+
+    def test_hits_and_misses_are_counted(self):
+        build = mock.Mock(return_value=['Drama'])
+        self.assertEqual([cached_fragment('genre_list', [], [GENRES_SCOPE], build) for _ in range(3)], [['Drama']] * 3)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(cache_stats()['genre_list'], {'hits': 2, 'misses': 1, 'hit_rate': 0.667})
+        reset_cache_stats()
+        self.assertEqual(cache_stats()['genre_list'], {'hits': 0, 'misses': 0, 'hit_rate': None})
+
+    def test_invalidate_orphans_only_its_scope(self):
+        mine = mock.Mock(return_value='mine'); theirs = mock.Mock(return_value='theirs')
+        for _ in range(2):
+            cached_fragment('last_rated_list', [self.alice.id], [user_scope(self.alice.id)], mine)
+            cached_fragment('last_rated_list', [self.bob.id], [user_scope(self.bob.id)], theirs)
+            invalidate(user_scope(self.alice.id))
+        self.assertEqual((mine.call_count, theirs.call_count), (2, 1))
+
+    def assert_invalidated_on_commit(self, scopes, write):
+        before = scope_versions(scopes)
+        with self.captureOnCommitCallbacks() as callbacks:
+            write()
+            self.assertEqual(scope_versions(scopes), before)
+        self.assertTrue(callbacks)
+        for callback in callbacks: callback()
+        self.assertTrue(all(after > version for after, version in zip(scope_versions(scopes), before)), scopes)
+
+    def test_rating_invalidates_the_user_scope(self):
+        self.assert_invalidated_on_commit([user_scope(self.alice.id)], lambda: UserMovieView.objects.create(user=self.alice, movie=self.movie, has_seen=True))
+        self.assert_invalidated_on_commit([user_scope(self.alice.id)], lambda: UserMovieView.objects.get().delete())
+
+    def test_movie_change_invalidates_the_movie_and_catalogue_scopes(self):
+        self.movie.title = 'Heat (1995)'
+        self.assert_invalidated_on_commit([movie_scope(self.movie.id), CATALOGUE_SCOPE], self.movie.save)
+
+    def test_genre_change_invalidates_the_genre_scope(self):
+        self.assert_invalidated_on_commit([GENRES_SCOPE], lambda: Genre.objects.create(name='Noir'))
+
+    def test_friendship_change_invalidates_both_friend_scopes(self):
+        self.assert_invalidated_on_commit([friends_scope(self.alice.id), friends_scope(self.bob.id)],
+                                          lambda: Friendship.objects.create(**Friendship.pair(self.alice, self.bob), requested_by=self.alice))
+
+    def test_rolled_back_write_invalidates_nothing(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Genre.objects.create(name='Noir')
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+
+    def test_deploy_check_requires_a_shared_cache_without_debug(self):
+        backends = {'locmem': 'django.core.cache.backends.locmem.LocMemCache', 'file': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'redis': 'django.core.cache.backends.redis.RedisCache'}
+        errors = {}
+        for name, backend in backends.items():
+            with override_settings(DEBUG=False, CACHES={'default': {'BACKEND': backend, 'LOCATION': '/tmp/hysi-unused'}}):
+                errors[name] = [error.id for error in check_shared_cache(None)]
+        self.assertEqual(errors, {'locmem': ['tracker.E001'], 'file': ['tracker.E001'], 'redis': []})
+        with override_settings(DEBUG=True): self.assertEqual(check_shared_cache(None), [])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('pager', password='pw')
+        movies = Movie.objects.bulk_create([Movie(title=f'Movie {i}', release_year=2000) for i in range(25)])
+        UserMovieView.objects.bulk_create([UserMovieView(user=self.user, movie=movie, has_seen=True) for movie in movies])
+        # Ties on date_recorded are broken by id, so rows sharing a timestamp can't be skipped or repeated.
+        UserMovieView.objects.filter(movie__in=movies[5:15]).update(date_recorded=timezone.now() - timedelta(days=1))
+        self.views = UserMovieView.objects.filter(user=self.user)
+
+    def walk(self, page_size, limit=None):
+        pages = []; cursor = None
+        while True:
+            rows, cursor = keyset_page(self.views, cursor, page_size, limit=limit)
+            pages.append([row.id for row in rows])
+            if cursor is None: return pages
+
+    def test_pages_cover_every_row_once_in_order(self):
+        expected = list(self.views.order_by('-date_recorded', '-id').values_list('id', flat=True))
+        for page_size in (1, 4, 7, 25, 30):
+            pages = self.walk(page_size)
+            self.assertEqual([row_id for page in pages for row_id in page], expected, page_size)
+            self.assertTrue(all(pages), page_size)
+
+    def test_limit_caps_how_far_the_list_pages(self):
+        self.assertEqual([len(page) for page in self.walk(4, limit=10)], [4, 4, 2])
+
+    def test_cursor_round_trip_and_bad_cursors(self):
+        recorded = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(recorded, 42, 12)), (recorded, 42, 12))
+        for token in ('garbage', encode_cursor(recorded, 1, 1)[:-2] + '!!', ''):
+            with self.assertRaises(ValueError): decode_cursor(token)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('get_last_rated_page'), {'cursor': 'garbage'}).status_code, 400)
+        first = self.client.get(reverse('get_seen_movies_page', args=['pager'])).json()
+        self.assertEqual(self.client.get(reverse('get_seen_movies_page', args=['pager']), {'cursor': first['next_cursor']}).status_code, 200)
+
+
+class FriendSeenGridTests(TestCase):
+    """A friend's seen grid marks the movies the viewer hasn't seen with a per-row EXISTS, in one query."""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.viewer = User.objects.create_user('viewer', password='pw')
+        Friendship.objects.create(**Friendship.pair(self.owner, self.viewer), requested_by=self.owner, status=Friendship.Status.ACCEPTED)
+        self.movies = Movie.objects.bulk_create([Movie(title=f'Movie {i}', release_year=2000) for i in range(4)])
+        UserMovieView.objects.bulk_create([UserMovieView(user=self.owner, movie=movie, has_seen=True) for movie in self.movies[:3]])
+        UserMovieView.objects.bulk_create([UserMovieView(user=self.viewer, movie=self.movies[0], has_seen=True), UserMovieView(user=self.viewer, movie=self.movies[1], has_seen=False),
+                                           UserMovieView(user=self.viewer, movie=self.movies[3], has_seen=True)])
+
+    def test_rows_are_annotated_for_the_viewer(self):
+        with self.assertNumQueries(1):
+            marks = {view.movie.title: view.viewer_has_seen for view in seen_movies_for(self.owner, self.viewer)}
+        self.assertEqual(marks, {'Movie 0': True, 'Movie 1': False, 'Movie 2': False})
+        self.assertFalse(hasattr(seen_movies_for(self.owner).first(), 'viewer_has_seen'))
+
+    def test_friend_grid_marks_unseen_movies(self):
+        self.client.force_login(self.viewer)
+        html = self.client.get(reverse('get_seen_movies_page', args=['owner'])).json()['html']
+        self.assertEqual(html.count('not-seen-by-viewer'), 2)
+        self.client.force_login(self.owner)
+        self.assertNotIn('not-seen-by-viewer', self.client.get(reverse('get_seen_movies_page', args=['owner'])).json()['html'])
+
+
+# Session, user, owner + profile, then the invite-code prefetch, the friendships, the friends' feed and the two list pages on your own profile.
+PROFILE_QUERY_BUDGET = 8
+
+
+class ProfileQueryBudgetTests(TestCase):
+    """profile_view must cost a fixed number of queries however many friends, codes and ratings a user has."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='pw')
+        cls.friend = User.objects.create_user('friend', password='pw')
+        movies = Movie.objects.bulk_create([Movie(title=f'Movie {i}', release_year=2000) for i in range(40)])
+        for i, movie in enumerate(movies):
+            UserMovieView.objects.create(user=cls.owner, movie=movie, has_seen=i % 3 != 0)
+            if i % 2: UserMovieView.objects.create(user=cls.friend, movie=movie, has_seen=True)
+        for i in range(8):
+            other = User.objects.create_user(f'user{i}', password='pw')
+            if i < 4: Friendship.objects.create(**Friendship.pair(cls.owner, other), requested_by=cls.owner, status=Friendship.Status.ACCEPTED)
+            elif i < 6: Friendship.objects.create(**Friendship.pair(cls.owner, other), requested_by=other)
+            else: Friendship.objects.create(**Friendship.pair(cls.owner, other), requested_by=cls.owner)
+            InviteCode.objects.create(generated_by=cls.owner, used_by=other if i < 2 else None)
+        Friendship.objects.create(**Friendship.pair(cls.owner, cls.friend), requested_by=cls.friend, status=Friendship.Status.ACCEPTED)
+
+    def setUp(self):
+        # Fixtures are never committed, so their on-commit invalidations don't run: start from an empty cache.
+        cache.clear()
+
+    def login(self, user):
+        # A fresh instance, so the login's last_login save can't write back a stale cached profile.
+        self.client.force_login(User.objects.get(pk=user.pk))
+
+    def get_profile(self, viewer, url):
+        self.login(viewer)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), PROFILE_QUERY_BUDGET, '\n'.join(query['sql'] for query in queries))
+        return response
+
+    def test_own_profile_stays_within_budget(self):
+        response = self.get_profile(self.owner, reverse('my_profile'))
+        self.assertEqual(len(response.context['friends_list']), 5)
+        self.assertEqual(len(response.context['incoming_requests']), 2)
+        self.assertEqual(len(response.context['sent_requests']), 2)
+        self.assertEqual(len(response.context['available_codes']), 6)
+        self.assertEqual(response.context['total_rated_movies'], 40)
+
+    def test_friend_profile_stays_within_budget(self):
+        response = self.get_profile(self.friend, reverse('profile_dashboard', args=['owner']))
+        self.assertEqual(response.context['friendship_status'], 'FRIENDS')
+        self.assertEqual(len(response.context['seen_movies_list']), 12)
+
+    def test_pending_request_profile_stays_within_budget(self):
+        sender = User.objects.get(username='user4')
+        response = self.get_profile(self.owner, reverse('profile_dashboard', args=['user4']))
+        self.assertEqual(response.context['friendship_status'], 'REQUEST_RECEIVED')
+        self.assertEqual(response.context['request_obj']['id'], Friendship.objects.get(requested_by=sender).id)
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.login(self.owner)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(reverse('my_profile'))
+        extra = Movie.objects.bulk_create([Movie(title=f'Extra {i}', release_year=2001) for i in range(30)])
+        UserMovieView.objects.bulk_create([UserMovieView(user=self.owner, movie=movie, has_seen=True) for movie in extra])
+        for i in range(5):
+            other = User.objects.create_user(f'late{i}', password='pw')
+            Friendship.objects.create(**Friendship.pair(self.owner, other), requested_by=self.owner, status=Friendship.Status.ACCEPTED)
+            InviteCode.objects.create(generated_by=self.owner)
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(reverse('my_profile'))
+        self.assertEqual(len(before), len(after))
+
+
+class RequestMetricsTests(TestCase):
+    """Every request is measured into the configured sinks; /metrics/ exposes the Prometheus one to staff or the token holder."""
+
+    def setUp(self):
+        self.sink = PrometheusSink(); self.recorded = []; record = self.sink.record
+        self.sink.record = lambda metrics: (self.recorded.append(metrics), record(metrics))
+        patcher = mock.patch('tracker.metrics._sinks', [self.sink]); patcher.start(); self.addCleanup(patcher.stop)
+
+    def test_requests_are_measured(self):
+        self.client.force_login(User.objects.create_user('measured', password='pw'))
+        response = self.client.get(reverse('about'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+        metrics = self.recorded[-1]
+        self.assertEqual((metrics.view, metrics.status, metrics.method), ('about', 200, 'GET'))
+        self.assertGreater(metrics.queries, 0)  # The session and user lookups.
+        self.assertGreater(metrics.template_seconds, 0)
+        self.assertGreaterEqual(metrics.total_seconds, metrics.db_seconds)
+
+    @override_settings(VIEW_BUDGETS={'about': {'queries': 0}})
+    def test_over_budget_requests_are_logged(self):
+        with self.assertLogs('tracker.metrics', 'WARNING') as logs:
+            self.client.force_login(User.objects.create_user('measured', password='pw'))
+            self.client.get(reverse('about'))
+        self.assertIn('[about] over budget', logs.output[-1])
+
+    @override_settings(VIEW_BUDGETS={'about': {'queries': 0, 'cold': {'queries': 50}}, 'POST about': {'queries': 50}})
+    def test_cold_and_write_requests_have_their_own_budgets(self):
+        self.client.force_login(User.objects.create_user('measured', password='pw'))
+        with self.assertNoLogs('tracker.metrics', 'WARNING'):
+            with mock.patch('tracker.views.render', side_effect=lambda *args, **kwargs: (mark_cold('test'), render(*args, **kwargs))[1]):
+                self.client.get(reverse('about'))
+            self.client.post(reverse('about'))
+        with self.assertLogs('tracker.metrics', 'WARNING') as logs:
+            self.client.get(reverse('about'))
+        self.assertIn('[about] over budget', logs.output[-1])
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_endpoint_access(self):
+        url = reverse('metrics')
+        self.client.get(reverse('about'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hysi_requests_total{view="about",status="200"} 1', response.content.decode())
+        self.client.force_login(User.objects.create_user('member', password='pw'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with mock.patch('tracker.metrics._sinks', []):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class BenchmarkCommandTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def generate(self, **options):
+        with redirect_stdout(StringIO()):
+            call_command('generate_catalogue', movies=60, people=20, users='0,15', batch_size=25, summaries=True, stdout=StringIO(), **options)
+
+    def test_generate_catalogue_is_reproducible_and_clearable(self):
+        self.generate()
+        first = (list(Movie.objects.order_by('title').values_list('title', 'revenue', 'revenue_tier')), Credit.objects.count())
+        self.assertEqual(len(first[0]), 60)
+        self.assertEqual([(user.username, user.profile.total_rated) for user in User.objects.order_by('username')], [('bench_user_0', 0), ('bench_user_15', 15)])
+        self.assertFalse(Movie.objects.filter(credits_updated_at__isnull=True).exists())
+        self.assertFalse(any(user.has_usable_password() for user in User.objects.all()))
+        self.generate(clear=True, password='s3cret')
+        self.assertTrue(User.objects.get(username='bench_user_0').check_password('s3cret'))
+        self.assertEqual((list(Movie.objects.order_by('title').values_list('title', 'revenue', 'revenue_tier')), Credit.objects.count()), first)
+        with self.assertRaises(CommandError):
+            call_command('generate_catalogue', movies=5, users='10', stdout=StringIO())
+
+    def test_benchmark_reports_every_scenario_and_leaves_the_data_as_it_was(self):
+        self.generate()
+        user = User.objects.get(username='bench_user_15')
+        # A friend, so the rating scenarios fan out to a feed the benchmark has to clean up.
+        friend = User.objects.get(username='bench_user_0')
+        Friendship.objects.create(**Friendship.pair(user, friend), requested_by=friend, status=Friendship.Status.ACCEPTED)
+        ratings = list(UserMovieView.objects.filter(user=user).order_by('id').values_list('movie_id', 'has_seen'))
+        bits = seen_bitmap(user.id)
+        cache.set('unrelated', 'kept')
+        with tempfile.TemporaryDirectory() as directory:
+            report_path = os.path.join(directory, 'report.json'); out = StringIO()
+            call_command('benchmark', users='bench_user_15', iterations=2, warmup=1, depth=1, output=report_path, verbosity=2, stdout=out)
+            call_command('benchmark', users='bench_user_15', scenarios='next_movie', iterations=2, warmup=0, compare=report_path, verbosity=2, stdout=out)
+            with open(report_path) as f: report = json.load(f)
+        results = report['results']['bench_user_15']
+        self.assertLessEqual({'next_movie', 'rate_movie', 'rate_api', 'profile', 'seen_page', 'movie_detail'}, set(results))
+        self.assertEqual(results['profile']['n'], 2)
+        self.assertIn('Compared with', out.getvalue())
+        self.assertEqual(list(UserMovieView.objects.filter(user=user).order_by('id').values_list('movie_id', 'has_seen')), ratings)
+        self.assertEqual(Profile.objects.get(user=user).total_rated, 15)
+        self.assertEqual((FeedEntry.objects.count(), InviteCode.objects.count(), seen_bitmap(user.id)), (0, 0, bits))
+        with self.assertRaises(CommandError):
+            call_command('benchmark', scenarios='warp_speed', stdout=StringIO())
+
+    def test_cold_runs_rebuild_fragments_without_clearing_the_cache(self):
+        self.generate()
+        cache.set('unrelated', 'kept'); reset_cache_stats()
+        call_command('benchmark', users='bench_user_15', scenarios='seen_page,last_rated_page,movie_detail', iterations=2, warmup=1, cold=True, verbosity=2, stdout=StringIO())
+        stats = cache_stats()
+        self.assertEqual([(stats[fragment]['hits'], stats[fragment]['misses']) for fragment in ('seen_movies_grid', 'last_rated_list', 'movie_detail')], [(0, 3)] * 3)
+        self.assertEqual(cache.get('unrelated'), 'kept')
+        self.assertEqual(cache.get_many(['cache_bumped:catalogue', 'cache_bumped:genres', f"cache_bumped:user:{User.objects.get(username='bench_user_15').id}"]), {})
+
+
+class RatingBufferTests(TestCase):
+    """JSON swipes are buffered in the cache and written in batches, without losing or double-counting any."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('swiper', password='pw')
+        self.movies = Movie.objects.bulk_create([Movie(title=f'Movie {i}', release_year=2000) for i in range(8)])
+        self.client.force_login(self.user)
+
+    def swipe(self, movie, has_seen=True, **extra):
+        return self.client.post(reverse('rate_movie_api'), {'movie_id': movie.id, 'has_seen': has_seen, **extra}, content_type='application/json')
+
+    def assert_counters_match(self):
+        profile = Profile.objects.get(user=self.user); views = UserMovieView.objects.filter(user=self.user)
+        self.assertEqual((profile.total_rated, profile.total_seen), (views.count(), views.filter(has_seen=True).count()))
+
+    @mock.patch('tracker.rating_buffer.BUFFER_SIZE', 3)
+    def test_swipes_are_written_once_the_buffer_is_full(self):
+        for movie in self.movies[:2]:
+            response = self.swipe(movie)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_seen_movies'], 2)
+        self.assertFalse(UserMovieView.objects.exists())
+        self.assertEqual(list(pending_users()), [self.user.id])
+        self.swipe(self.movies[2], has_seen=False)
+        self.assertEqual(UserMovieView.objects.filter(user=self.user).count(), 3)
+        self.assertEqual((buffered_ratings(self.user.id), pending_users()), ([], {}))
+        self.assert_counters_match()
+
+    def test_old_buffers_are_due(self):
+        self.assertFalse(flush_due([]))
+        self.assertFalse(flush_due([[self.movies[0].id, True, time.time()]]))
+        self.assertTrue(flush_due([[self.movies[0].id, True, time.time() - 3600]]))
+
+    def test_a_failed_write_keeps_the_buffer(self):
+        buffer_rating(self.user.id, self.movies[0].id, True)
+        with mock.patch.object(UserMovieView.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError): flush_ratings(self.user)
+        self.assertEqual(len(buffered_ratings(self.user.id)), 1)
+        self.assertEqual(flush_ratings(self.user), 1)
+        self.assertEqual(buffered_ratings(self.user.id), [])
+
+    def test_ratings_already_made_elsewhere_are_not_counted_twice(self):
+        for movie in self.movies[:3]: buffer_rating(self.user.id, movie.id, True)
+        UserMovieView.objects.create(user=self.user, movie=self.movies[1], has_seen=False)
+        real_bulk_create = UserMovieView.objects.bulk_create; calls = []
+        def conflicting(views, *args, **kwargs):
+            # The first insert collides with a rating made between the check and the insert.
+            calls.append(len(views))
+            if len(calls) == 1: UserMovieView.objects.create(user=self.user, movie=self.movies[2], has_seen=True)
+            return real_bulk_create(views, *args, **kwargs)
+        with mock.patch.object(UserMovieView.objects, 'bulk_create', side_effect=conflicting):
+            self.assertEqual(flush_ratings(self.user), 2)
+        self.assertEqual(calls, [2, 2])
+        self.assertFalse(UserMovieView.objects.get(user=self.user, movie=self.movies[1]).has_seen)
+        self.assert_counters_match()
+
+    def test_swipes_on_deleted_movies_are_dropped(self):
+        self.swipe(self.movies[0]); self.swipe(self.movies[1], has_seen=False)
+        self.movies[0].delete()
+        self.assertEqual(self.client.get(reverse('my_profile')).status_code, 200)
+        self.assertEqual(list(UserMovieView.objects.filter(user=self.user).values_list('movie_id', flat=True)), [self.movies[1].id])
+        self.assertEqual((buffered_ratings(self.user.id), pending_users()), ([], {}))
+        self.assert_counters_match()
+
+    def test_other_integrity_errors_are_not_retried(self):
+        buffer_rating(self.user.id, self.movies[0].id, True)
+        with mock.patch.object(UserMovieView.objects, 'bulk_create', side_effect=IntegrityError('CHECK constraint failed')) as bulk_create:
+            with self.assertRaises(IntegrityError): flush_ratings(self.user)
+        self.assertEqual(bulk_create.call_count, 1)
+        self.assertEqual(len(buffered_ratings(self.user.id)), 1)
+
+    @mock.patch('tracker.rating_buffer.LOCK_TIMEOUT', 0.05)
+    def test_a_held_lock_is_reported_busy_and_left_alone(self):
+        cache.add(f'rating_buffer:{self.user.id}:lock', 'other', 60)
+        with self.assertRaises(BufferBusy): buffer_rating(self.user.id, self.movies[0].id, True)
+        self.assertEqual(self.swipe(self.movies[0]).status_code, 503)
+        self.assertEqual(cache.get(f'rating_buffer:{self.user.id}:lock'), 'other')
+
+    def test_flush_command_writes_buffers_old_enough(self):
+        buffer_rating(self.user.id, self.movies[0].id, True)
+        call_command('flush_rating_buffers', '--min-age', '3600', stdout=StringIO())
+        self.assertFalse(UserMovieView.objects.exists())
+        out = StringIO(); call_command('flush_rating_buffers', stdout=out)
+        self.assertIn('Flushed 1 rating buffers (1 new ratings)', out.getvalue())
+        self.assertEqual(pending_users(), {})
+        self.assert_counters_match()
+
+    def test_invalid_swipes_are_rejected(self):
+        url = reverse('rate_movie_api')
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.post(url, 'not json', content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.post(url, {'has_seen': True}, content_type='application/json').status_code, 400)
+        self.assertEqual(self.swipe(self.movies[0], genre='drama').status_code, 400)
+        self.assertEqual(self.client.post(url, {'movie_id': 999999, 'has_seen': True}, content_type='application/json').status_code, 404)
+        self.assertEqual(buffered_ratings(self.user.id), [])
+        self.client.logout()
+        self.assertEqual(self.swipe(self.movies[0]).status_code, 302)
+
+
+class ProfileSaveTests(TestCase):
+    """Saving a User must not rewrite its profile unless the profile itself was changed."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('rater', password='pw')
+        self.user.profile # Cache the profile on the instance, as request.user often has it.
+        movie = Movie.objects.create(title='Movie', release_year=2000)
+        UserMovieView.objects.create(user=self.user, movie=movie, has_seen=True)
+
+    def test_login_does_not_write_back_stale_counters(self):
+        self.client.force_login(self.user)
+        self.assertEqual(Profile.objects.get(user=self.user).total_rated, 1)
+
+    def test_only_changed_profile_fields_are_saved(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.user.save()
+        self.assertFalse([query for query in queries if 'tracker_profile' in query['sql']])
+        self.user.profile.date_of_birth = date(1990, 1, 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.user.save()
+        profile_updates = [query['sql'] for query in queries if 'UPDATE "tracker_profile"' in query['sql']]
+        self.assertEqual(len(profile_updates), 1)
+        self.assertNotIn('total_rated', profile_updates[0])
+        self.assertEqual(Profile.objects.get(user=self.user).total_rated, 1)
+
+
+@mock.patch('tracker.middleware.replica_enabled', return_value=True)
+@mock.patch('tracker.routers.replica_enabled', return_value=True)
+class ReplicaRoutingTests(SimpleTestCase):
+    """Reads go to the replica unless the request (or a recent one from the same browser) wrote."""
+
+    def handle(self, request, write=False):
+        router = PrimaryReplicaRouter(); seen = {}
+        def view(request):
+            seen['before'] = router.db_for_read(Movie)
+            if write: router.db_for_write(Movie)
+            seen['after'] = router.db_for_read(Movie)
+            with use_primary(): seen['pinned'] = router.db_for_read(Movie)
+            return HttpResponse()
+        return ReplicaRoutingMiddleware(view)(request), seen
+
+    def test_reads_outside_requests_use_the_primary(self, *mocks):
+        self.assertEqual(PrimaryReplicaRouter().db_for_read(Movie), 'default')
+
+    def test_read_only_request_uses_the_replica(self, *mocks):
+        response, seen = self.handle(RequestFactory().get('/'))
+        self.assertEqual(seen, {'before': 'replica', 'after': 'replica', 'pinned': 'default'})
+        self.assertNotIn(REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_write_pins_the_rest_of_the_request_and_the_next_ones(self, *mocks):
+        response, seen = self.handle(RequestFactory().get('/'), write=True)
+        self.assertEqual((seen['before'], seen['after']), ('replica', 'default'))
+        self.assertIn(REPLICA_PIN_COOKIE, response.cookies)
+        request = RequestFactory().get('/'); request.COOKIES[REPLICA_PIN_COOKIE] = '1'
+        self.assertEqual(self.handle(request)[1]['before'], 'default')
+
+    def test_unsafe_methods_read_from_the_primary(self, *mocks):
+        self.assertEqual(self.handle(RequestFactory().post('/'))[1]['before'], 'default')
+
+
+class FriendshipTests(TestCase):
+    """A friendship is one row per pair, and the cached friend-id sets follow every change to it."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+
+    def post(self, user, **data):
+        self.client.force_login(user)
+        # Each request commits on its own, which is when the cached friend ids are invalidated.
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('my_profile'), data)
+
+    def test_request_accept_and_remove(self):
+        self.post(self.bob, add_friend='1', user_id=self.alice.id)
+        self.assertEqual(friend_ids(self.alice.id), frozenset())
+        friendship = Friendship.objects.get()
+        self.assertEqual((friendship.user_low, friendship.user_high, friendship.requested_by), (self.alice, self.bob, self.bob))
+        self.post(self.alice, accept_request='1', request_id=friendship.id)
+        self.assertEqual(Friendship.objects.get().status, Friendship.Status.ACCEPTED)
+        self.assertEqual((friend_ids(self.alice.id), friend_ids(self.bob.id)), (frozenset({self.bob.id}), frozenset({self.alice.id})))
+        self.assertEqual(self.client.get(reverse('get_seen_movies_page', args=['bob'])).status_code, 200)
+        self.post(self.bob, remove_friend='1', remove_friend_id=self.alice.id)
+        self.assertFalse(Friendship.objects.exists())
+        self.assertEqual(friend_ids(self.alice.id), frozenset())
+
+    def test_adding_someone_who_asked_you_accepts_their_request(self):
+        self.post(self.alice, add_friend='1', user_id=self.bob.id)
+        self.post(self.bob, add_friend='1', user_id=self.alice.id)
+        self.assertEqual(Friendship.objects.get().status, Friendship.Status.ACCEPTED)
+
+    def test_only_the_recipient_can_accept(self):
+        self.post(self.alice, add_friend='1', user_id=self.bob.id)
+        self.assertEqual(self.post(self.alice, accept_request='1', request_id=Friendship.objects.get().id).status_code, 404)
+
+
+class FriendFeedTests(TestCase):
+    """Ratings fan out to every friend's timeline, and reading a timeline is one bounded query."""
+
+    def setUp(self):
+        cache.clear()
+        self.rater, self.friend, self.stranger = (User.objects.create_user(name, password='pw') for name in ('rater', 'friend', 'stranger'))
+        Friendship.objects.create(**Friendship.pair(self.rater, self.friend), requested_by=self.rater, status=Friendship.Status.ACCEPTED)
+        self.movies = Movie.objects.bulk_create([Movie(title=f'Movie {i}', release_year=2000) for i in range(6)])
+
+    def test_saved_and_buffered_ratings_reach_friends_only(self):
+        UserMovieView.objects.create(user=self.rater, movie=self.movies[0], has_seen=True)
+        for movie in self.movies[1:3]: buffer_rating(self.rater.id, movie.id, False)
+        flush_ratings(self.rater)
+        entries, _ = friend_feed_page(self.friend)
+        self.assertEqual([(entry.actor, entry.movie, entry.has_seen) for entry in entries], [(self.rater, self.movies[2], False), (self.rater, self.movies[1], False), (self.rater, self.movies[0], True)])
+        self.assertFalse(FeedEntry.objects.filter(owner__in=[self.rater, self.stranger]).exists())
+
+    def test_feed_page_is_one_query(self):
+        UserMovieView.objects.create(user=self.rater, movie=self.movies[0], has_seen=True)
+        self.client.force_login(self.friend); self.client.get(reverse('get_friend_feed_page'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('get_friend_feed_page'))
+        self.assertIn('Movie 0', response.json()['html'])
+        self.assertEqual(len([query for query in queries if 'tracker_feedentry' in query['sql']]), 1)
+
+    @mock.patch('tracker.feed.FEED_LENGTH', 3)
+    def test_timelines_are_trimmed_and_dropped_with_the_friendship(self):
+        for movie in self.movies: UserMovieView.objects.create(user=self.rater, movie=movie, has_seen=True); cache.delete(f'feed_trim:{self.rater.id}')
+        self.assertEqual(FeedEntry.objects.filter(owner=self.friend).count(), 3)
+        Friendship.objects.get().delete()
+        self.assertFalse(FeedEntry.objects.exists())
+
+
+class CompatibilityTests(TestCase):
+    """Seen bitmaps follow every kind of rating write and score friends without loading their histories."""
+
+    def setUp(self):
+        cache.clear()
+        self.me, self.close, self.distant, self.stranger = (User.objects.create_user(name, password='pw') for name in ('me', 'close', 'distant', 'stranger'))
+        for friend in (self.close, self.distant): Friendship.objects.create(**Friendship.pair(self.me, friend), requested_by=self.me, status=Friendship.Status.ACCEPTED)
+        self.movies = Movie.objects.bulk_create([Movie(title=f'Movie {i}', release_year=2000) for i in range(6)])
+
+    def rate(self, user, indexes, has_seen=True):
+        for i in indexes: UserMovieView.objects.create(user=user, movie=self.movies[i], has_seen=has_seen)
+
+    def test_bitmaps_follow_saves_toggles_deletes_and_buffered_swipes(self):
+        self.rate(self.me, [0, 1]); self.rate(self.me, [2], has_seen=False)
+        self.assertEqual(sorted(movie_ids(seen_bitmap(self.me.id))), sorted(m.id for m in self.movies[:2]))
+        # Each write commits on its own, which is when the cached bitmap is dropped.
+        with self.captureOnCommitCallbacks(execute=True):
+            view = UserMovieView.objects.get(user=self.me, movie=self.movies[2]); view.has_seen = True; view.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            UserMovieView.objects.get(user=self.me, movie=self.movies[0]).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            buffer_rating(self.me.id, self.movies[3].id, True); flush_ratings(self.me)
+        expected = sorted(m.id for m in self.movies[1:4])
+        self.assertEqual(sorted(movie_ids(seen_bitmap(self.me.id))), expected)
+        rebuild_seen_bitmaps([self.me.id])
+        self.assertEqual(sorted(movie_ids(seen_bitmap(self.me.id))), expected)
+
+    def test_cached_bitmap_is_dropped_only_on_commit(self):
+        self.rate(self.me, [0]); seen_bitmap(self.me.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.rate(self.me, [1])
+            # Until the rating commits, other requests keep reading the committed bitmap.
+            self.assertEqual(movie_ids(seen_bitmap(self.me.id)), [self.movies[0].id])
+        for callback in callbacks: callback()
+        self.assertEqual(sorted(movie_ids(seen_bitmap(self.me.id))), sorted(m.id for m in self.movies[:2]))
+
+    def test_friend_scores_and_ranking(self):
+        self.rate(self.me, [0, 1, 2]); self.rate(self.close, [0, 1, 2, 3]); self.rate(self.distant, [2, 4, 5])
+        self.client.force_login(self.me)
+        data = self.client.get(reverse('friend_compatibility', args=['close'])).json()
+        self.assertEqual((data['overlap'], data['jaccard'], data['seen_by_them_only']), (3, 0.75, 1))
+        self.assertEqual([movie['title'] for movie in data['seen_by_them_not_you']], ['Movie 3'])
+        ranking = self.client.get(reverse('friend_compatibility_ranking')).json()['friends']
+        self.assertEqual([(row['username'], row['overlap']) for row in ranking], [('close', 3), ('distant', 1)])
+        self.assertEqual(self.client.get(reverse('friend_compatibility', args=['stranger'])).status_code, 403)
@@ -0,0 +1,192 @@
+# tracker/tmdb.py
+
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Configuration ---
+TMDB_API_KEY = os.getenv("TMDB_API_KEY")
+# Overridable so the ingestion commands can be pointed at a local fake TMDb server.
+TMDB_BASE_URL = os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3")
+# TMDb allows roughly 50 requests/second per IP; stay a little under it by default.
+TMDB_REQUESTS_PER_SECOND = float(os.getenv("TMDB_REQUESTS_PER_SECOND", 40))
+TMDB_WORKERS = int(os.getenv("TMDB_WORKERS", 8))
+REQUEST_TIMEOUT = 15
+MAX_RETRIES = 5
+
+
+class TMDbError(Exception):
+    """Raised when TMDb can't give us a usable response after retries."""
+
+class TMDbNotFound(TMDbError):
+    """The requested TMDb resource does not exist (HTTP 404)."""
+
+class TMDbAuthError(TMDbError):
+    """The API key was rejected (HTTP 401/403); nothing else will succeed either."""
+
+
+def retry_after_seconds(value, default=5.0):
+    """Seconds to wait from a Retry-After header, which may be delay-seconds or an HTTP-date (RFC 9110)."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every worker of a client. A Retry-After from TMDb pauses
+    the whole bucket, so all workers back off together instead of each one tripping the limit.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class TMDbClient:
+    """
+    Pooled TMDb HTTP client. `get` is safe to call from several threads; `fetch_many` runs a bounded
+    pool of worker threads and hands their results back to the calling thread through a queue, so
+    all database writes stay on the caller's connection.
+    """
+
+    def __init__(self, api_key=None, base_url=None, requests_per_second=None, workers=None):
+        self.api_key = api_key or TMDB_API_KEY
+        self.base_url = (base_url or TMDB_BASE_URL).rstrip('/')
+        self.workers = workers or TMDB_WORKERS
+        self.bucket = TokenBucket(requests_per_second or TMDB_REQUESTS_PER_SECOND)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, path, **params):
+        """GETs a TMDb path (e.g. '/movie/550') and returns the decoded JSON body."""
+        return self._get(path, params)[0]
+
+    def get_if_changed(self, path, etag=None, **params):
+        """Like get, but conditional on `etag`; returns (data, etag) with data None if TMDb answers 304."""
+        return self._get(path, params, etag)
+
+    def _get(self, path, params, etag=None):
+        url = f"{self.base_url}{path}"
+        params = {'api_key': self.api_key, **params}
+        headers = {'If-None-Match': etag} if etag else {}
+        for attempt in range(MAX_RETRIES):
+            self.bucket.acquire()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                if attempt == MAX_RETRIES - 1:
+                    raise TMDbError(f"Connection error for {path}: {e}") from e
+                time.sleep(2 ** attempt)
+                continue
+
+            if response.status_code == 304:
+                return None, etag
+            if response.status_code == 429:
+                self.bucket.pause(retry_after_seconds(response.headers.get('Retry-After')) + 1)
+                continue
+            if response.status_code == 404:
+                raise TMDbNotFound(f"{path} not found on TMDb")
+            if response.status_code in (401, 403):
+                raise TMDbAuthError(f"TMDb rejected the API key (status {response.status_code})")
+            if response.status_code >= 500:
+                time.sleep(2 ** attempt)
+                continue
+            if response.status_code != 200:
+                raise TMDbError(f"Unexpected status {response.status_code} for {path}")
+            try:
+                return response.json(), response.headers.get('ETag')
+            except ValueError as e:
+                raise TMDbError(f"Invalid JSON from TMDb for {path}") from e
+        raise TMDbError(f"Gave up on {path} after {MAX_RETRIES} attempts")
+
+    def fetch_many(self, jobs):
+        """
+        Fetches `jobs` — an iterable of (key, path, params) — concurrently and yields
+        (key, data, error) in completion order. `error` is a TMDbError or None; any other exception
+        raised while fetching is handed back wrapped in a TMDbError, so a worker never dies without
+        reporting. The job iterable is consumed from the worker threads, so it must not touch the database.
+        """
+        jobs = iter(jobs)
+        job_lock = threading.Lock()
+        stop = threading.Event()
+        results = queue.Queue(maxsize=self.workers * 2)
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def worker():
+            # `done` is always sent, or the consumer below would wait for this worker forever.
+            try:
+                while not stop.is_set():
+                    with job_lock:
+                        job = next(jobs, None)
+                    if job is None:
+                        break
+                    key, path, params = job
+                    try:
+                        put((key, self.get(path, **params), None))
+                    except TMDbError as e:
+                        put((key, None, e))
+                    except Exception as e:
+                        put((key, None, TMDbError(f"Unexpected error fetching {path}: {e!r}")))
+            finally:
+                put(done)
+
+        threads = [threading.Thread(target=worker, daemon=True, name=f'tmdb-fetch-{i}') for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            finished = 0
+            while finished < len(threads):
+                item = results.get()
+                if item is done:
+                    finished += 1
+                else:
+                    yield item
+        finally:
+            stop.set()
@@ -0,0 +1,102 @@
+# tracker/unseen_queue.py
+
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from .caching import cache_lock, CacheLockBusy
+from .metrics import mark_cold
+from .models import Movie
+from .sampling import filtered_unseen_movies, unseen_movies_for, sample_weighted_movie_ids
+
+# Per-user queue of pre-picked unseen movie ids, one queue per (genre, person) filter combination.
+# The rating page pops the head; when the queue runs low it is topped up in the background.
+QUEUE_SIZE = getattr(settings, 'UNSEEN_QUEUE_SIZE', 20)
+QUEUE_LOW_WATER = getattr(settings, 'UNSEEN_QUEUE_LOW_WATER', 5)
+QUEUE_TIMEOUT = getattr(settings, 'UNSEEN_QUEUE_TIMEOUT', 60 * 60)
+REFILL_IN_BACKGROUND = getattr(settings, 'UNSEEN_QUEUE_REFILL_IN_BACKGROUND', True)
+# Every read-modify-write of a queue (a pop, or merging a refill in) holds its lock, so a pop and a
+# refill can't overwrite each other's result. A request that can't get it within this many seconds
+# picks a movie without the queue.
+QUEUE_LOCK_TIMEOUT = 2
+
+_refill_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='unseen-queue-refill')
+
+
+def _queue_key(user_id, genre_id, person_query):
+    person_digest = hashlib.md5(person_query.lower().encode()).hexdigest() if person_query else ''
+    return f"unseen_queue:{user_id}:{genre_id or ''}:{person_digest}"
+
+
+def refill_queue(user, genre_id=None, person_query='', skip_ids=()):
+    """
+    Tops the user's queue up to QUEUE_SIZE with a fresh weighted batch; returns the new queue.
+    `skip_ids` are movies rated but not written yet (see rating_buffer).
+    """
+    key = _queue_key(user.id, genre_id, person_query)
+    queued = cache.get(key) or []
+    if len(queued) >= QUEUE_SIZE: return queued
+    mark_cold('queue refill')
+    # Sampled unlocked, then merged into the queue as it is now, so ids popped meanwhile are not put back.
+    fresh = sample_weighted_movie_ids(filtered_unseen_movies(user, genre_id, person_query), QUEUE_SIZE - len(queued), exclude_ids=[*queued, *skip_ids])
+    with cache_lock(key, QUEUE_LOCK_TIMEOUT):
+        queued = cache.get(key) or []
+        queued += [movie_id for movie_id in fresh if movie_id not in queued]
+        cache.set(key, queued, QUEUE_TIMEOUT)
+    return queued
+
+
+def _background_refill(user, genre_id, person_query, skip_ids, lock_key):
+    try:
+        refill_queue(user, genre_id, person_query, skip_ids)
+    except CacheLockBusy:
+        pass  # The queue is in use; the next low-water pop schedules another refill.
+    finally:
+        cache.delete(lock_key)
+        connection.close()
+
+
+def schedule_refill(user, genre_id=None, person_query='', skip_ids=()):
+    """Queues a background refill unless one is already running for this queue."""
+    lock_key = _queue_key(user.id, genre_id, person_query) + ':refilling'
+    if not cache.add(lock_key, True, 60): return
+    if REFILL_IN_BACKGROUND:
+        _refill_executor.submit(_background_refill, user, genre_id, person_query, skip_ids, lock_key)
+    else:
+        try: refill_queue(user, genre_id, person_query, skip_ids)
+        except CacheLockBusy: pass # As in _background_refill: the next low-water pop tries again.
+        finally: cache.delete(lock_key)
+
+
+def _pop_unseen(user, key, skip_ids):
+    """Pops ids off the queue until one is still unseen; returns (movie or None, ids left in the queue)."""
+    with cache_lock(key, QUEUE_LOCK_TIMEOUT):
+        queued = cache.get(key) or []; movie = None
+        while queued and movie is None:
+            movie_id = queued.pop(0)
+            if movie_id not in skip_ids: movie = unseen_movies_for(user).filter(id=movie_id).first()
+        if queued: cache.set(key, queued, QUEUE_TIMEOUT)
+        else: cache.delete(key)
+    return movie, len(queued)
+
+
+def next_unseen_movie(user, genre_id=None, person_query='', skip_ids=()):
+    """
+    Pops the next movie from the user's queue. Each popped id is re-checked against the user's
+    ratings (one primary-key lookup) so a movie rated on another device is skipped, as are the
+    buffered, not yet written ratings in `skip_ids`. Only an empty or fully stale queue is refilled
+    inline; a low queue is refilled in the background.
+    """
+    key = _queue_key(user.id, genre_id, person_query); skip_ids = set(skip_ids)
+    try:
+        movie, left = _pop_unseen(user, key, skip_ids)
+        if movie is None:
+            refill_queue(user, genre_id, person_query, skip_ids)
+            movie, left = _pop_unseen(user, key, skip_ids)
+    except CacheLockBusy:
+        # Another request holds the queue: serve a fresh pick rather than wait on it.
+        picked = sample_weighted_movie_ids(filtered_unseen_movies(user, genre_id, person_query), 1, exclude_ids=skip_ids)
+        return Movie.objects.filter(id__in=picked).first()
+    if movie is not None and left < QUEUE_LOW_WATER: schedule_refill(user, genre_id, person_query, skip_ids)
+    return movie
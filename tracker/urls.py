@@ -18,10 +18,16 @@ urlpatterns = [
     path('api/update-account-details/', views.update_account_details, name='update_account_details'),
     # --- END NEW URLS ---
 
-    path('api/last-rated-page/<int:page>/', views.get_last_rated_page, name='get_last_rated_page'),
-    path('api/seen-movies-page/<str:username>/<int:page>/', views.get_seen_movies_page, name='get_seen_movies_page'),
+    path('api/last-rated/', views.get_last_rated_page, name='get_last_rated_page'),
+    path('api/friend-feed/', views.get_friend_feed_page, name='get_friend_feed_page'),
+    path('api/compatibility/', views.friend_compatibility_ranking, name='friend_compatibility_ranking'),
+    path('api/compatibility/<str:username>/', views.friend_compatibility, name='friend_compatibility'),
+    path('api/seen-movies/<str:username>/', views.get_seen_movies_page, name='get_seen_movies_page'),
     path('api/update-rating/', views.update_rating, name='update_rating'),
+    path('api/rate/', views.rate_movie_api, name='rate_movie_api'),
     path('movie/<int:movie_id>/', views.movie_detail_view, name='movie_detail'),
+    path('api/cache-stats/', views.cache_stats_view, name='cache_stats'),
+    path('metrics/', views.metrics_view, name='metrics'),
 
     path('about/', views.about_view, name='about'),
 ]
\ No newline at end of file
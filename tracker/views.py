@@ -1,36 +1,51 @@
 # tracker/views.py
 
-import random
 import json
-from django.db.models import Q
+from django.db.models import Q, Exists, OuterRef, Prefetch
 from django.contrib.auth.models import User
 from django.shortcuts import render, redirect, get_object_or_404, reverse
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.urls import reverse_lazy
 from django.views.generic.edit import CreateView
 from django.db import transaction, IntegrityError
 from django.utils import timezone
 from django.conf import settings
-from django.contrib.postgres.search import TrigramSimilarity
-from .models import Movie, UserMovieView, Profile, Genre, InviteCode, Friendship, MovieCastCredit
+from .models import Movie, UserMovieView, Profile, InviteCode, Friendship, rebuild_credits_summaries, touch_last_activity
 from .forms import CustomUserCreationForm, ProfileUpdateForm
-from .signals import milestone_reached
-from django.http import JsonResponse, HttpResponseBadRequest
+from .signals import milestone_reached, is_rating_milestone
+from .unseen_queue import next_unseen_movie
+from .rating_buffer import buffer_rating, buffered_ratings, flush_due, flush_ratings, BufferBusy
+from .pagination import keyset_page
+from .feed import friend_feed_page
+from .seen_sets import seen_bitmaps, compatibility, movie_ids
+from .metrics import prometheus_sink
+from .caching import cached_fragment, cache_stats, reset_cache_stats, genre_list, friend_ids, movie_scope, user_scope, CATALOGUE_SCOPE
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, Http404
 from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from django.contrib.auth import login, logout
 from django.contrib import messages
 
+SEEN_PAGE_SIZE = 12
+LAST_RATED_PAGE_SIZE = 10
+# "Recently Rated" only ever pages through the newest ratings.
+LAST_RATED_LIMIT = 20
+# How many "seen by them, not by you" movies the compatibility API lists.
+COMPATIBILITY_LIST_SIZE = 20
+
+
+def seen_movies_for(owner, viewer=None):
+    """
+    The owner's seen movies for the poster grid. With a viewer, each row is annotated with
+    viewer_has_seen via a correlated EXISTS on the viewer's (user, movie) index, so only the
+    rows on the page are checked rather than loading the viewer's whole history.
+    """
+    seen_movies = UserMovieView.objects.filter(user=owner, has_seen=True).select_related('movie')
+    if viewer is None: return seen_movies
+    return seen_movies.annotate(viewer_has_seen=Exists(UserMovieView.objects.filter(user=viewer, has_seen=True, movie_id=OuterRef('movie_id'))))
 
-def get_weighted_random_movie(unseen_movies):
-    tiers = { "tentpole": (300_000_000, None), "major": (75_000_000, 300_000_000), "mid": (10_000_000, 75_000_000), "low": (1_000_000, 10_000_000), "micro": (None, 1_000_000), }
-    tier_weights = {"tentpole": 45, "major": 30, "mid": 15, "low": 7, "micro": 3}
-    if not unseen_movies.exists(): return None
-    chosen_tier_name = random.choices(list(tiers.keys()), weights=list(tier_weights.values()), k=1)[0]
-    min_rev, max_rev = tiers[chosen_tier_name]
-    movie_query = unseen_movies
-    if min_rev is not None: movie_query = movie_query.filter(revenue__gte=min_rev)
-    if max_rev is not None: movie_query = movie_query.filter(revenue__lt=max_rev)
-    return movie_query.order_by('?').first()
 
 class SignUpView(CreateView):
     form_class = CustomUserCreationForm
@@ -56,7 +71,6 @@ class SignUpView(CreateView):
             user.last_name = form.cleaned_data.get('last_name')
             user.profile.date_of_birth = form.cleaned_data.get('date_of_birth')
             user.save()
-            user.profile.save()
             messages.success(self.request, "Welcome back! Your account has been reactivated.")
             login(self.request, user)
             return redirect('next_movie')
@@ -67,17 +81,17 @@ class SignUpView(CreateView):
 
 @login_required
 def next_movie_view(request):
-    user = request.user
+    user = request.user; flush_ratings(user, request)
     if request.method == 'POST':
         movie_id = request.POST.get('movie_id'); has_seen_status = request.POST.get('has_seen') == 'True'; movie = get_object_or_404(Movie, id=movie_id)
         try:
             with transaction.atomic():
                 _, created = UserMovieView.objects.get_or_create(user=user, movie=movie, defaults={'has_seen': has_seen_status})
                 if created:
-                    total_rated = UserMovieView.objects.filter(user=user).count()
-                    if total_rated == 250 or (total_rated > 250 and (total_rated - 250) % 100 == 0):
+                    total_rated = Profile.objects.filter(user=user).values_list('total_rated', flat=True).first() or 0
+                    if is_rating_milestone(total_rated):
                         milestone_reached.send(sender=user.__class__, user=user, total_rated=total_rated, request=request)
-                profile = user.profile; profile.last_activity = timezone.now(); profile.save()
+                touch_last_activity(user.id)
         except IntegrityError: pass
         redirect_url = reverse('next_movie')
         genre_id = request.POST.get('genre'); person_query = request.POST.get('person_query', '').strip(); params = []
@@ -85,67 +99,104 @@ def next_movie_view(request):
         if person_query: params.append(f'person_query={person_query}')
         if params: redirect_url += '?' + '&'.join(params)
         return redirect(redirect_url)
-    viewed_movie_ids = UserMovieView.objects.filter(user=user).values_list('movie_id', flat=True); unseen_movies = Movie.objects.exclude(id__in=viewed_movie_ids)
     genre_id = request.GET.get('genre'); person_query = request.GET.get('person_query', '').strip()
-    if genre_id: unseen_movies = unseen_movies.filter(genre__id=genre_id)
-    if person_query: unseen_movies = unseen_movies.filter(Q(actors__name__icontains=person_query) | Q(directors__name__icontains=person_query) | Q(producers__name__icontains=person_query) | Q(cinematographers__name__icontains=person_query)).distinct()
-    next_movie = get_weighted_random_movie(unseen_movies)
-    if not next_movie: next_movie = unseen_movies.order_by('?').first()
-    total_seen_movies = UserMovieView.objects.filter(user=user, has_seen=True).count()
-    context = { 'page_context': 'rating', 'total_seen_movies': total_seen_movies, 'all_genres': Genre.objects.all().order_by('name'), 'active_genre_id': int(genre_id) if genre_id else None, 'active_person_query': person_query, }
+    next_movie = next_unseen_movie(user, genre_id, person_query)
+    context = { 'page_context': 'rating', 'total_seen_movies': user.profile.total_seen, 'all_genres': genre_list(), 'active_genre_id': int(genre_id) if genre_id else None, 'active_person_query': person_query, }
     if next_movie: context['movie'] = next_movie
     else: context['no_movies_left'] = True
     return render(request, 'tracker/movie_display.html', context)
 
+def movie_payload(movie):
+    """What the rating card shows, for the JSON rating API."""
+    return {'id': movie.id, 'title': movie.title, 'release_year': movie.release_year, 'plot_summary': movie.plot_summary, 'poster_url': movie.poster_url,
+            'genres': [genre.name for genre in movie.genre.all()]}
+
+@login_required
+def rate_movie_api(request):
+    """
+    JSON swipe: buffers the rating (see rating_buffer) and answers with the next movie, so the rating
+    page never reloads. Most swipes cost a handful of reads and no writes at all.
+    """
+    if request.method != 'POST': return HttpResponseBadRequest("Only POST method is allowed")
+    try:
+        data = json.loads(request.body); movie_id = int(data['movie_id']); has_seen = bool(data['has_seen'])
+        genre_id = int(data['genre']) if data.get('genre') else None; person_query = str(data.get('person_query') or '').strip()
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError): return HttpResponseBadRequest("Invalid request")
+    if not Movie.objects.filter(id=movie_id).exists(): raise Http404("No such movie")
+    user = request.user
+    # The page falls back to the plain form post on any error, so a stuck buffer never drops the swipe.
+    try: pending = buffer_rating(user.id, movie_id, has_seen)
+    except BufferBusy: return JsonResponse({'error': 'Busy, try again'}, status=503)
+    if flush_due(pending): flush_ratings(user, request); pending = buffered_ratings(user.id)
+    touch_last_activity(user.id)
+    next_movie = next_unseen_movie(user, genre_id, person_query, skip_ids=[entry[0] for entry in pending])
+    total_seen = (Profile.objects.filter(user=user).values_list('total_seen', flat=True).first() or 0) + sum(seen for _, seen, _ in pending)
+    return JsonResponse({'movie': movie_payload(next_movie) if next_movie else None, 'total_seen_movies': total_seen, 'messages': [str(message) for message in messages.get_messages(request)]})
+
+def friendship_state(viewer, other):
+    """
+    Resolves how `viewer` relates to `other`: friends are a lookup in the viewer's cached friend-id set,
+    anyone else costs one query for the pair's row. Returns (status, id of the pending request `other` sent, or None).
+    """
+    if other.id in friend_ids(viewer.id): return 'FRIENDS', None
+    pending = Friendship.objects.filter(**Friendship.pair(viewer, other), status=Friendship.Status.PENDING).values_list('id', 'requested_by_id').first()
+    if pending is None: return 'NOT_FRIENDS', None
+    return ('REQUEST_SENT', None) if pending[1] == viewer.id else ('REQUEST_RECEIVED', pending[0])
+
+def accept_friendship(friendship):
+    friendship.status = Friendship.Status.ACCEPTED; friendship.accepted_at = timezone.now(); friendship.save(update_fields=['status', 'accepted_at'])
+
 @login_required
 def profile_view(request, username=None):
-    current_user = request.user
-    profile_owner = get_object_or_404(User, username=username, is_active=True) if username else current_user
-    is_self = (current_user == profile_owner)
+    current_user = request.user; flush_ratings(current_user, request)
+    is_self = not username or username == current_user.username
+    # The owner is loaded with their profile; on your own profile, the invite codes come along as a prefetch.
+    owner_query = User.objects.select_related('profile')
+    if is_self and request.method != 'POST': owner_query = owner_query.prefetch_related(Prefetch('generated_codes', queryset=InviteCode.objects.order_by('created_at'), to_attr='invite_codes'))
+    profile_owner = get_object_or_404(owner_query, username=username, is_active=True) if username else get_object_or_404(owner_query, pk=current_user.pk)
     if request.method == 'POST':
         next_url = request.POST.get('next_url', reverse('my_profile'))
+        # Requests addressed to the current user: pending rows of their pairs that someone else asked for.
+        received = Friendship.objects.filter(Friendship.involving(current_user), status=Friendship.Status.PENDING).exclude(requested_by=current_user)
         if 'add_friend' in request.POST:
-            user_id = request.POST.get('user_id'); to_user = get_object_or_404(User, id=user_id); Friendship.objects.get_or_create(from_user=current_user, to_user=to_user)
+            user_id = request.POST.get('user_id'); to_user = get_object_or_404(User, id=user_id)
+            if to_user != current_user:
+                friendship, created = Friendship.objects.get_or_create(**Friendship.pair(current_user, to_user), defaults={'requested_by': current_user})
+                # Adding someone who has already asked you accepts their request.
+                if friendship.status == Friendship.Status.PENDING and friendship.requested_by_id == to_user.id: accept_friendship(friendship)
             return redirect(next_url)
         elif 'accept_request' in request.POST:
-            request_id = request.POST.get('request_id'); friend_request = get_object_or_404(Friendship, id=request_id, to_user=current_user)
-            with transaction.atomic():
-                friend_request.status = Friendship.Status.ACCEPTED; friend_request.accepted_at = timezone.now(); friend_request.save()
-                Friendship.objects.update_or_create(from_user=current_user, to_user=friend_request.from_user, defaults={'status': Friendship.Status.ACCEPTED, 'accepted_at': timezone.now()})
+            request_id = request.POST.get('request_id'); accept_friendship(get_object_or_404(received, id=request_id))
             return redirect(next_url)
         elif 'decline_request' in request.POST:
-            request_id = request.POST.get('request_id'); friend_request = get_object_or_404(Friendship, id=request_id, to_user=current_user); friend_request.delete()
+            request_id = request.POST.get('request_id'); friend_request = get_object_or_404(received, id=request_id); friend_request.delete()
             return redirect(next_url)
         elif 'cancel_request' in request.POST:
-            request_id = request.POST.get('request_id'); friend_request = get_object_or_404(Friendship, id=request_id, from_user=current_user); friend_request.delete()
+            request_id = request.POST.get('request_id'); friend_request = get_object_or_404(Friendship, id=request_id, requested_by=current_user, status=Friendship.Status.PENDING); friend_request.delete()
             return redirect(next_url)
         elif 'remove_friend' in request.POST:
             friend_id_to_remove = request.POST.get('remove_friend_id')
             if friend_id_to_remove:
                 friend_to_remove = get_object_or_404(User, id=friend_id_to_remove)
-                Friendship.objects.filter((Q(from_user=current_user) & Q(to_user=friend_to_remove)) | (Q(from_user=friend_to_remove) & Q(to_user=current_user))).delete()
+                Friendship.objects.filter(**Friendship.pair(current_user, friend_to_remove)).delete()
             return redirect(next_url)
-    context = { 'profile_owner': profile_owner, 'profile': profile_owner.profile, 'is_self': is_self, 'total_seen_movies': UserMovieView.objects.filter(user=profile_owner, has_seen=True).count(), 'friendship_status': None, }
+    context = { 'profile_owner': profile_owner, 'profile': profile_owner.profile, 'is_self': is_self, 'total_seen_movies': profile_owner.profile.total_seen, 'friendship_status': None, }
     if not is_self:
-        if Friendship.objects.filter(from_user=current_user, to_user=profile_owner, status='ACCEPTED').exists(): context['friendship_status'] = 'FRIENDS'
-        else:
-            received_request = Friendship.objects.filter(from_user=profile_owner, to_user=current_user, status='PENDING').first()
-            if received_request: context['friendship_status'] = 'REQUEST_RECEIVED'; context['request_obj'] = received_request
-            elif Friendship.objects.filter(from_user=current_user, to_user=profile_owner, status='PENDING').exists(): context['friendship_status'] = 'REQUEST_SENT'
-            else: context['friendship_status'] = 'NOT_FRIENDS'
+        context['friendship_status'], received_request_id = friendship_state(current_user, profile_owner)
+        if received_request_id: context['request_obj'] = {'id': received_request_id}
     if is_self or context['friendship_status'] == 'FRIENDS' or context['friendship_status'] == 'REQUEST_RECEIVED':
-        context['total_rated_movies'] = UserMovieView.objects.filter(user=profile_owner).count()
+        context['total_rated_movies'] = profile_owner.profile.total_rated
     if is_self or context['friendship_status'] == 'FRIENDS':
-        seen_movies_query = UserMovieView.objects.filter(user=profile_owner, has_seen=True).select_related('movie').order_by('-date_recorded');
-        context['seen_movies_list'] = seen_movies_query[:12]; context['total_seen_for_paging'] = seen_movies_query.count()
-        # If viewing a friend's profile, get the current user's seen movies to compare
-        if not is_self:
-            context['viewer_seen_movie_ids'] = set(UserMovieView.objects.filter(user=current_user, has_seen=True).values_list('movie_id', flat=True))
+        context['seen_movies_list'], context['seen_next_cursor'] = keyset_page(seen_movies_for(profile_owner, None if is_self else current_user), None, SEEN_PAGE_SIZE)
+        context['compare_with_viewer'] = not is_self
     if is_self:
-        last_rated = UserMovieView.objects.filter(user=current_user).select_related('movie').order_by('-date_recorded');
-        context['last_rated_movies'] = last_rated[:10]; context['total_last_rated'] = min(last_rated.count(), 20)
-        invited_friend_ids = set(InviteCode.objects.filter(generated_by=current_user, used_by__isnull=False).values_list('used_by_id', flat=True))
-        context.update({ 'available_codes': InviteCode.objects.filter(generated_by=current_user, used_by__isnull=True), 'friends_list': Friendship.objects.filter(from_user=current_user, status='ACCEPTED', to_user__is_active=True).select_related('to_user'), 'incoming_requests': Friendship.objects.filter(to_user=current_user, status='PENDING', from_user__is_active=True).select_related('from_user'), 'sent_requests': Friendship.objects.filter(from_user=current_user, status='PENDING', to_user__is_active=True).select_related('to_user'), 'invited_friend_ids': invited_friend_ids, })
+        context['last_rated_movies'], context['last_rated_next_cursor'] = keyset_page(UserMovieView.objects.filter(user=current_user).select_related('movie'), None, LAST_RATED_PAGE_SIZE, limit=LAST_RATED_LIMIT)
+        # Every friendship of the owner in one query; `friend` is the other user of the pair.
+        friendships = list(Friendship.objects.filter(Q(user_low=current_user, user_high__is_active=True) | Q(user_high=current_user, user_low__is_active=True)).select_related('user_low', 'user_high').order_by('created_at'))
+        for friendship in friendships: friendship.friend = friendship.user_high if friendship.user_low_id == current_user.id else friendship.user_low
+        pending = [f for f in friendships if f.status == Friendship.Status.PENDING]; codes = profile_owner.invite_codes
+        context['feed_entries'], context['feed_next_cursor'] = friend_feed_page(current_user)
+        context.update({ 'available_codes': [code for code in codes if code.used_by_id is None], 'friends_list': [f for f in friendships if f.status == Friendship.Status.ACCEPTED], 'incoming_requests': [f for f in pending if f.requested_by_id != current_user.id], 'sent_requests': [f for f in pending if f.requested_by_id == current_user.id], 'invited_friend_ids': {code.used_by_id for code in codes if code.used_by_id is not None}, })
     return render(request, 'tracker/profile_dashboard.html', context)
 
 @login_required
@@ -157,38 +208,87 @@ def delete_account_view(request):
     return redirect('my_profile')
 
 @login_required
-def get_seen_movies_page(request, username, page):
-    page_size = 12; start_index = (page - 1) * page_size; end_index = start_index + page_size
+def get_seen_movies_page(request, username):
+    flush_ratings(request.user, request)
     user_to_fetch = get_object_or_404(User, username=username, is_active=True)
     is_self = request.user == user_to_fetch
-    is_friend = Friendship.objects.filter(from_user=request.user, to_user=user_to_fetch, status='ACCEPTED').exists()
+    is_friend = not is_self and user_to_fetch.id in friend_ids(request.user.id)
     if not (is_self or is_friend): return JsonResponse({'error': 'Unauthorized'}, status=403)
-    seen_movies = UserMovieView.objects.filter(user=user_to_fetch, has_seen=True).select_related('movie').order_by('-date_recorded')[start_index:end_index]
-    
-    template_context = {'seen_movies_list': seen_movies}
-    if not is_self and is_friend:
-        template_context['viewer_seen_movie_ids'] = set(UserMovieView.objects.filter(user=request.user, has_seen=True).values_list('movie_id', flat=True))
-        
-    html = render_to_string('tracker/partials/seen_movies_grid.html', template_context)
-    return JsonResponse({'html': html})
+    cursor = request.GET.get('cursor') or None
+    # A friend's grid also marks the movies the viewer hasn't seen, so it depends on both users' ratings.
+    viewer_id = request.user.id if not is_self and is_friend else None
+    scopes = [user_scope(user_to_fetch.id), CATALOGUE_SCOPE] + ([user_scope(viewer_id)] if viewer_id else [])
+    def build():
+        seen_movies, next_cursor = keyset_page(seen_movies_for(user_to_fetch, request.user if viewer_id else None), cursor, SEEN_PAGE_SIZE)
+        template_context = {'seen_movies_list': seen_movies, 'compare_with_viewer': bool(viewer_id)}
+        return {'html': render_to_string('tracker/partials/seen_movies_grid.html', template_context), 'next_cursor': next_cursor}
+    try: return JsonResponse(cached_fragment('seen_movies_grid', [user_to_fetch.id, cursor, viewer_id], scopes, build))
+    except ValueError: return HttpResponseBadRequest("Invalid cursor")
 
 @login_required
 def movie_detail_view(request, movie_id):
-    movie = get_object_or_404(Movie.objects.prefetch_related('directors', 'producers', 'cinematographers', 'genre'), id=movie_id)
-    crew = []; top_cast = MovieCastCredit.objects.filter(movie=movie).select_related('actor').order_by('order')[:10]
-    for director in movie.directors.all(): crew.append({'role': 'Director', 'name': director.name})
-    for producer in movie.producers.all(): crew.append({'role': 'Producer', 'name': producer.name})
-    for cine in movie.cinematographers.all(): crew.append({'role': 'Cinematography', 'name': cine.name})
-    context = {'movie': movie, 'crew': crew, 'cast': top_cast}
-    return render(request, 'tracker/movie_detail.html', context)
+    movie = get_object_or_404(Movie, id=movie_id)
+    if movie.credits_updated_at is None: rebuild_credits_summaries([movie.id]); movie.refresh_from_db(fields=['credits_summary', 'credits_updated_at'])
+    # The page only changes when the credits summary is rebuilt; the user id is in the ETag because the navbar is per-user.
+    updated_at = movie.credits_updated_at.timestamp(); etag = f'"movie-{movie.id}-{int(updated_at * 1000000)}-u{request.user.id}"'
+    response = get_conditional_response(request, etag=etag, last_modified=int(updated_at))
+    if response is None:
+        summary = movie.credits_summary; context = {'movie': movie, 'genres': summary.get('genres', []), 'crew': summary.get('crew', []), 'cast': summary.get('cast', [])}
+        card_html = cached_fragment('movie_detail', [movie.id, int(updated_at * 1000000)], [movie_scope(movie.id)], lambda: render_to_string('tracker/partials/movie_detail_card.html', context))
+        response = render(request, 'tracker/movie_detail.html', {'movie': movie, 'movie_card_html': card_html})
+    response['ETag'] = etag; response['Last-Modified'] = http_date(updated_at)
+    patch_cache_control(response, private=True, no_cache=True); patch_vary_headers(response, ['Cookie'])
+    return response
 
 @login_required
-def get_last_rated_page(request, page):
-    page_size = 10; start_index = (page - 1) * page_size; end_index = start_index + page_size
-    if start_index >= 20: return JsonResponse({'html': ''})
-    last_rated = UserMovieView.objects.filter(user=request.user).select_related('movie').order_by('-date_recorded')[start_index:end_index]
-    html = render_to_string('tracker/partials/last_rated_list.html', {'last_rated_movies': last_rated})
-    return JsonResponse({'html': html})
+def get_last_rated_page(request):
+    flush_ratings(request.user, request); cursor = request.GET.get('cursor') or None
+    def build():
+        last_rated, next_cursor = keyset_page(UserMovieView.objects.filter(user=request.user).select_related('movie'), cursor, LAST_RATED_PAGE_SIZE, limit=LAST_RATED_LIMIT)
+        return {'html': render_to_string('tracker/partials/last_rated_list.html', {'last_rated_movies': last_rated}), 'next_cursor': next_cursor}
+    try: return JsonResponse(cached_fragment('last_rated_list', [request.user.id, cursor], [user_scope(request.user.id), CATALOGUE_SCOPE], build))
+    except ValueError: return HttpResponseBadRequest("Invalid cursor")
+
+@login_required
+def get_friend_feed_page(request):
+    # Not cached: the timeline is already precomputed by fan-out on write, so a page is one indexed range read.
+    try: feed_entries, next_cursor = friend_feed_page(request.user, request.GET.get('cursor') or None)
+    except ValueError: return HttpResponseBadRequest("Invalid cursor")
+    return JsonResponse({'html': render_to_string('tracker/partials/friend_feed.html', {'feed_entries': feed_entries}), 'next_cursor': next_cursor})
+
+@login_required
+def friend_compatibility(request, username):
+    """How the viewer's seen movies compare with a friend's, from the two seen bitmaps, plus what the friend has seen that they haven't."""
+    flush_ratings(request.user, request)
+    friend = get_object_or_404(User, username=username, is_active=True)
+    if friend.id not in friend_ids(request.user.id): return JsonResponse({'error': 'Unauthorized'}, status=403)
+    bitmaps = seen_bitmaps([request.user.id, friend.id]); mine, theirs = bitmaps[request.user.id], bitmaps[friend.id]
+    their_only = movie_ids(theirs & ~mine, limit=COMPATIBILITY_LIST_SIZE); movies = Movie.objects.in_bulk(their_only)
+    return JsonResponse({'username': friend.username, **compatibility(mine, theirs),
+                         'seen_by_them_not_you': [{'id': movie.id, 'title': movie.title, 'release_year': movie.release_year, 'poster_url': movie.poster_url} for movie in (movies.get(movie_id) for movie_id in their_only) if movie]})
+
+@login_required
+def friend_compatibility_ranking(request):
+    """All of the viewer's friends ranked by Jaccard similarity of their seen movies, then by overlap."""
+    flush_ratings(request.user, request)
+    friends = dict(User.objects.filter(id__in=friend_ids(request.user.id), is_active=True).values_list('id', 'username'))
+    bitmaps = seen_bitmaps([request.user.id, *friends]); mine = bitmaps.pop(request.user.id)
+    ranking = sorted(({'username': friends[friend_id], **compatibility(mine, theirs)} for friend_id, theirs in bitmaps.items()), key=lambda row: (-row['jaccard'], -row['overlap'], row['username']))
+    return JsonResponse({'friends': ranking})
+
+@staff_member_required
+def cache_stats_view(request):
+    """Hit/miss counters of the fragment cache; POST resets them."""
+    if request.method == 'POST': reset_cache_stats()
+    return JsonResponse({'backend': settings.CACHES['default']['BACKEND'], 'fragments': cache_stats()})
+
+def metrics_view(request):
+    """Prometheus text exposition of the request metrics, when the prometheus sink is enabled."""
+    sink = prometheus_sink()
+    if sink is None: raise Http404("The prometheus metrics sink is not enabled.")
+    token = settings.METRICS_TOKEN
+    if not ((token and request.headers.get('Authorization') == f'Bearer {token}') or request.user.is_staff): return HttpResponse(status=403)
+    return HttpResponse(sink.render(), content_type='text/plain; version=0.0.4')
 
 @login_required
 def update_rating(request):
@@ -197,9 +297,9 @@ def update_rating(request):
             data = json.loads(request.body)
             view_id = data.get('view_id'); new_status = data.get('new_status')
             if view_id is None or new_status is None: return HttpResponseBadRequest("Missing data")
-            view = get_object_or_404(UserMovieView, id=view_id, user=request.user)
+            flush_ratings(request.user, request); view = get_object_or_404(UserMovieView, id=view_id, user=request.user)
             view.has_seen = new_status; view.save()
-            total_seen = UserMovieView.objects.filter(user=request.user, has_seen=True).count()
+            total_seen = Profile.objects.filter(user=request.user).values_list('total_seen', flat=True).first() or 0
             return JsonResponse({'success': True, 'total_seen_movies': total_seen})
         except (json.JSONDecodeError, KeyError): return HttpResponseBadRequest("Invalid request")
     return HttpResponseBadRequest("Only POST method is allowed")